@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+log = logging.getLogger(__name__)
+
+# Query parameters that don't change the page content
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid"}
+TRACKING_PARAM_PREFIXES = ("utm_",)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Called with partial results, see MetadataEnricher.parse_page
+UpdateCallback = Callable[[str, dict[str, Any]], None]
+
+
+def normalize_url(url: str) -> str:
+    """ Returns a canonical form of `url`, so that URLs that refer to the same
+        page share a cache entry: lowercase scheme and host, no default port,
+        no fragment, no tracking parameters and sorted query parameters. """
+    parsed = urllib.parse.urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    if parsed.port and parsed.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parsed.port}"
+    query = sorted(
+        (key, value) for key, value in urllib.parse.parse_qsl(parsed.query, keep_blank_values=True)
+        if key not in TRACKING_PARAMS and not key.startswith(TRACKING_PARAM_PREFIXES))
+    return urllib.parse.urlunsplit(
+        (scheme, host, parsed.path or "/", urllib.parse.urlencode(query), ""))
+
+
+class Computation:
+    """ A result that is being computed, and the update callbacks of the
+        requests that wait for it. """
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.listeners: list[UpdateCallback] = []
+        # The partial results so far, for requests that join later
+        self.updates: list[tuple[str, dict[str, Any]]] = []
+
+    def notify(self, stage: str, fields: dict[str, Any]):
+        self.updates.append((stage, fields))
+        for listener in list(self.listeners):
+            listener(stage, fields)
+
+
+class ResultCache:
+    """ Caches the metadata of recently requested URLs.
+
+        Entries are kept in memory for `ttl` seconds, and the least recently
+        used ones are evicted if there are more than `max_entries`. With a
+        `redis_url`, entries are stored in Redis as well, so they are shared
+        by all workers and survive restarts.
+
+        Concurrent requests for the same URL are coalesced: only the first one
+        computes the result, the others wait for it. Requests that stream
+        partial results get the updates of the computation they wait for.
+
+        Results that were computed with different options (e.g. only some
+        fields) are cached separately, under a different `variant`. """
+
+    def __init__(self, ttl: float = 3600, max_entries: int = 1000, redis_url: str = "",
+                 version: str = "1"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._in_flight: dict[str, Computation] = {}
+        self._stats = {"hits": 0, "misses": 0, "coalesced": 0, "errors": 0}
+        self.redis = None
+        if redis_url:
+            if aioredis is None:
+                raise RuntimeError("CACHE_REDIS_URL is set, but the redis package is not installed.")
+            self.redis = aioredis.Redis.from_url(redis_url)
+
+    def _key(self, url: str, variant: str = "") -> str:
+        name = f"{normalize_url(url)}\0{variant}" if variant else normalize_url(url)
+        h = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return f"metadataapi:result:v{self.version}:{h}"
+
+    async def get(self, url: str, variant: str = "") -> Optional[Any]:
+        """ Returns the cached result for `url`, or None. """
+        key = self._key(url, variant)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if time.time() < expires_at:
+                self._entries.move_to_end(key)
+                return value
+            del self._entries[key]
+        if self.redis is not None:
+            try:
+                data = await self.redis.get(key)
+            except aioredis.RedisError as e:
+                log.warning("Failed to read from the Redis cache: %s", e)
+                return None
+            if data is not None:
+                value = json.loads(data)
+                self._store(key, value)
+                return value
+        return None
+
+    async def lookup(self, url: str, variant: str = "") -> Optional[Any]:
+        """ Like get, but counts a hit in the stats. """
+        value = await self.get(url, variant)
+        if value is not None:
+            self._stats["hits"] += 1
+        return value
+
+    async def set(self, url: str, value: Any, variant: str = ""):
+        """ Caches `value`, which must be JSON-serializable. """
+        key = self._key(url, variant)
+        self._store(key, value)
+        if self.redis is not None:
+            try:
+                await self.redis.set(key, json.dumps(value), ex=max(int(self.ttl), 1))
+            except aioredis.RedisError as e:
+                log.warning("Failed to write to the Redis cache: %s", e)
+
+    def _store(self, key: str, value: Any):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, url: str, compute: Callable[[UpdateCallback], Awaitable[Optional[Any]]],
+                             variant: str = "", on_update: Optional[UpdateCallback] = None) -> Optional[Any]:
+        """ Returns the cached result for `url`, or computes and caches it.
+            `compute` is called with a callback for partial results, which
+            are passed on to the `on_update` of all waiting requests. Results
+            that are None are not cached. """
+        value = await self.lookup(url, variant)
+        if value is not None:
+            return value
+
+        key = self._key(url, variant)
+        computation = self._in_flight.get(key)
+        if computation is not None:
+            self._stats["coalesced"] += 1
+        else:
+            self._stats["misses"] += 1
+            computation = Computation()
+            computation.task = asyncio.create_task(self._compute(url, compute, variant, computation.notify))
+            self._in_flight[key] = computation
+            computation.task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        assert computation.task is not None
+        if on_update is not None:
+            for stage, fields in computation.updates:
+                on_update(stage, fields)
+            computation.listeners.append(on_update)
+        try:
+            # shield: a client that disconnects must not cancel the computation
+            # for the other waiting clients
+            return await asyncio.shield(computation.task)
+        finally:
+            if on_update is not None:
+                computation.listeners.remove(on_update)
+
+    async def _compute(self, url: str, compute: Callable[[UpdateCallback], Awaitable[Optional[Any]]],
+                       variant: str, notify: UpdateCallback) -> Optional[Any]:
+        try:
+            value = await compute(notify)
+        except Exception:
+            self._stats["errors"] += 1
+            raise
+        if value is not None:
+            await self.set(url, value, variant)
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self._stats["hits"] + self._stats["misses"] + self._stats["coalesced"]
+        return {
+            **self._stats,
+            "hit_rate": (self._stats["hits"] + self._stats["coalesced"]) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "in_flight": len(self._in_flight),
+            "backend": "memory+redis" if self.redis is not None else "memory",
+        }
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
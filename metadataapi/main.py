@@ -1,20 +1,39 @@
+import asyncio
+import json
 import logging
 import sys
 from contextlib import asynccontextmanager
+from typing import Any, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Security
+from fastapi import Depends, FastAPI, HTTPException, Request, Security
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security.api_key import APIKeyHeader
-from metadataenricher import env
+from metadataenricher.config import settings_from_env
 from metadataenricher.metadata_enricher import MetadataEnricher
-from pydantic import ValidationError
+from metadataenricher.metrics import format_metric
+from metadataenricher.web_tools import browser_connection, page_semaphore
+from pydantic import BaseModel, ValidationError
 from pydantic_settings import BaseSettings
 
+from cache import ResultCache, UpdateCallback
+
 
 log = logging.getLogger(__name__)
 
 ## Settings
 class Settings(BaseSettings):
     api_key: str
+    # Results are cached per URL for this many seconds (0 disables the cache)
+    cache_ttl: float = 3600
+    cache_max_entries: int = 1000
+    # Optional, to share the cache between workers and restarts
+    cache_redis_url: str = ""
+    # Maximum number of URLs in one /metadata/batch request
+    batch_max_urls: int = 1000
+    # URLs of one /metadata/batch request that are analyzed at the same time.
+    # The browser pages of all requests are limited separately.
+    batch_concurrency: int = 10
 
 try:
     settings = Settings()  # type: ignore
@@ -32,16 +51,43 @@ async def validate_api_key(api_key: str = Security(api_key_header)):
     return None
 
 
-## Logging
+## Lifespan
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """ Set up logging """
+    """ Set up logging, and the enricher that is shared by all requests """
     logging.basicConfig(level=logging.INFO)
     logging.getLogger("uvicorn.error").propagate = False
     logging.getLogger("metadataenricher.web_tools").setLevel(logging.DEBUG)
     logging.getLogger("valuespace_converter.valuespaces").setLevel(logging.INFO)
+
+    # The enricher, its API clients and the vocabularies are created once
+    log.info("Setting up MetadataEnricher")
+    enricher = MetadataEnricher(ai_enabled=True)
+    enricher.setup(settings_from_env())
+    app.state.enricher = enricher
+    app.state.cache = ResultCache(ttl=settings.cache_ttl, max_entries=settings.cache_max_entries,
+                                  redis_url=settings.cache_redis_url)
+
+    # Connect to the browser before the first request arrives
+    try:
+        await browser_connection.get()
+    except Exception as e:  # pylint: disable=broad-except
+        log.warning("Could not connect to the browser yet, retrying on the first request: %s", e)
+
     yield
 
+    enricher.close()
+    await app.state.cache.close()
+    await browser_connection.close()
+
+
+def get_enricher(request: Request) -> MetadataEnricher:
+    return request.app.state.enricher
+
+
+def get_cache(request: Request) -> ResultCache:
+    return request.app.state.cache
+
 
 ## Main app
 app = FastAPI(lifespan=lifespan)
@@ -54,21 +100,234 @@ async def health():
 
 
 @app.get("/metadata")
-async def get_metadata(url: str, dependencies=Depends(validate_api_key)):
+async def get_metadata(url: str, fields: Optional[str] = None, dependencies=Depends(validate_api_key),
+                       enricher: MetadataEnricher = Depends(get_enricher),
+                       cache: ResultCache = Depends(get_cache)):
+    """ Returns the metadata of `url`. `fields` is an optional comma-separated
+        list of the fields to return, as dotted paths (e.g.
+        "lom.general.title,kidra_raw.curriculum"). The AI services that are
+        not needed for these fields are skipped. """
     log.info("Received request for URL: %s", url)
-    log.debug("Creating MetadataEnricher instance")
-    enricher = MetadataEnricher(ai_enabled=True)
-    settings = {
-        'GENERIC_CRAWLER_DB_PATH': env.get("GENERIC_CRAWLER_DB_PATH", allow_null=True),
-        'GENERIC_CRAWLER_USE_LLM_API': env.get_bool("GENERIC_CRAWLER_USE_LLM_API", default=False),
-        'GENERIC_CRAWLER_LLM_API_KEY': env.get("GENERIC_CRAWLER_LLM_API_KEY", default=""),
-        'GENERIC_CRAWLER_LLM_API_BASE_URL': env.get("GENERIC_CRAWLER_LLM_API_BASE_URL",
-                                                    default="https://chat-ai.academiccloud.de/v1"),
-        'GENERIC_CRAWLER_LLM_MODEL': env.get("GENERIC_CRAWLER_LLM_MODEL",
-                                             default="meta-llama-3.1-8b-instruct"),
-    }
-    log.debug("Setting up MetadataEnricher")
-    enricher.setup(settings)
-    log.debug("Analyzing page")
-    result = await enricher.parse_page(url)
+    return await analyze_url(url, enricher, cache, parse_fields(fields))
+
+
+def parse_fields(fields: Optional[str]) -> Optional[list[str]]:
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()] or None
+
+
+def select_fields(result: dict, fields: list[str]) -> dict:
+    """ Returns the parts of `result` at the given dotted paths. """
+    selected: dict[str, Any] = {}
+    for field in fields:
+        *parents, name = field.split(".")
+        value: Any = result
+        for key in field.split("."):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = selected
+            for key in parents:
+                target = target.setdefault(key, {})
+            target[name] = value
+    return selected
+
+
+def result_variant(enricher: MetadataEnricher, fields: Optional[list[str]]) -> tuple[Optional[set[str]], str]:
+    """ Returns the AI stages needed for `fields`, and the cache variant of
+        results that were computed with only these stages. """
+    if not fields:
+        return None, ""
+    stages = enricher.stages_for_fields(fields)
+    if stages == enricher.stage_fields.keys():
+        return stages, ""
+    return stages, "stages=" + ",".join(sorted(stages))
+
+
+async def get_cached(url: str, enricher: MetadataEnricher, cache: ResultCache,
+                     fields: Optional[list[str]] = None):
+    """ Returns the cached metadata of `url` (only `fields`, if given), or None. """
+    if settings.cache_ttl <= 0:
+        return None
+    # A complete result can be used for any fields
+    result = await cache.lookup(url)
+    if result is None:
+        _, variant = result_variant(enricher, fields)
+        if variant:
+            result = await cache.lookup(url, variant)
+    if fields and result is not None:
+        return select_fields(result, fields)
     return result
+
+
+async def parse_page(url: str, enricher: MetadataEnricher, on_update: UpdateCallback,
+                     stages: Optional[set[str]] = None):
+    """ Renders and enriches the page, returns the JSON-compatible result. """
+    # The LLM token budget applies to each request
+    item = await enricher.parse_page(url, on_update=on_update, stages=stages,
+                                     token_budget=enricher.new_token_budget())
+    return jsonable_encoder(item)
+
+
+async def analyze_url(url: str, enricher: MetadataEnricher, cache: ResultCache,
+                      fields: Optional[list[str]] = None):
+    """ Returns the metadata of `url`, from the cache if possible. If `fields`
+        is given, only these fields are returned and computed. """
+    cached = await get_cached(url, enricher, cache, fields)
+    if cached is not None:
+        return cached
+    stages, variant = result_variant(enricher, fields)
+
+    async def analyze(notify: UpdateCallback):
+        log.debug("Analyzing page %s (stages: %s)", url, "all" if stages is None else sorted(stages))
+        return await parse_page(url, enricher, notify, stages)
+
+    if settings.cache_ttl > 0:
+        result = await cache.get_or_compute(url, analyze, variant)
+    else:
+        result = await analyze(lambda stage, fields: None)
+    if fields and result is not None:
+        return select_fields(result, fields)
+    return result
+
+
+@app.get("/metadata/stream")
+async def get_metadata_stream(url: str, dependencies=Depends(validate_api_key),
+                              enricher: MetadataEnricher = Depends(get_enricher),
+                              cache: ResultCache = Depends(get_cache)):
+    """ Like /metadata, but returns newline-delimited JSON with partial
+        results as soon as they are known: first the metadata found in the
+        page itself ({"stage": "page", "fields": {...}}), then one line per AI
+        service ("llm", "curriculum", "statistics", "disciplines"). The last
+        line is {"stage": "result", "result": ...} with the complete result,
+        or {"stage": "error", "error": ...}. """
+    log.info("Received streaming request for URL: %s", url)
+    use_cache = settings.cache_ttl > 0
+
+    async def generate():
+        cached = await cache.lookup(url) if use_cache else None
+        if cached is not None:
+            yield json.dumps({"stage": "result", "result": cached}) + "\n"
+            return
+
+        updates: asyncio.Queue = asyncio.Queue()
+
+        def on_update(stage: str, fields: dict):
+            updates.put_nowait({"stage": stage, "fields": jsonable_encoder(fields)})
+
+        # Through the cache, so that concurrent requests for the URL share
+        # one computation, and this request gets its partial results
+        task = asyncio.create_task(
+            cache.get_or_compute(url, lambda notify: parse_page(url, enricher, notify), on_update=on_update)
+            if use_cache else parse_page(url, enricher, on_update))
+        task.add_done_callback(lambda _: updates.put_nowait(None))
+        try:
+            while (update := await updates.get()) is not None:
+                yield json.dumps(update) + "\n"
+            try:
+                result = task.result()
+            except Exception as e:  # pylint: disable=broad-except
+                log.exception("Failed to analyze %s", url)
+                yield json.dumps({"stage": "error", "error": str(e) or type(e).__name__}) + "\n"
+                return
+            if result is None:
+                yield json.dumps({"stage": "error", "error": "The page could not be rendered"}) + "\n"
+                return
+            yield json.dumps({"stage": "result", "result": result}) + "\n"
+        finally:
+            # e.g. if the client disconnected
+            task.cancel()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+class BatchRequest(BaseModel):
+    urls: list[str]
+    # Fields to return for each URL, as for /metadata
+    fields: Optional[list[str]] = None
+
+
+@app.post("/metadata/batch")
+async def get_metadata_batch(batch: BatchRequest, dependencies=Depends(validate_api_key),
+                             enricher: MetadataEnricher = Depends(get_enricher),
+                             cache: ResultCache = Depends(get_cache)):
+    """ Analyzes several URLs concurrently. Returns newline-delimited JSON,
+        one line per URL as soon as its result is ready (not in request
+        order): {"index": ..., "url": ..., "result": ...}, or {"index": ...,
+        "url": ..., "error": ...} if the URL could not be analyzed. """
+    if len(batch.urls) > settings.batch_max_urls:
+        raise HTTPException(status_code=413, detail=f"At most {settings.batch_max_urls} URLs per batch")
+    log.info("Received batch request for %d URLs", len(batch.urls))
+    # Limits the URLs of this batch that are in progress. The rendering is
+    # limited by the page semaphore of the browser, for all requests.
+    semaphore = asyncio.Semaphore(settings.batch_concurrency)
+
+    async def process(index: int, url: str) -> dict:
+        try:
+            # Cached results don't wait for a slot
+            result = await get_cached(url, enricher, cache, batch.fields or None)
+            if result is None:
+                async with semaphore:
+                    result = await analyze_url(url, enricher, cache, batch.fields or None)
+        except Exception as e:  # pylint: disable=broad-except
+            log.exception("Failed to analyze %s", url)
+            return {"index": index, "url": url, "error": str(e) or type(e).__name__}
+        if result is None:
+            return {"index": index, "url": url, "error": "The page could not be rendered"}
+        return {"index": index, "url": url, "result": result}
+
+    async def generate():
+        tasks = [asyncio.create_task(process(index, url)) for index, url in enumerate(batch.urls)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # e.g. if the client disconnected
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+@app.get("/cache/stats")
+async def get_cache_stats(dependencies=Depends(validate_api_key), cache: ResultCache = Depends(get_cache)):
+    """ Returns the hit and miss counts of the result cache. """
+    return cache.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(dependencies=Depends(validate_api_key),
+                      enricher: MetadataEnricher = Depends(get_enricher),
+                      cache: ResultCache = Depends(get_cache)):
+    """ Returns the latency of the enrichment stages, the cache counters and
+        the number of browser pages in the Prometheus text format. """
+    cache_stats = cache.stats()
+    enrichment_cache = []
+    for key, value in enricher.stats.get_stats().items():
+        # e.g. "enrichment_cache/llm/hit"
+        parts = key.split("/")
+        if len(parts) == 3 and parts[0] == "enrichment_cache":
+            enrichment_cache.append(((("kind", parts[1]), ("result", parts[2])), value))
+
+    metrics = [
+        enricher.metrics.render(),
+        format_metric("metadataapi_result_cache_total", "counter", "Lookups in the result cache",
+                      [((("result", result),), cache_stats[result])
+                       for result in ("hits", "misses", "coalesced", "errors")]),
+        format_metric("metadataapi_result_cache_entries", "gauge", "Entries in the result cache",
+                      [((), cache_stats["entries"])]),
+        format_metric("metadataapi_result_cache_in_flight", "gauge", "Results that are being computed",
+                      [((), cache_stats["in_flight"])]),
+        format_metric("metadataenricher_enrichment_cache_total", "counter",
+                      "Lookups in the cache of AI results", enrichment_cache),
+        format_metric("metadataenricher_browser_pages", "gauge",
+                      "Pages that are being rendered, or waiting for a free slot",
+                      [((("state", "rendering"),), page_semaphore.in_use),
+                       ((("state", "waiting"),), page_semaphore.waiting)]),
+        format_metric("metadataenricher_browser_pages_limit", "gauge",
+                      "Maximum number of pages that are rendered at the same time",
+                      [((), page_semaphore.limit)]),
+    ]
+    return PlainTextResponse("".join(metrics), media_type="text/plain; version=0.0.4; charset=utf-8")
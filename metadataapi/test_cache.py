@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from cache import ResultCache, normalize_url
+
+
+def test_normalize_url():
+    assert normalize_url("HTTPS://Example.com:443/page?b=2&a=1&utm_source=x#top") == \
+        "https://example.com/page?a=1&b=2"
+    assert normalize_url("http://example.com") == "http://example.com/"
+    assert normalize_url("http://example.com:8080/?fbclid=1") == "http://example.com:8080/"
+
+
+def test_get_or_compute():
+    async def run():
+        cache = ResultCache()
+        calls = []
+
+        async def compute(notify):
+            calls.append(1)
+            return {"title": "Page"}
+
+        assert await cache.get_or_compute("https://example.com/?utm_source=x", compute) == {"title": "Page"}
+        assert await cache.get_or_compute("https://EXAMPLE.com/", compute) == {"title": "Page"}
+        assert len(calls) == 1
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    asyncio.run(run())
+
+
+def test_concurrent_requests_are_coalesced():
+    async def run():
+        cache = ResultCache()
+        calls = []
+
+        async def compute(notify):
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"title": "Page"}
+
+        results = await asyncio.gather(*(cache.get_or_compute("https://example.com/", compute) for _ in range(5)))
+        assert results == [{"title": "Page"}] * 5
+        assert len(calls) == 1
+        assert cache.stats()["coalesced"] == 4
+        assert cache.stats()["in_flight"] == 0
+
+    asyncio.run(run())
+
+
+def test_coalesced_requests_get_the_updates():
+    async def run():
+        cache = ResultCache()
+        started = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def compute(notify):
+            notify("page", {"title": "Page"})
+            started.set()
+            await finish.wait()
+            notify("llm", {"keyword": ["a"]})
+            return {"title": "Page"}
+
+        first, second = [], []
+        task = asyncio.create_task(cache.get_or_compute(
+            "https://example.com/", compute, on_update=lambda *update: first.append(update)))
+        await started.wait()
+        # Joins the running computation, and gets the earlier updates as well
+        joined = asyncio.create_task(cache.get_or_compute(
+            "https://example.com/", compute, on_update=lambda *update: second.append(update)))
+        await asyncio.sleep(0)
+        finish.set()
+        assert await task == await joined == {"title": "Page"}
+        assert first == second == [("page", {"title": "Page"}), ("llm", {"keyword": ["a"]})]
+        assert cache.stats()["coalesced"] == 1
+
+    asyncio.run(run())
+
+
+def test_errors_and_none_are_not_cached():
+    async def run():
+        cache = ResultCache()
+
+        async def fail(notify):
+            raise ValueError("render failed")
+
+        async def nothing(notify):
+            return None
+
+        with pytest.raises(ValueError):
+            await cache.get_or_compute("https://example.com/", fail)
+        assert await cache.get_or_compute("https://example.com/", nothing) is None
+        assert await cache.get("https://example.com/") is None
+        assert cache.stats()["errors"] == 1
+
+    asyncio.run(run())
+
+
+def test_ttl_and_lru(monkeypatch):
+    async def run():
+        cache = ResultCache(ttl=10, max_entries=2)
+        await cache.set("https://example.com/1", 1)
+        await cache.set("https://example.com/2", 2)
+        assert await cache.get("https://example.com/1") == 1
+        await cache.set("https://example.com/3", 3)
+        # 2 was the least recently used
+        assert await cache.get("https://example.com/2") is None
+        assert await cache.get("https://example.com/1") == 1
+
+        now = time.time()
+        monkeypatch.setattr("cache.time.time", lambda: now + 11)
+        assert await cache.get("https://example.com/1") is None
+
+    asyncio.run(run())
+
+
+def test_variants_are_cached_separately():
+    async def run():
+        cache = ResultCache()
+        await cache.set("https://example.com/", {"title": "Page", "keywords": ["a"]})
+        await cache.set("https://example.com/", {"title": "Page"}, variant="stages=")
+        assert await cache.get("https://example.com/") == {"title": "Page", "keywords": ["a"]}
+        assert await cache.get("https://example.com/", variant="stages=") == {"title": "Page"}
+        assert await cache.get("https://example.com/", variant="stages=llm") is None
+
+    asyncio.run(run())
+
+
+def test_lookup_counts_hits():
+    async def run():
+        cache = ResultCache()
+        assert await cache.lookup("https://example.com/") is None
+        await cache.set("https://example.com/", {"title": "Page"})
+        assert await cache.lookup("https://example.com/") == {"title": "Page"}
+        assert await cache.get("https://example.com/") == {"title": "Page"}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 0
+
+    asyncio.run(run())
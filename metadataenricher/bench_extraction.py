@@ -0,0 +1,103 @@
+""" Measures the CPU time per page of the HTML extraction in the enricher.
+
+Compares the old approach (every extractor parses the page itself) with
+extraction.extract_page, which parses the page once.
+
+Usage: python bench_extraction.py [--repeat N] [page.html ...]
+If no files are given, a synthetic page is used.
+"""
+import argparse
+import statistics
+import time
+
+import html2text
+import scrapy
+import trafilatura
+from bs4 import BeautifulSoup
+
+from metadataenricher.extraction import DEFAULT_CLEAN_TAGS, extract_page
+
+# A sample of the XPaths used by the item loaders
+LOADER_XPATHS = [
+    '//meta[@property="og:image"]/@content',
+    '//meta[@name="last-modified"]/@content',
+    '//meta[@name="keywords"]/@content',
+    '//meta[@name="description"]/@content',
+    '//html/@lang',
+    '//title/text()',
+    '//meta[@name="date"]/@content',
+    '//meta[@name="publisher"]/@content',
+    '//meta[@name="author"]/@content',
+    '//link[@rel="license"]/@href',
+]
+
+
+def synthetic_page() -> str:
+    paragraphs = "\n".join(
+        f"<p>Paragraph {i}: Plants use the energy of <b>sunlight</b> to convert water and "
+        f"carbon dioxide into glucose and oxygen. <a href='/link/{i}'>More</a></p>"
+        for i in range(300))
+    navigation = "".join(f"<li><a href='/nav/{i}'>Item {i}</a></li>" for i in range(200))
+    return f"""<html lang="de"><head><title>Photosynthesis</title>
+<meta name="description" content="How plants make food">
+<meta name="keywords" content="biology, plants">
+<script type="application/ld+json">{{"@type": "Article", "name": "Photosynthesis"}}</script>
+</head><body><header><ul>{navigation}</ul></header><nav><ul>{navigation}</ul></nav>
+<article><h1>Photosynthesis</h1>{paragraphs}</article><footer>Footer</footer></body></html>"""
+
+
+def legacy_extraction(html: str):
+    trafilatura.extract(html.encode())
+    trafilatura.extract_metadata(html)
+    parsed_html = BeautifulSoup(html, features="lxml")
+    for tag in DEFAULT_CLEAN_TAGS:
+        for t in parsed_html.find_all(tag):
+            t.clear()
+    for t in parsed_html.find_all(name=None, attrs={"data-crawler": "ignore"}):
+        t.clear()
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    h.ignore_images = True
+    h.handle(parsed_html.prettify())
+    selector = scrapy.Selector(text=html)
+    selector.xpath('//script[@type="application/ld+json"]//text()').getall()
+    for xpath in LOADER_XPATHS:
+        selector.xpath(xpath).getall()
+
+
+def single_parse_extraction(html: str):
+    extraction = extract_page(html)
+    for xpath in LOADER_XPATHS:
+        extraction["selector"].xpath(xpath).getall()
+
+
+def measure(func, html: str, repeat: int) -> list[float]:
+    func(html)  # warm up
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func(html)
+        timings.append(time.process_time() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    pages = {name: open(name, encoding="utf-8").read() for name in args.files}
+    if not pages:
+        pages = {"synthetic": synthetic_page()}
+
+    for name, html in pages.items():
+        print(f"{name} ({len(html)} bytes)")
+        for label, func in [("legacy", legacy_extraction), ("single parse", single_parse_extraction)]:
+            timings = measure(func, html, args.repeat)
+            print(f"  {label:>12}: median {statistics.median(timings) * 1000:8.2f} ms CPU, "
+                  f"min {min(timings) * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
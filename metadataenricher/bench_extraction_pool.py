@@ -0,0 +1,68 @@
+""" Measures how much the text extraction stalls the event loop, and the
+extraction throughput, when extracting pages concurrently.
+
+Compares running extract_page_text directly on the event loop (as before)
+with the ExtractionPool in a thread (workers=0) and in worker processes.
+
+Usage: python bench_extraction_pool.py [--pages N] [--workers N ...] [page.html]
+If no file is given, the synthetic page of bench_extraction.py is used.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from bench_extraction import synthetic_page
+from metadataenricher.extraction import extract_page_text
+from metadataenricher.extraction_pool import ExtractionPool
+
+TICK = 0.01
+
+
+async def measure_lag(stop: asyncio.Event) -> float:
+    """ Returns the longest time the event loop was blocked while running. """
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        max_lag = max(max_lag, time.perf_counter() - start - TICK)
+    return max_lag
+
+
+async def run(html: str, pages: int, workers: int | None) -> tuple[float, float]:
+    pool = ExtractionPool(workers or 0)
+
+    async def extract():
+        if workers is None:
+            extract_page_text(html, with_main_text=True, with_blocks=True, hash_version="1")
+        else:
+            await pool.extract_text(html, with_main_text=True, with_blocks=True, hash_version="1")
+
+    await extract()  # start the pool
+    stop = asyncio.Event()
+    lag = asyncio.create_task(measure_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(extract() for _ in range(pages)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    pool.close()
+    return pages / elapsed, await lag
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, nargs="*", default=[0, 2, os.cpu_count() or 1])
+    parser.add_argument("file", nargs="?")
+    args = parser.parse_args()
+
+    html = open(args.file, encoding="utf-8").read() if args.file else synthetic_page()
+    print(f"{args.pages} pages of {len(html)} bytes")
+    for workers in [None] + args.workers:
+        label = "event loop" if workers is None else ("thread" if workers == 0 else f"{workers} processes")
+        throughput, lag = asyncio.run(run(html, args.pages, workers))
+        print(f"  {label:>12}: {throughput:6.1f} pages/s, event loop blocked for up to {lag * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
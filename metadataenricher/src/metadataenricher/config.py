@@ -0,0 +1,22 @@
+import os
+
+from . import env
+
+
+def settings_from_env() -> dict:
+    """ Returns the enricher settings from the environment, for use outside of
+        Scrapy (where the settings come from scraper/settings.py). """
+    settings: dict = {key: value for key, value in os.environ.items()
+                      if key.startswith("GENERIC_CRAWLER_")}
+    settings.update({
+        'GENERIC_CRAWLER_DB_PATH': env.get("GENERIC_CRAWLER_DB_PATH", allow_null=True),
+        'GENERIC_CRAWLER_USE_LLM_API': env.get_bool("GENERIC_CRAWLER_USE_LLM_API", default=False),
+        'GENERIC_CRAWLER_LLM_API_KEY': env.get("GENERIC_CRAWLER_LLM_API_KEY", default=""),
+        'GENERIC_CRAWLER_LLM_API_BASE_URL': env.get("GENERIC_CRAWLER_LLM_API_BASE_URL",
+                                                    default="https://chat-ai.academiccloud.de/v1"),
+        'GENERIC_CRAWLER_LLM_MODEL': env.get("GENERIC_CRAWLER_LLM_MODEL",
+                                             default="meta-llama-3.1-8b-instruct"),
+        'GENERIC_CRAWLER_ZAPI_HEDGE': env.get_bool("GENERIC_CRAWLER_ZAPI_HEDGE", default=False),
+        'GENERIC_CRAWLER_TRACE_OTEL': env.get_bool("GENERIC_CRAWLER_TRACE_OTEL", default=False),
+    })
+    return settings
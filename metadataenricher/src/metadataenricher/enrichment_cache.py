@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+from .stats import EnricherStats
+from .util.text_utils import normalize_whitespace
+
+log = logging.getLogger(__name__)
+
+
+class EnrichmentCache:
+    """ Persistent cache for the results of the AI services (LLM and Z-API).
+
+        Entries are keyed by a fingerprint of the normalized input text, the
+        kind of query (e.g. "llm" or "zapi_curriculum") and a version string,
+        which should contain everything else that influences the result (the
+        prompt template, the model name, ...). Changing any of these results in
+        a cache miss.
+
+        Entries expire after `ttl` seconds. If the stored results take up more
+        than `max_bytes`, the least recently used ones are evicted. The cache is stored in
+        a sqlite database, so it can be shared between crawl runs and between
+        several scrapyd processes. """
+
+    # Evict expired and surplus entries every n writes
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 60 * 60, max_bytes: int = 100 * 1024 * 1024,
+                 stats: Optional[EnricherStats] = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = stats
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS enrichment_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(enrichment_cache)")]
+        if "size" not in columns:
+            # Caches created before eviction by size
+            self.connection.execute("ALTER TABLE enrichment_cache ADD COLUMN size INTEGER NOT NULL DEFAULT 0")
+            self.connection.execute("UPDATE enrichment_cache SET size = length(CAST(value AS BLOB))")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS enrichment_cache_accessed_at ON enrichment_cache (accessed_at)")
+        self.connection.commit()
+        log.info("Opened enrichment cache at %s (ttl=%ss, max_bytes=%d)", path, ttl, max_bytes)
+
+    @staticmethod
+    def make_key(kind: str, text: str, version: str = "") -> str:
+        """ Returns the cache key for a query of the given kind over `text`. """
+        h = hashlib.sha256()
+        for part in (kind, version, normalize_whitespace(text)):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def get(self, kind: str, text: str, version: str = "") -> Optional[Any]:
+        """ Returns the cached result, or None if there is no (valid) entry. """
+        key = self.make_key(kind, text, version)
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM enrichment_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] + self.ttl < now:
+                self.connection.execute("DELETE FROM enrichment_cache WHERE key = ?", (key,))
+                self.connection.commit()
+                row = None
+            if row is not None:
+                self.connection.execute(
+                    "UPDATE enrichment_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                self.connection.commit()
+
+        if row is None:
+            self._inc_stats(kind, "miss")
+            return None
+        self._inc_stats(kind, "hit")
+        return json.loads(row[0])
+
+    def set(self, kind: str, text: str, value: Any, version: str = ""):
+        """ Stores a (JSON-serializable) result. """
+        key = self.make_key(kind, text, version)
+        now = time.time()
+        data = json.dumps(value)
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO enrichment_cache (key, value, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)", (key, data, len(data.encode("utf-8")), now, now))
+            self.connection.commit()
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def evict(self):
+        """ Removes expired entries, and the least recently used entries
+            while the cache takes up more than `max_bytes`. """
+        with self._lock:
+            self._evict(time.time())
+
+    def _evict(self, now: float):
+        expired = self.connection.execute(
+            "DELETE FROM enrichment_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        # Keep the most recently used entries whose sizes add up to max_bytes
+        surplus = self.connection.execute("""
+            DELETE FROM enrichment_cache WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS total
+                    FROM enrichment_cache)
+                WHERE total > ?)""", (self.max_bytes,)).rowcount
+        self.connection.commit()
+        if expired or surplus:
+            log.info("Evicted %d expired and %d surplus entries from the enrichment cache",
+                     expired, surplus)
+
+    def size(self) -> int:
+        """ Returns the size of the stored results in bytes. """
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM enrichment_cache").fetchone()[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM enrichment_cache").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _inc_stats(self, kind: str, result: str):
+        if self.stats is not None:
+            self.stats.inc_value(f"enrichment_cache/{result}")
+            self.stats.inc_value(f"enrichment_cache/{kind}/{result}")
@@ -0,0 +1,93 @@
+from typing import NamedTuple, Optional
+
+import lxml.html
+
+from .util.text_utils import normalize_whitespace
+
+BLOCK_TAGS = {"p", "li", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre",
+              "td", "th", "dd", "dt", "figcaption", "summary"}
+HEADING_TAGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+# Blocks inside these elements are boilerplate
+EXCLUDED_TAGS = {"nav", "header", "footer", "aside", "form", "script", "style", "noscript",
+                 "template", "button", "select"}
+# Blocks with fewer words are ignored, unless they are headings
+MIN_WORDS = 4
+# Only truncate a block to fill the budget if at least this many tokens are left
+MIN_FILL_TOKENS = 25
+
+
+class TextBlock(NamedTuple):
+    position: int
+    text: str
+    score: float
+
+
+def estimate_tokens(text: str) -> int:
+    """ Rough token count, good enough for budgeting (~4 characters per token). """
+    return len(text) // 4 + 1
+
+
+def score_blocks(tree: lxml.html.HtmlElement, main_text: Optional[str] = None) -> list[TextBlock]:
+    """ Splits the page into text blocks and scores how informative they are.
+
+        Blocks that are part of the trafilatura main text, headings and blocks
+        with a lot of text and few links score higher. Blocks within navigation,
+        headers, footers etc. are dropped. """
+    main_text = normalize_whitespace(main_text or "")
+    blocks = []
+    seen = set()
+    for position, element in enumerate(tree.iter(*BLOCK_TAGS)):
+        if _is_excluded(element):
+            continue
+        text = normalize_whitespace(element.text_content())
+        if not text or text in seen:
+            continue
+        is_heading = element.tag in HEADING_TAGS
+        words = len(text.split())
+        if words < MIN_WORDS and not is_heading:
+            continue
+        seen.add(text)
+
+        link_chars = sum(len(normalize_whitespace(a.text_content())) for a in element.iter("a"))
+        link_density = min(link_chars / len(text), 1.0)
+        score = min(words, 100) / 100 * (1 - link_density)
+        if is_heading:
+            score += 0.5
+        if main_text and text in main_text:
+            score += 1.0
+        blocks.append(TextBlock(position, text, score))
+    return blocks
+
+
+def build_excerpt(blocks: list[TextBlock], token_budget: int) -> str:
+    """ Picks the highest scoring blocks that fit into the token budget, and
+        returns them in document order. """
+    selected = []
+    skipped = []
+    tokens = 0
+    for block in sorted(blocks, key=lambda b: b.score, reverse=True):
+        if block.score <= 0:
+            # e.g. blocks that consist only of links
+            break
+        block_tokens = estimate_tokens(block.text)
+        if tokens + block_tokens > token_budget:
+            skipped.append(block)
+            continue
+        selected.append(block)
+        tokens += block_tokens
+    remaining = token_budget - tokens
+    if skipped and remaining >= MIN_FILL_TOKENS:
+        # Fill the rest of the budget with the start of the best block that did not fit
+        selected.append(skipped[0]._replace(text=skipped[0].text[:remaining * 4]))
+    selected.sort(key=lambda b: b.position)
+    return "\n\n".join(block.text for block in selected)
+
+
+def _is_excluded(element: lxml.html.HtmlElement) -> bool:
+    for ancestor in element.iterancestors():
+        if ancestor.tag in EXCLUDED_TAGS or ancestor.get("data-crawler") == "ignore":
+            return True
+        if ancestor.tag in BLOCK_TAGS:
+            # The text is already part of the enclosing block
+            return True
+    return element.get("data-crawler") == "ignore"
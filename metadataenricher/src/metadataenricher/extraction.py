@@ -0,0 +1,189 @@
+import copy
+import json
+import logging
+from typing import Optional, TypedDict
+
+import html2text
+import lxml.html
+import scrapy
+import trafilatura  # type: ignore
+from trafilatura.utils import load_html  # type: ignore
+
+from .excerpt import TextBlock, score_blocks
+from .tracing import tracer
+from .util.fingerprint import content_fingerprint, main_text_of, tree_fingerprint
+
+log = logging.getLogger(__name__)
+logging.getLogger("trafilatura").setLevel(logging.INFO)  # trafilatura is quite spammy
+
+DEFAULT_CLEAN_TAGS = ["nav", "header", "footer"]
+LRMI_XPATH = '//script[@type="application/ld+json"]//text()'
+# Parts of the trafilatura metadata that are lxml elements, and cannot be pickled
+METADATA_TREE_KEYS = {"body", "commentsbody"}
+# The XPaths of the MetadataEnricher's item loaders, evaluated by
+# extract_page_text, so the enricher does not need a tree of its own
+PAGE_XPATHS = {
+    "og_image": '//meta[@property="og:image"]/@content',
+    "last_modified": '//meta[@name="last-modified"]/@content',
+    "og_title": '//meta[@property="og:title"]/@content',
+    "title": '//title/text()',
+    "lang": '//html/@lang',
+    "og_locale": '//meta[@property="og:locale"]/@content',
+    "keywords": '//meta[@name="keywords"]/@content',
+    "og_url": '//meta[@property="og:url"]/@content',
+    "date": '//meta[@name="date"]/@content',
+    "author": '//meta[@name="author"]/@content',
+    "publisher": '//meta[@name="publisher"]/@content',
+    "planet_schule_mediatypes": '//meta[@name="planet-schule:mediatypes"]/@content',
+}
+
+
+class PageExtraction(TypedDict):
+    tree: lxml.html.HtmlElement
+    selector: scrapy.Selector
+    main_text: Optional[str]
+    cleaned_text: str
+    metadata: dict
+    lrmi_objects: list[dict]
+
+
+class PageText(TypedDict):
+    """ The plain data of a PageExtraction, without the parsed tree. """
+    main_text: Optional[str]
+    cleaned_text: str
+    metadata: dict
+    lrmi_objects: list[dict]
+    blocks: list[TextBlock]
+    fingerprint: Optional[str]
+    # The results of PAGE_XPATHS, by name
+    xpath_values: dict[str, list[str]]
+
+
+def parse_html(html: str) -> lxml.html.HtmlElement:
+    """ Parses a page into an lxml tree, which can be shared by all extractors. """
+    tree = None
+    if html and html.strip():
+        tree = load_html(html)
+        if tree is None:
+            # trafilatura rejects documents that do not look like HTML
+            tree = lxml.html.document_fromstring(html)
+    if tree is None:
+        tree = lxml.html.document_fromstring("<html><body></body></html>")
+    return tree
+
+
+def extract_page(html: str, clean_tags: Optional[list[str]] = None,
+                 with_main_text: bool = False) -> PageExtraction:
+    """ Parses the page once and runs all extractors on the same tree.
+
+        The tree is not modified, so the returned selector can be used for the
+        XPath loaders afterwards. The trafilatura main text is only extracted
+        if `with_main_text` is set, because it is by far the most expensive
+        step. """
+    # The spans are only recorded if this runs in the traced process, i.e.
+    # not in the worker processes of an ExtractionPool
+    with tracer.span("parse_html"):
+        tree = parse_html(html)
+
+    with tracer.span("trafilatura_metadata"):
+        if trafilatura_meta := trafilatura.extract_metadata(tree):
+            metadata = trafilatura_meta.as_dict()
+        else:
+            metadata = {}
+
+    main_text = None
+    if with_main_text:
+        with tracer.span("trafilatura_extract"):
+            # extract() works on a copy of the tree. The same text as in the
+            # fingerprint, so it is extracted only once.
+            main_text = main_text_of(tree)
+
+    with tracer.span("html2text"):
+        cleaned_text = cleanup_text(tree, clean_tags if clean_tags is not None else DEFAULT_CLEAN_TAGS)
+
+    selector = scrapy.Selector(root=tree, type="html")
+    with tracer.span("json_ld"):
+        lrmi_objects = extract_lrmi_objects(selector)
+    return {
+        "tree": tree,
+        "selector": selector,
+        "main_text": main_text,
+        "cleaned_text": cleaned_text,
+        "metadata": metadata,
+        "lrmi_objects": lrmi_objects,
+    }
+
+
+def extract_page_text(html: str, clean_tags: Optional[list[str]] = None, with_main_text: bool = False,
+                      with_blocks: bool = False, hash_version: Optional[str] = None,
+                      hash_html: Optional[str] = None) -> PageText:
+    """ Runs the CPU-heavy extractors and returns only data that can be pickled
+        cheaply, so this can run in a worker process (see ExtractionPool).
+
+        With `with_blocks`, the text blocks for the AI excerpts are scored as
+        well. With `hash_version`, the content fingerprint is computed as
+        well: of `hash_html` (e.g. the page before rendering) if given, or
+        else from the same tree and main text. """
+    extraction = extract_page(html, clean_tags=clean_tags, with_main_text=with_main_text)
+    tree = extraction["tree"]
+    fingerprint = None
+    if hash_version is not None:
+        with tracer.span("fingerprint"):
+            if hash_html is not None and hash_html != html:
+                fingerprint = content_fingerprint(hash_html, hash_version)
+            elif html and html.strip():
+                fingerprint = tree_fingerprint(tree, hash_version,
+                                               extraction["main_text"] if with_main_text else None)
+            else:
+                fingerprint = content_fingerprint(html, hash_version)
+    blocks = []
+    if with_blocks:
+        with tracer.span("score_blocks"):
+            blocks = score_blocks(tree, extraction["main_text"])
+    return {
+        "main_text": extraction["main_text"],
+        "cleaned_text": extraction["cleaned_text"],
+        "metadata": {key: value for key, value in extraction["metadata"].items()
+                     if key not in METADATA_TREE_KEYS},
+        "lrmi_objects": extraction["lrmi_objects"],
+        "blocks": blocks,
+        "fingerprint": fingerprint,
+        "xpath_values": {name: extraction["selector"].xpath(xpath).getall()
+                         for name, xpath in PAGE_XPATHS.items()},
+    }
+
+
+def cleanup_text(tree: lxml.html.HtmlElement, clean_tags: list[str]) -> str:
+    """ Converts the page to markdown-ish text, without the content of
+        `clean_tags` and of elements marked with data-crawler="ignore". """
+    tree = copy.deepcopy(tree)
+    xpath = " | ".join([f"//{tag}" for tag in clean_tags] + ['//*[@data-crawler="ignore"]'])
+    for element in tree.xpath(xpath):
+        element.clear(keep_tail=True)
+    h = html2text.HTML2Text()
+    h.ignore_links = True
+    h.ignore_images = True
+    return h.handle(lxml.html.tostring(tree, encoding="unicode"))
+
+
+def extract_lrmi_objects(selector: scrapy.Selector) -> list[dict]:
+    """ Returns all JSON-LD objects embedded in the page. """
+    lrmi_objects = []
+    for l in selector.xpath(LRMI_XPATH).getall():
+        try:
+            obj = json.loads(l)
+        except json.JSONDecodeError:
+            log.warning("Failed to parse JSON-LD object: %s", l)
+            continue
+
+        log.debug("JSON-LD object: %s", type(obj))
+        if isinstance(obj, list):
+            for o in obj:
+                if isinstance(o, dict):
+                    lrmi_objects.append(o)
+        elif isinstance(obj, dict):
+            lrmi_objects.append(obj)
+        else:
+            log.warning("Unexpected JSON-LD object: %s", l)
+            continue
+    return lrmi_objects
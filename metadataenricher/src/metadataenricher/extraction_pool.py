@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from .extraction import PageText, extract_page_text
+from .util.fingerprint import content_fingerprint
+
+log = logging.getLogger(__name__)
+
+
+class ExtractionPool:
+    """ Runs the CPU-bound text extraction (trafilatura, html2text, block
+        scoring, fingerprints) outside of the event loop, so a large page does
+        not stall the downloads and browser sessions of all other pages.
+
+        With `workers` > 0 the extraction runs in a pool of worker processes
+        and scales with the number of cores. With 0 it runs in a thread, which
+        keeps the event loop responsive, but shares the GIL with it. """
+
+    def __init__(self, workers: int = 0):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers > 0 and self._executor is None:
+            log.info("Starting %d extraction worker processes", self.workers)
+            # Forking a process with running threads (Twisted, Playwright) is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def _run(self, func, *args):
+        executor = self._get_executor()
+        if executor is None:
+            return await asyncio.to_thread(func, *args)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory on a huge page), start a new pool
+            # for the following pages
+            log.error("Extraction worker process died, restarting the pool")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    async def extract_text(self, html: str, clean_tags: Optional[list[str]] = None,
+                           with_main_text: bool = False, with_blocks: bool = False,
+                           hash_version: Optional[str] = None, hash_html: Optional[str] = None) -> PageText:
+        """ See extraction.extract_page_text. """
+        return await self._run(extract_page_text, html, clean_tags, with_main_text, with_blocks,
+                               hash_version, hash_html)
+
+    async def fingerprint(self, html: str, version: str = "") -> str:
+        """ See util.fingerprint.content_fingerprint. """
+        return await self._run(content_fingerprint, html, version)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
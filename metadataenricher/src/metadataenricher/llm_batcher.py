@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from .rate_limit import TokenBudget
+
+log = logging.getLogger(__name__)
+
+
+class LlmResult(NamedTuple):
+    prompt: str
+    response: Optional[str]
+    result: Optional[dict]
+
+
+def parse_json_response(response: str, start: str = "{", end: str = "}") -> Any:
+    """ Parses the JSON part of an LLM response, ignoring any text around it.
+        Raises json.JSONDecodeError if there is no valid JSON. """
+    # strip everything up to the first start character and after the last end character
+    return json.loads(response[response.find(start):response.rfind(end) + 1])
+
+
+class LlmBatcher:
+    """ Collects the LLM queries of pages that are processed concurrently, and
+        sends them to the LLM as a single prompt.
+
+        Queries are collected until `batch_size` queries are pending, or until
+        `window` seconds have passed since the first one. The LLM is asked to
+        answer with a JSON array containing one object per text, tagged with the
+        id of the text. If the answer for a text is missing or cannot be parsed,
+        that text is sent again with the single-page prompt.
+
+        The prompt of each result is the single-page prompt of its text, so
+        that results never contain the texts of other pages. """
+
+    def __init__(self, call_llm: Callable[[str, Optional[TokenBudget]], Awaitable[Optional[str]]],
+                 single_prompt: str, batch_prompt: str, batch_size: int, window: float, stats=None):
+        self.call_llm = call_llm
+        self.single_prompt = single_prompt
+        self.batch_prompt = batch_prompt
+        self.batch_size = batch_size
+        self.window = window
+        self.stats = stats
+        # Texts are only batched with texts that are charged to the same
+        # token budget, i.e. that belong to the same crawl job
+        self._pending: dict[Optional[TokenBudget], list[tuple[str, asyncio.Future]]] = {}
+        self._timers: dict[Optional[TokenBudget], asyncio.Task] = {}
+        # The event loop only keeps weak references to tasks
+        self._tasks: set[asyncio.Task] = set()
+
+    async def query(self, text: str, budget: Optional[TokenBudget] = None) -> LlmResult:
+        """ Queries the LLM for a single text, possibly as part of a batch. """
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(budget, [])
+        pending.append((text, future))
+        if len(pending) >= self.batch_size:
+            self._flush(budget)
+        elif budget not in self._timers:
+            self._timers[budget] = asyncio.create_task(self._flush_later(budget))
+        return await future
+
+    async def _flush_later(self, budget: Optional[TokenBudget]):
+        await asyncio.sleep(self.window)
+        del self._timers[budget]
+        self._flush(budget)
+
+    def _flush(self, budget: Optional[TokenBudget]):
+        timer = self._timers.pop(budget, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(budget, [])
+        if batch:
+            task = asyncio.create_task(self._run_batch(batch, budget))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list[tuple[str, asyncio.Future]], budget: Optional[TokenBudget]):
+        try:
+            if len(batch) == 1:
+                results = [await self._query_single(batch[0][0], budget)]
+            else:
+                results = await self._query_batch([text for text, _ in batch], budget)
+        except Exception as e:  # pylint: disable=broad-except
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def _query_single(self, text: str, budget: Optional[TokenBudget]) -> LlmResult:
+        prompt = self.single_prompt % ({'text': text})
+        response = await self.call_llm(prompt, budget)
+        if response is None:
+            return LlmResult(prompt, None, None)
+        try:
+            result = parse_json_response(response)
+        except json.JSONDecodeError:
+            log.error("Failed to parse JSON response from AI service.", exc_info=True)
+            log.info("AI response: %r", response)
+            result = None
+        if not isinstance(result, dict):
+            result = None
+        return LlmResult(prompt, response, result)
+
+    async def _query_batch(self, texts: list[str], budget: Optional[TokenBudget]) -> list[LlmResult]:
+        items = [{"id": i, "text": text} for i, text in enumerate(texts)]
+        prompt = self.batch_prompt % ({'texts': json.dumps(items, ensure_ascii=False, indent=1)})
+        log.info("Sending batched LLM prompt for %d texts", len(texts))
+        log.debug("Batched LLM prompt: %r", prompt)
+        self._inc_stats("llm_batch/batches")
+        self._inc_stats("llm_batch/items", len(texts))
+        response = await self.call_llm(prompt, budget)
+
+        answers: dict[int, dict] = {}
+        if response is not None:
+            try:
+                parsed = parse_json_response(response, "[", "]")
+            except json.JSONDecodeError:
+                log.warning("Failed to parse batched JSON response from AI service: %r", response)
+                parsed = []
+            for answer in parsed if isinstance(parsed, list) else []:
+                if not isinstance(answer, dict):
+                    continue
+                try:
+                    # Some models answer with string ids ("0")
+                    answer_id = int(answer.pop("id"))
+                except (KeyError, TypeError, ValueError):
+                    continue
+                answers[answer_id] = answer
+
+        results: list[Optional[LlmResult]] = []
+        for i in range(len(texts)):
+            if i in answers:
+                answer = answers[i]
+                results.append(LlmResult(self.single_prompt % ({'text': texts[i]}),
+                                         json.dumps(answer, ensure_ascii=False), answer))
+            else:
+                results.append(None)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            log.warning("No usable answer for %d of %d texts in batch, falling back to single prompts",
+                        len(missing), len(texts))
+            self._inc_stats("llm_batch/fallback", len(missing))
+            fallback = await asyncio.gather(*[self._query_single(texts[i], budget) for i in missing])
+            for i, result in zip(missing, fallback):
+                results[i] = result
+        return results  # type: ignore
+
+    def _inc_stats(self, key: str, count: int = 1):
+        if self.stats is not None:
+            self.stats.inc_value(key, count)
@@ -1,27 +1,39 @@
 
-import datetime
+import asyncio
+import copy
 import json
 import logging
 import re
-from typing import Optional
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Collection, Iterator, Optional
 
-import html2text
 import httpx
 import openai
-import scrapy
-import trafilatura  # type: ignore
-from bs4 import BeautifulSoup
 from valuespace_converter.valuespaces import Valuespaces
 
 from . import env, zapi
+from .enrichment_cache import EnrichmentCache
+from .excerpt import TextBlock, build_excerpt
+from .extraction import cleanup_text, parse_html
+from .extraction_pool import ExtractionPool
+from .llm_batcher import LlmBatcher, parse_json_response
+from .metrics import StageMetrics
 from .items import (AiPromptItemLoader, BaseItem, BaseItemLoader,
                     KIdraItemLoader, LicenseItemLoader, LomBaseItemloader,
                     LomClassificationItemLoader, LomEducationalItemLoader,
                     LomGeneralItemloader, LomLifecycleItemloader,
                     LomTechnicalItemLoader, PermissionItemLoader,
                     ResponseItemLoader, ValuespaceItemLoader)
+from .rate_limit import (BudgetExhausted, LlmRateLimiter, TokenBudget,
+                         create_chat_completion, shared_limiter)
+from .resilience import CircuitOpen, ZapiEndpoint
+from .snapshot_store import SnapshotStore
+from .stats import EnricherStats
+from .tracing import tracer
+from .util.fingerprint import content_fingerprint
 from .util.license_mapper import LicenseMapper
-from .web_tools import get_url_data
+from .web_tools import UrlDataDict, get_url_data
 from .zapi import errors, models
 from .zapi.api.ai_text_prompts import prompt as zapi_prompt
 from .zapi.api.kidra import (predict_subjects_kidra_predict_subjects_post,
@@ -47,11 +59,52 @@ class AuthenticationError(Exception):
     pass
 
 
+# Called with the name of a stage and the fields it produced, e.g.
+# ("page", {"title": ...}), so that callers can show partial results before
+# all AI services have answered.
+UpdateCallback = Callable[[str, dict[str, Any]], None]
+
+# Errors of a Z-API call that count towards opening its circuit breaker
+ZAPI_ERRORS = (errors.UnexpectedStatus, httpx.TransportError)
+
+
 class MetadataEnricher:
     zapi_client: zapi.AuthenticatedClient
+    zapi_endpoints: dict[str, ZapiEndpoint]
     llm_client: Optional[openai.OpenAI] = None
     use_llm_api: bool = False
     llm_model: str = ""
+    cache: Optional[EnrichmentCache] = None
+    llm_batcher: Optional[LlmBatcher] = None
+    llm_limiter: Optional[LlmRateLimiter] = None
+    snapshot_store: Optional[SnapshotStore] = None
+    # If set, pages are read from the snapshot store instead of being rendered
+    snapshot_replay: bool = False
+    # Default token budget of the excerpt sent to each AI service. Can be
+    # overridden with GENERIC_CRAWLER_EXCERPT_TOKENS_<SERVICE>.
+    excerpt_token_budgets = {
+        "llm": 1000,
+        "zapi_curriculum": 1000,
+        "zapi_statistics": 1000,
+        "zapi_disciplines": 1000,
+    }
+    # Bump this if the post-processing of Z-API results changes, to invalidate
+    # cached results.
+    zapi_cache_version = "1"
+    # Part of the content hash; bump this to re-process all items. Crawlers
+    # that check the hash before rendering set their own version here, so
+    # both compute the same hash.
+    hash_version = "1"
+    # The AI services that parse_page queries, and the fields of the item
+    # they fill. Callers that need only some fields can skip the others.
+    stage_fields = {
+        "llm": ("lom.general.description", "lom.general.keyword", "valuespaces.discipline",
+                "valuespaces.educationalContext", "valuespaces.intendedEndUserRole",
+                "valuespaces.new_lrt", "ai_prompts"),
+        "curriculum": ("kidra_raw.curriculum",),
+        "statistics": ("kidra_raw.text_difficulty", "kidra_raw.text_reading_time"),
+        "disciplines": ("kidra_raw.kidraDisciplines",),
+    }
 
     clean_tags = ["nav", "header", "footer"]
     prompts = {
@@ -62,15 +115,16 @@ class MetadataEnricher:
         "new_lrt": "Welche Materialart im schulischen Kontext ist folgender Text: %(text)s",
         "intendedEndUserRole": "Für welche Zielgruppen eignet sich folgender Text: %(text)s",
     }
-    ALL_IN_ONE_PROMPT = """Folgender Text ist ein Bildungsmaterial von einer Webseite. Bitte extrahiere folgende Informationen:
-
-description: Gebe eine Beschreibung und Zusammenfassung der Quelle in 3 Sätzen.
+    LLM_FIELDS = """description: Gebe eine Beschreibung und Zusammenfassung der Quelle in 3 Sätzen.
 keywords: Finde 3-5 Schlagworte die den Text beschreiben.
 discipline: Für welche Schul- bzw. Fachgebiete eignet sich das Material?
 educationalContext: Für welche Bildungsstufen eignet sich das Material? Berücksichtige die Sprachschwierigkeit des Textes und die Altersangemessenheit der Formulierung. (Mögliche Antworten: Elementarbereich, Schule, Primarstufe, Sekundarstufe I, Sekundarstufe II, Hochschule, Berufliche Bildung, Fortbildung, Erwachsenenbildung, Förderschule, Fernunterricht, Informelles Lernen)
 new_lrt: Welche Materialart im schulischen Kontext stellt die Quelle dar? (Webseite, Artikel und Einzelpublikation, Bild, Video, Anleitung, Lexikon, Quiz, Wiki, Schülerarbeit, ...)
 intendedEndUserRole: Für welche Zielgruppen eignet sich das Material? (Lerner/in, Lehrer/in, Eltern, Autor/in, ...)
+"""
+    ALL_IN_ONE_PROMPT = """Folgender Text ist ein Bildungsmaterial von einer Webseite. Bitte extrahiere folgende Informationen:
 
+""" + LLM_FIELDS + """
 Antworte im JSON-Format, und gebe keinen weiteren Text aus:
 {
   "description": "Deine Beschreibung der Quelle",
@@ -83,6 +137,26 @@ Antworte im JSON-Format, und gebe keinen weiteren Text aus:
 
 Hier folgt der Text:
 %(text)s
+"""
+    # Used if several pages are sent to the LLM at once (GENERIC_CRAWLER_LLM_BATCH_SIZE > 1)
+    BATCH_PROMPT = """Folgende Texte sind Bildungsmaterialien von verschiedenen Webseiten. Sie sind als JSON-Array mit den Feldern "id" und "text" angegeben. Bitte extrahiere für jeden Text einzeln folgende Informationen:
+
+""" + LLM_FIELDS + """
+Antworte mit einem JSON-Array, das für jeden Text genau ein Objekt mit der "id" des Textes enthält, und gebe keinen weiteren Text aus:
+[
+  {
+    "id": 0,
+    "description": "Deine Beschreibung der Quelle",
+    "keywords": ["Thema1", "Thema2"],
+    "discipline": ["Geographie"],
+    "educationalContext": ["Primarstufe"],
+    "new_lrt": ["Artikel"],
+    "intendedEndUserRole": ["Lehrer/in", "Lerner/in"]
+  }
+]
+
+Hier folgen die Texte:
+%(texts)s
 """
 
     def __init__(self, ai_enabled: bool):
@@ -90,6 +164,11 @@ Hier folgt der Text:
         self.ai_enabled = ai_enabled
         self.valuespaces = Valuespaces()
         self.inherited_fields = {}
+        # Replaced by the crawler's stats collector when running in Scrapy
+        self.stats = EnricherStats()
+        # Latency of the stages of parse_page, see metrics.py
+        self.metrics = StageMetrics()
+        self.extraction_pool = ExtractionPool()
         if self.ai_enabled:
             log.info("Starting content with ai_enabled flag!")
             self.zapi_client = zapi.AuthenticatedClient(
@@ -99,6 +178,7 @@ Hier folgt der Text:
                 base_url="https://ai-prompt-service.staging.openeduhub.net",
                 raise_on_unexpected_status=True
             )
+            self.zapi_endpoints = self.create_zapi_endpoints({})
         else:
             log.info(
                 "Starting content with MINIMAL settings. AI Services are DISABLED!")
@@ -106,6 +186,21 @@ Hier folgt der Text:
     def setup(self, settings):
         self.is_setup = True
         self.settings = settings
+        tracer.configure(settings)
+        if self.ai_enabled:
+            self.zapi_endpoints = self.create_zapi_endpoints(settings)
+
+        extraction_workers = int(settings.get('GENERIC_CRAWLER_EXTRACTION_WORKERS', 0))
+        if extraction_workers > 0:
+            self.extraction_pool = ExtractionPool(extraction_workers)
+
+        cache_path = settings.get('GENERIC_CRAWLER_ENRICHMENT_CACHE_PATH')
+        if self.ai_enabled and cache_path:
+            self.cache = EnrichmentCache(
+                cache_path,
+                ttl=float(settings.get('GENERIC_CRAWLER_ENRICHMENT_CACHE_TTL', 30 * 24 * 60 * 60)),
+                max_bytes=int(settings.get('GENERIC_CRAWLER_ENRICHMENT_CACHE_MAX_BYTES', 100 * 1024 * 1024)),
+                stats=self.stats)
 
         self.use_llm_api = settings.get('GENERIC_CRAWLER_USE_LLM_API', False)
         log.info("GENERIC_CRAWLER_USE_LLM_API: %r", self.use_llm_api)
@@ -132,66 +227,190 @@ Hier folgt der Text:
         log.info("GENERIC_CRAWLER_LLM_API_BASE_URL: %r", base_url)
         log.info("GENERIC_CRAWLER_LLM_MODEL: %r", self.llm_model)
         self.llm_client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        # Shared with all other LLM users in this process
+        self.llm_limiter = shared_limiter(settings)
+
+        batch_size = int(settings.get('GENERIC_CRAWLER_LLM_BATCH_SIZE', 1))
+        if batch_size > 1:
+            batch_window = float(settings.get('GENERIC_CRAWLER_LLM_BATCH_WINDOW', 2.0))
+            log.info("Batching up to %d LLM prompts within %.1fs", batch_size, batch_window)
+            self.llm_batcher = LlmBatcher(
+                self.call_llm, self.ALL_IN_ONE_PROMPT, self.BATCH_PROMPT,
+                batch_size=batch_size, window=batch_window, stats=self.stats)
+
+    @staticmethod
+    def create_zapi_endpoints(settings) -> dict[str, ZapiEndpoint]:
+        """ Returns a circuit breaker (and optionally hedging) per Z-API endpoint. """
+        return {
+            name: ZapiEndpoint(
+                name,
+                failure_threshold=int(settings.get('GENERIC_CRAWLER_ZAPI_FAILURE_THRESHOLD', 5)),
+                reset_timeout=float(settings.get('GENERIC_CRAWLER_ZAPI_RESET_TIMEOUT', 30)),
+                hedge=bool(settings.get('GENERIC_CRAWLER_ZAPI_HEDGE', False)),
+                failure_exceptions=ZAPI_ERRORS)
+            for name in ("curriculum", "statistics", "disciplines")
+        }
+
+    def close(self):
+        """ Releases resources held by the enricher. """
+        self.extraction_pool.close()
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+        if self.snapshot_store is not None:
+            self.snapshot_store.close()
+            self.snapshot_store = None
+
+    def set_snapshot_store(self, snapshot_store: SnapshotStore, replay: bool = False):
+        """ Records all rendered pages in `snapshot_store`, or, if `replay` is
+            set, reads the pages from it instead of rendering them. """
+        self.snapshot_store = snapshot_store
+        self.snapshot_replay = replay
+
+    def new_token_budget(self) -> TokenBudget:
+        """ Returns a budget of GENERIC_CRAWLER_LLM_TOKEN_BUDGET tokens, for
+            one crawl job or one API request. """
+        return TokenBudget(int(self.settings.get('GENERIC_CRAWLER_LLM_TOKEN_BUDGET', 0)))
 
     def set_inherited_fields(self, inherited_fields: dict):
         self.inherited_fields = inherited_fields
         log.info("Inherited fields set for enricher: %s", inherited_fields)
 
-    async def parse_page(self, response_url: str) -> Optional[BaseItem]:
-        url_data = await get_url_data(response_url)
-        if not url_data:
-            log.warning("Playwright failed to fetch data for %s", response_url)
-            return
+    async def parse_page(self, response_url: str, source_hash: Optional[str] = None,
+                         with_screenshot: bool = False,
+                         on_update: Optional[UpdateCallback] = None,
+                         stages: Optional[Collection[str]] = None,
+                         token_budget: Optional[TokenBudget] = None) -> Optional[BaseItem]:
+        """ Renders and enriches the page at `response_url`. `source_hash` can be
+            given if the caller already computed the content hash (e.g. to check
+            whether the page has changed before rendering it). If `with_screenshot`
+            is set, the screenshot is returned in `screenshot_bytes` for items
+            without a thumbnail. `on_update` is called with partial results, and
+            `stages` limits the AI services that are queried, see
+            parse_page_inner. The LLM tokens are charged to `token_budget`. """
+        with tracer.span("parse_page", url=response_url):
+            # Recorded pages should be complete, so they can be replayed with any options
+            url_data = await self.fetch_page(
+                response_url, with_screenshot=with_screenshot or self.snapshot_store is not None)
+            if not url_data:
+                return
+            return await self.enrich_page(response_url, url_data, source_hash=source_hash,
+                                          with_screenshot=with_screenshot, on_update=on_update,
+                                          stages=stages, token_budget=token_budget)
+
+    @contextmanager
+    def stage(self, name: str, **attributes: Any) -> Iterator[None]:
+        """ Records the duration of a stage in the metrics, and traces it. """
+        with tracer.span(name, **attributes), self.metrics.time(name):
+            yield
+
+    def stages_for_fields(self, fields: Collection[str]) -> set[str]:
+        """ Returns the AI stages that are needed to fill the given fields,
+            which are dotted paths into the item, e.g. "lom.general.title"
+            (no AI stage) or "kidra_raw" (all Z-API stages). """
+        def overlaps(a: str, b: str) -> bool:
+            return a == b or a.startswith(b + ".") or b.startswith(a + ".")
+
+        return {stage for stage, stage_fields in self.stage_fields.items()
+                if any(overlaps(field, stage_field) for field in fields for stage_field in stage_fields)}
+
+    async def fetch_page(self, response_url: str, with_screenshot: bool = True) -> Optional[UrlDataDict]:
+        """ Renders the page in the browser, or reads it from the snapshot
+            store when replaying. """
+        if self.snapshot_replay:
+            assert self.snapshot_store is not None
+            url_data = await asyncio.to_thread(self.snapshot_store.get, response_url)
+            if not url_data:
+                log.warning("No snapshot found for %s", response_url)
+                return None
+        else:
+            with self.stage("render"):
+                url_data = await get_url_data(response_url, with_screenshot=with_screenshot)
+            if not url_data:
+                log.warning("Playwright failed to fetch data for %s", response_url)
+                return None
+            if self.snapshot_store is not None:
+                # Compressing and committing the page would block the event loop
+                await asyncio.to_thread(self.snapshot_store.put, response_url, url_data)
         log.info("Response from get_url_data:")
         for key, val in url_data.items():
             log.info("%s: %r", key, str(val)[:100])
-
-        # ToDo: validate "trafilatura"-fulltext-extraction from playwright
-        # (compared to the html2text approach)
+        return url_data
+
+    async def enrich_page(self, response_url: str, url_data: UrlDataDict, source_hash: Optional[str] = None,
+                          with_screenshot: bool = False,
+                          on_update: Optional[UpdateCallback] = None,
+                          stages: Optional[Collection[str]] = None,
+                          token_budget: Optional[TokenBudget] = None,
+                          inherited_fields: Optional[dict] = None) -> BaseItem:
+        """ Extracts and enriches the metadata of a rendered page.
+            `inherited_fields` replace the ones set with
+            set_inherited_fields, for callers that enrich the pages of
+            several crawl jobs at the same time. """
         # HTML extracted from the browser view
         playwright_html: str = url_data["html"] or ""
-        # Main text extracted from browser view
-        trafilatura_text: str = url_data["text"] or ""
-        return await self.parse_page_inner(
-            response_url=response_url,
-            playwright_html=playwright_html,
-            trafilatura_text=trafilatura_text
-        )
-
-    async def parse_page_inner(self, response_url: str, playwright_html: str, trafilatura_text: str) -> BaseItem:
-        log.info("trafilatura_text: %s", str(trafilatura_text)[:100])
-
-        text_html2text = self.manual_cleanup_text(playwright_html)
+        with tracer.span("enrich_page", url=response_url, html_size=len(playwright_html)):
+            item = await self.parse_page_inner(
+                response_url=response_url,
+                playwright_html=playwright_html,
+                source_hash=source_hash,
+                # The same input as a crawler that checks the hash before rendering
+                hash_html=url_data.get("raw_html") or None,
+                on_update=on_update,
+                stages=stages,
+                token_budget=token_budget,
+                inherited_fields=inherited_fields
+            )
+        if with_screenshot and "thumbnail" not in item and url_data["screenshot_bytes"]:
+            # Let the thumbnail pipeline use the screenshot we already have,
+            # instead of rendering the page again
+            item["screenshot_bytes"] = url_data["screenshot_bytes"]
+        return item
+
+    async def parse_page_inner(self, response_url: str, playwright_html: str,
+                               trafilatura_text: Optional[str] = None,
+                               source_hash: Optional[str] = None,
+                               hash_html: Optional[str] = None,
+                               on_update: Optional[UpdateCallback] = None,
+                               stages: Optional[Collection[str]] = None,
+                               token_budget: Optional[TokenBudget] = None,
+                               inherited_fields: Optional[dict] = None) -> BaseItem:
+        """ Extracts the metadata of a page and queries the AI services.
+
+            If `on_update` is given, it is called with the "page" stage as
+            soon as the metadata found in the page itself is known, and then
+            with the "llm", "curriculum", "statistics" and "disciplines"
+            stages as the AI services answer. If `stages` is given, only
+            these AI services are queried (see stage_fields). Without a
+            `source_hash`, the hash is computed from `hash_html`, or else
+            from `playwright_html`. """
+        if stages is None:
+            stages = self.stage_fields.keys()
+        if inherited_fields is None:
+            inherited_fields = self.inherited_fields
+        ai_stages = set(stages) & self.stage_fields.keys() if self.ai_enabled else set()
+
+        if trafilatura_text:
+            log.info("trafilatura_text: %s", str(trafilatura_text)[:100])
+
+        # The page is parsed and all extractors (including the XPaths of the
+        # loaders below) run outside of the event loop
+        with self.stage("extraction"):
+            page_text = await self.extraction_pool.extract_text(
+                playwright_html, clean_tags=self.clean_tags, with_main_text=bool(ai_stages),
+                with_blocks=bool(ai_stages), hash_version=self.hash_version if source_hash is None else None,
+                hash_html=hash_html)
+        # The time spent in the loaders, without the AI services
+        loaders_start = time.perf_counter()
+
+        text_html2text = page_text["cleaned_text"]
         log.info("Cleaned up text via html2text: %s", text_html2text[:100])
 
-        if trafilatura_meta_playwright := trafilatura.extract_metadata(playwright_html):
-            trafilatura_meta = trafilatura_meta_playwright.as_dict()
-        else:
-            trafilatura_meta = {}
+        trafilatura_meta = page_text["metadata"]
         log.info("trafilatura_meta: %s", trafilatura_meta)
 
-        selector_playwright = scrapy.Selector(text=playwright_html)
-
-        # extract LRMI objects from the response
-        lrmi_path = '//script[@type="application/ld+json"]//text()'
-        lrmi_objects = []
-        for l in selector_playwright.xpath(lrmi_path).getall():
-            try:
-                obj = json.loads(l)
-            except json.JSONDecodeError:
-                log.warning("Failed to parse JSON-LD object: %s", l)
-                continue
-
-            log.debug("JSON-LD object: %s", type(obj))
-            if isinstance(obj, list):
-                for o in obj:
-                    if isinstance(o, dict):
-                        lrmi_objects.append(o)
-            elif isinstance(obj, dict):
-                lrmi_objects.append(obj)
-            else:
-                log.warning("Unexpected JSON-LD object: %s", l)
-                continue
+        xpath_values = page_text["xpath_values"]
+        lrmi_objects = page_text["lrmi_objects"]
 
         def getLRMI(field: str):
             for obj in lrmi_objects:
@@ -201,24 +420,25 @@ Hier folgt der Text:
                     return value
             log.info("JSON-LD not found: %s", field)
 
-        base_loader = BaseItemLoader(selector=selector_playwright)
+        base_loader = BaseItemLoader()
         source_id = self.get_id(response_url=response_url)
-        source_hash = self.get_hash()
+        if source_hash is None:
+            source_hash = page_text["fingerprint"]
         base_loader.add_value("sourceId", source_id)
         base_loader.add_value("hash", source_hash)
         base_loader.add_value("thumbnail", getLRMI("thumbnailUrl"))
-        base_loader.add_xpath("thumbnail", '//meta[@property="og:image"]/@content')
-        base_loader.add_xpath("lastModified", '//meta[@name="last-modified"]/@content')
+        base_loader.add_value("thumbnail", xpath_values["og_image"])
+        base_loader.add_value("lastModified", xpath_values["last_modified"])
 
         # Creating the nested ItemLoaders according to our items.py data model
         lom_loader = LomBaseItemloader()
-        general_loader = LomGeneralItemloader(selector=selector_playwright)
-        technical_loader = LomTechnicalItemLoader(selector=selector_playwright)
+        general_loader = LomGeneralItemloader()
+        technical_loader = LomTechnicalItemLoader()
         educational_loader = LomEducationalItemLoader()
         classification_loader = LomClassificationItemLoader()
         valuespace_loader = ValuespaceItemLoader()
-        license_loader = LicenseItemLoader(selector=selector_playwright)
-        permissions_loader = PermissionItemLoader(selector=selector_playwright)
+        license_loader = LicenseItemLoader()
+        permissions_loader = PermissionItemLoader()
         # default all materials to public, needs to be changed depending on the spider!
         permissions_loader.add_value("public", self.settings.get("DEFAULT_PUBLIC_STATE"))
         response_loader = ResponseItemLoader()
@@ -229,43 +449,110 @@ Hier folgt der Text:
         # ToDo: try to grab as many OpenGraph metadata properties as possible (for reference, see:
         # https://ogp.me)
 
-        general_loader.add_xpath("title", '//meta[@property="og:title"]/@content')
-        general_loader.add_xpath("title", '//title/text()')
+        general_loader.add_value("title", xpath_values["og_title"])
+        general_loader.add_value("title", xpath_values["title"])
         # HTML language and locale properties haven proven to be pretty inconsistent, but they might
         # be useful as fallback values.
         # ToDo: websites might return languagecodes as 4-char values (e.g. "de-DE") instead of the
         # 2-char value "de"
         # -> we will have to detect/clean up languageCodes to edu-sharing's expected 2-char format
         general_loader.add_value("language", getLRMI("inLanguage"))
-        general_loader.add_xpath("language", "//html/@lang")
-        general_loader.add_xpath("language", '//meta[@property="og:locale"]/@content')
+        general_loader.add_value("language", xpath_values["lang"])
+        general_loader.add_value("language", xpath_values["og_locale"])
         general_loader.add_value("description", getLRMI("description"))
         general_loader.add_value("description", getLRMI("about"))
-        general_loader.add_xpath("keyword", '//meta[@name="keywords"]/@content', re=r'[^,;\s]+')
+        general_loader.add_value("keyword", xpath_values["keywords"], re=r'[^,;\s]+')
         # general_loader.add_value("keyword", getLRMI("keywords"))
 
-        if self.ai_enabled:
-            excerpt = text_html2text[:4000]
-            # todo: turn this "inside out" - don't pass the loaders,
-            # but return structured data and load it here
-            self.query_llm(excerpt, general_loader,
-                           base_loader, valuespace_loader)
-
-            kidra_loader.add_value(
-                "curriculum", self.zapi_get_curriculum(excerpt))
-            classification, reading_time = self.zapi_get_statistics(excerpt)
-            kidra_loader.add_value("text_difficulty", classification)
-            kidra_loader.add_value("text_reading_time", reading_time)
-            kidra_loader.add_value(
-                "kidraDisciplines", self.zapi_get_disciplines(excerpt))
-            # ToDo: map/replace the previously set 'language'-value by AI suggestions from Z-API?
-            base_loader.add_value("kidra_raw", kidra_loader.load_item())
-        else:
+        # Metadata inheritance
+        if 'virtual:licenseurl' in inherited_fields:
+            log.info("Adding inherited license URL: %s", inherited_fields['virtual:licenseurl'])
+            license_loader.add_value("url", inherited_fields['virtual:licenseurl'])
+
+        if trafilatura_license_detected := trafilatura_meta.get("license"):
+            license_mapper = LicenseMapper()
+            license_url_mapped = license_mapper.get_license_url(
+                license_string=trafilatura_license_detected
+            )
+            # ToDo: this is a really risky assignment! Validation of trafilatura's license detection
+            #  will be necessary! (this is a metadata field that needs to be confirmed by a human!)
+            license_loader.add_value("url", license_url_mapped)
+
+        if not self.ai_enabled:
             if trafilatura_description := trafilatura_meta.get("description"):
                 general_loader.add_value(
                     "description", trafilatura_description)
             if trafilatura_title := trafilatura_meta.get("title"):
                 general_loader.replace_value("title", trafilatura_title)
+        elif "llm" not in ai_stages:
+            # Without the LLM, the description found by trafilatura is better than none
+            general_loader.add_value("description", trafilatura_meta.get("description"))
+
+        def notify(stage: str, fields: dict[str, Any]):
+            if on_update is not None:
+                # The loaders return their own lists, which are extended later
+                on_update(stage, copy.deepcopy(fields))
+
+        if on_update is not None:
+            # Until the LLM has answered, the description found by
+            # trafilatura is better than none
+            notify("page", {
+                "title": general_loader.get_output_value("title"),
+                "description": (general_loader.get_output_value("description")
+                                or trafilatura_meta.get("description")),
+                "keyword": general_loader.get_output_value("keyword"),
+                "language": general_loader.get_output_value("language"),
+                "thumbnail": base_loader.get_output_value("thumbnail"),
+                "license": license_loader.get_output_value("url"),
+            })
+
+        loaders_time = time.perf_counter() - loaders_start
+        if ai_stages:
+            blocks = page_text["blocks"]
+
+            # The AI services are independent of each other, so they are
+            # queried at the same time
+            async def llm():
+                # todo: turn this "inside out" - don't pass the loaders,
+                # but return structured data and load it here
+                with self.stage("llm"):
+                    await self.query_llm(self.get_excerpt("llm", blocks, text_html2text), general_loader,
+                                         base_loader, valuespace_loader, token_budget)
+                notify("llm", {
+                    "description": general_loader.get_output_value("description"),
+                    "keyword": general_loader.get_output_value("keyword"),
+                    **{key: valuespace_loader.get_output_value(key) for key in
+                       ("discipline", "educationalContext", "intendedEndUserRole", "new_lrt")},
+                })
+
+            async def zapi(stage: str, query: Callable[[str], Any], fields: Callable[[Any], dict]):
+                # The Z-API client is synchronous
+                with self.stage(f"zapi_{stage}"):
+                    result = await asyncio.to_thread(
+                        query, self.get_excerpt(f"zapi_{stage}", blocks, text_html2text))
+                notify(stage, fields(result))
+                return result
+
+            queries = {
+                "llm": llm,
+                "curriculum": lambda: zapi("curriculum", self.zapi_get_curriculum,
+                                           lambda r: {"curriculum": r}),
+                "statistics": lambda: zapi("statistics", self.zapi_get_statistics,
+                                           lambda r: {"text_difficulty": r[0], "text_reading_time": r[1]}),
+                "disciplines": lambda: zapi("disciplines", self.zapi_get_disciplines,
+                                            lambda r: {"kidraDisciplines": r}),
+            }
+            stages_run = [stage for stage in queries if stage in ai_stages]
+            results = dict(zip(stages_run, await asyncio.gather(*(queries[stage]() for stage in stages_run))))
+            kidra_loader.add_value("curriculum", results.get("curriculum"))
+            if "statistics" in results:
+                classification, reading_time = results["statistics"]
+                kidra_loader.add_value("text_difficulty", classification)
+                kidra_loader.add_value("text_reading_time", reading_time)
+            kidra_loader.add_value("kidraDisciplines", results.get("disciplines"))
+            # ToDo: map/replace the previously set 'language'-value by AI suggestions from Z-API?
+            base_loader.add_value("kidra_raw", kidra_loader.load_item())
+        loaders_start = time.perf_counter()
 
         # Extract JSON-LD VideoObject metadata
         for obj in lrmi_objects:
@@ -296,24 +583,22 @@ Hier folgt der Text:
         technical_loader.add_value("location", getLRMI("url"))
         technical_loader.add_value("location", response_url)
         technical_loader.replace_value("size", len(playwright_html))
-        technical_loader.add_xpath(
-            "location", '//meta[@property="og:url"]/@content')
+        technical_loader.add_value("location", xpath_values["og_url"])
 
         date: Optional[str] = None
         if trafilatura_meta:
             date = trafilatura_meta.get('date')
         if not date:
-            date = selector_playwright.xpath('//meta[@name="date"]/@content').get()
+            date = next(iter(xpath_values["date"]), None)
 
         self.get_lifecycle_author(
-            lom_loader=lom_loader, selector=selector_playwright, date=date)
+            lom_loader=lom_loader, xpath_values=xpath_values, date=date)
 
         self.get_lifecycle_publisher(
-            lom_loader=lom_loader, selector=selector_playwright, date=date)
+            lom_loader=lom_loader, xpath_values=xpath_values, date=date)
 
         # Detect video from planet-schule:mediatypes meta tag (e.g. "video[Video]")
-        ps_mediatypes = selector_playwright.xpath(
-            '//meta[@name="planet-schule:mediatypes"]/@content').get()
+        ps_mediatypes = next(iter(xpath_values["planet_schule_mediatypes"]), None)
         if ps_mediatypes:
             ps_types = [entry.split("[")[0] for entry in ps_mediatypes.split(",")]
             if "video" in ps_types:
@@ -332,23 +617,9 @@ Hier folgt der Text:
         base_loader.add_value("lom", lom_loader.load_item())
 
         # Todo: does this deal with multiple authors correctly?
-        license_loader.add_xpath("author", '//meta[@name="author"]/@content')
+        license_loader.add_value("author", xpath_values["author"])
         # trafilatura offers a license detection feature as part of its "extract_metadata()"-method
 
-        # Metadata inheritance
-        if 'virtual:licenseurl' in self.inherited_fields:
-            log.info("Adding inherited license URL: %s", self.inherited_fields['virtual:licenseurl'])
-            license_loader.add_value("url", self.inherited_fields['virtual:licenseurl'])
-
-        if trafilatura_license_detected := trafilatura_meta.get("license"):
-            license_mapper = LicenseMapper()
-            license_url_mapped = license_mapper.get_license_url(
-                license_string=trafilatura_license_detected
-            )
-            # ToDo: this is a really risky assignment! Validation of trafilatura's license detection
-            #  will be necessary! (this is a metadata field that needs to be confirmed by a human!)
-            license_loader.add_value("url", license_url_mapped)
-
         # lrmi_intended_end_user_role = getLRMI("audience.educationalRole")
         # if lrmi_intended_end_user_role:
         #     valuespace_loader.add_value("intendedEndUserRole", lrmi_intended_end_user_role)
@@ -375,39 +646,39 @@ Hier folgt der Text:
         base_loader.add_value("permissions", permissions_loader.load_item())
         base_loader.add_value("response", response_loader.load_item())
 
-        return base_loader.load_item()
+        item = base_loader.load_item()
+        self.metrics.observe("loaders", loaders_time + time.perf_counter() - loaders_start)
+        return item
 
     def manual_cleanup_text(self, html_source: str) -> str:
-        parsed_html = BeautifulSoup(html_source, features="lxml")
-        for tag in self.clean_tags:
-            tags = parsed_html.find_all(
-                tag) if parsed_html.find_all(tag) else []
-            for t in tags:
-                t.clear()
-        crawler_ignore = parsed_html.find_all(
-            name=None, attrs={"data-crawler": "ignore"})
-        for t in crawler_ignore:
-            t.clear()
-        html = parsed_html.prettify()
-        h = html2text.HTML2Text()
-        h.ignore_links = True
-        h.ignore_images = True
-        return h.handle(html)
+        return cleanup_text(parse_html(html_source), self.clean_tags)
+
+    def get_excerpt(self, service: str, blocks: list[TextBlock], fallback_text: str) -> str:
+        """ Returns the most informative part of the page that fits into the
+            token budget of the given AI service. """
+        budget = int(self.settings.get(f'GENERIC_CRAWLER_EXCERPT_TOKENS_{service.upper()}',
+                                       self.excerpt_token_budgets[service]))
+        excerpt = build_excerpt(blocks, budget)
+        if not excerpt:
+            # No usable text blocks, e.g. if all text is directly within <div>s
+            excerpt = fallback_text[:budget * 4]
+        self.stats.inc_value(f"excerpt/{service}/count")
+        self.stats.inc_value(f"excerpt/{service}/chars", len(excerpt))
+        self.stats.max_value(f"excerpt/{service}/max_chars", len(excerpt))
+        return excerpt
 
     def get_id(self, response_url: str) -> str:
         """ Return a stable identifier (URI) of the crawled item """
         # TODO: use something more clever
         return response_url
 
-    def get_hash(self) -> str:
+    def get_hash(self, html: str) -> str:
         """ Return a stable hash to detect content changes (for future crawls). """
-        # TODO: this is obviously not stable
-        return f"{datetime.datetime.now().isoformat()}"
+        return content_fingerprint(html, self.hash_version)
 
-    def get_lifecycle_publisher(self, lom_loader: LomBaseItemloader, selector: scrapy.Selector,
+    def get_lifecycle_publisher(self, lom_loader: LomBaseItemloader, xpath_values: dict[str, list[str]],
                                 date: Optional[str]):
-        meta_publisher = selector.xpath(
-            '//meta[@name="publisher"]/@content').get()
+        meta_publisher = next(iter(xpath_values["publisher"]), None)
         if meta_publisher:
             lifecycle_publisher_loader = LomLifecycleItemloader()
             lifecycle_publisher_loader.add_value("role", "publisher")
@@ -418,9 +689,9 @@ Hier folgt der Text:
             lom_loader.add_value(
                 "lifecycle", lifecycle_publisher_loader.load_item())
 
-    def get_lifecycle_author(self, lom_loader: LomBaseItemloader, selector: scrapy.Selector,
+    def get_lifecycle_author(self, lom_loader: LomBaseItemloader, xpath_values: dict[str, list[str]],
                              date: Optional[str]):
-        meta_author = selector.xpath('//meta[@name="author"]/@content').get()
+        meta_author = next(iter(xpath_values["author"]), None)
         if meta_author:
             lifecycle_author_loader = LomLifecycleItemloader()
             lifecycle_author_loader.add_value("role", "author")
@@ -439,12 +710,19 @@ Hier folgt der Text:
     def zapi_get_curriculum(self, text: str) -> list[str]:
         """ Determines the curriculum topic (Lehrplanthema) using the z-API. """
         log.info("zapi_get_curriculum called")
+        cached = self.cache_get("zapi_curriculum", text, self.zapi_cache_version)
+        if cached is not None:
+            return cached
 
         data = models.TopicAssistantKeywordsData(text=text)
         try:
-            result = topics_flat_topics_flat_post.sync(
-                client=self.zapi_client, body=data)
-        except (errors.UnexpectedStatus, httpx.TimeoutException):
+            result = self.zapi_endpoints["curriculum"].call(
+                lambda: topics_flat_topics_flat_post.sync(client=self.zapi_client, body=data),
+                stats=self.stats)
+        except CircuitOpen as e:
+            log.warning("zapi_get_curriculum: %s, skipping.", e)
+            return []
+        except ZAPI_ERRORS:
             log.error(
                 "zapi_get_curriculum: Failed to get curriculum topics from z-API.", exc_info=True)
             return []
@@ -463,34 +741,54 @@ Hier folgt der Text:
 
         n_topics = 3
         topic_uris = [topic.uri for topic in topics[:n_topics]]
+        self.cache_set("zapi_curriculum", text, topic_uris, self.zapi_cache_version)
         return topic_uris
 
     def zapi_get_statistics(self, text: str) -> tuple[str, float]:
         """ Queries the z-API to get the text difficulty and reading time. """
 
         log.info("zapi_get_statistics called",)
+        cached = self.cache_get("zapi_statistics", text, self.zapi_cache_version)
+        if cached is not None:
+            classification, reading_time = cached
+            return classification, reading_time
+
         data = models.InputData(
             text=text, reading_speed=200, generate_embeddings=False)
         try:
-            result = text_stats_analyze_text_post.sync(
-                client=self.zapi_client, body=data)
-        except (errors.UnexpectedStatus, httpx.TimeoutException):
+            result = self.zapi_endpoints["statistics"].call(
+                lambda: text_stats_analyze_text_post.sync(client=self.zapi_client, body=data),
+                stats=self.stats)
+        except CircuitOpen as e:
+            log.warning("zapi_get_statistics: %s, skipping.", e)
+            return "", 0.0
+        except ZAPI_ERRORS:
             log.error("zapi_get_statistics: Failed to get text statistics from z-API.", exc_info=True)
             return "", 0.0
         log.info("zapi_get_statistics result: %s", result)
 
         # type: ignore
-        return result.classification, round(result.reading_time, 2)
+        statistics = result.classification, round(result.reading_time, 2)
+        self.cache_set("zapi_statistics", text, statistics, self.zapi_cache_version)
+        return statistics
 
     def zapi_get_disciplines(self, text: str) -> list[str]:
         """ Gets the disciplines for a given text using the z-API. """
 
         log.info("zapi_get_disciplines called")
+        cached = self.cache_get("zapi_disciplines", text, self.zapi_cache_version)
+        if cached is not None:
+            return cached
+
         data = models.DisciplinesData(text=text)
         try:
-            result = predict_subjects_kidra_predict_subjects_post.sync(
-                client=self.zapi_client, body=data)
-        except (errors.UnexpectedStatus, httpx.TimeoutException):
+            result = self.zapi_endpoints["disciplines"].call(
+                lambda: predict_subjects_kidra_predict_subjects_post.sync(client=self.zapi_client, body=data),
+                stats=self.stats)
+        except CircuitOpen as e:
+            log.warning("zapi_get_disciplines: %s, skipping.", e)
+            return []
+        except ZAPI_ERRORS:
             log.error("zapi_get_disciplines: Failed to get disciplines from z-API.", exc_info=True)
             return []
         log.info("zapi_get_disciplines result: %s", result)
@@ -500,18 +798,30 @@ Hier folgt der Text:
         discipline_names = [
             uri_discipline + d.id for d in result.disciplines if d.score > min_score  # type: ignore
         ]
-
+        self.cache_set("zapi_disciplines", text, discipline_names, self.zapi_cache_version)
         return discipline_names
 
-    def query_llm(self, excerpt: str, general_loader: LomGeneralItemloader,
-                  base_loader: BaseItemLoader, valuespace_loader: ValuespaceItemLoader):
+    async def query_llm(self, excerpt: str, general_loader: LomGeneralItemloader,
+                        base_loader: BaseItemLoader, valuespace_loader: ValuespaceItemLoader,
+                        token_budget: Optional[TokenBudget] = None):
         """ Performs the LLM queries for the given text, and fills the
             corresponding ItemLoaders. """
 
         log.info("query_llm called")
 
         prompt = self.ALL_IN_ONE_PROMPT % ({'text': excerpt})
-        result = self.call_llm_inner(prompt)
+        # The cached result depends on the prompt templates and the model
+        llm_cache_version = self.llm_model + "\0" + self.ALL_IN_ONE_PROMPT
+        if self.llm_batcher is not None:
+            llm_cache_version += "\0" + self.BATCH_PROMPT
+        result_dict = self.cache_get("llm", excerpt, llm_cache_version)
+        cached = result_dict is not None
+        if result_dict is not None:
+            result = json.dumps(result_dict, ensure_ascii=False)
+        elif self.llm_batcher is not None:
+            prompt, result, result_dict = await self.llm_batcher.query(excerpt, token_budget)
+        else:
+            result = await self.call_llm(prompt, token_budget)
 
         # log prompt and response
         ai_prompt_itemloader = AiPromptItemLoader()
@@ -527,14 +837,15 @@ Hier folgt der Text:
             return
 
         # try to parse the result
-        try:
-            # strip everything up to the first '{' character and after the last '}'
-            result = result[result.find('{'):result.rfind('}') + 1]
-            result_dict = json.loads(result)
-        except json.JSONDecodeError:
-            log.error("Failed to parse JSON response from AI service.", exc_info=True)
-            log.info("AI response: %r", result)
-            return
+        if result_dict is None:
+            try:
+                result_dict = parse_json_response(result)
+            except json.JSONDecodeError:
+                log.error("Failed to parse JSON response from AI service.", exc_info=True)
+                log.info("AI response: %r", result)
+                return
+        if not cached:
+            self.cache_set("llm", excerpt, result_dict, llm_cache_version)
 
         log.info("Structured AI response: %s", result_dict)
 
@@ -577,17 +888,47 @@ Hier folgt der Text:
         process_valuespaces("intendedEndUserRole", intended_end_user_role)
         process_valuespaces("new_lrt", new_lrt)
 
-    def call_llm_inner(self, prompt: str) -> Optional[str]:
+    def cache_get(self, kind: str, text: str, version: str = ""):
+        """ Looks up a previous AI result in the enrichment cache, if enabled. """
+        if self.cache is None:
+            return None
+        return self.cache.get(kind, text, version)
+
+    def cache_set(self, kind: str, text: str, value, version: str = ""):
+        """ Stores an AI result in the enrichment cache, if enabled. """
+        if self.cache is not None:
+            self.cache.set(kind, text, value, version)
+
+    async def call_llm(self, prompt: str, token_budget: Optional[TokenBudget] = None) -> Optional[str]:
+        """ Sends `prompt` to the LLM API (or the Z-API prompt endpoint) in a
+            worker thread. """
+        if self.llm_limiter is not None:
+            # Calls that wait for the limiter only occupy its own threads
+            return await self.llm_limiter.run(self.call_llm_inner, prompt, token_budget)
+        return await asyncio.to_thread(self.call_llm_inner, prompt, token_budget)
+
+    def call_llm_inner(self, prompt: str, token_budget: Optional[TokenBudget] = None) -> Optional[str]:
         if self.llm_client:
+            assert self.llm_limiter is not None
             try:
-                chat_completion = self.llm_client.chat.completions.create(
+                chat_completion = create_chat_completion(
+                    self.llm_client, self.llm_limiter,
                     messages=[{"role": "system", "content": "Du bist ein hilfreicher KI-Assistent der Informationen über Bildungsmaterialien herausfinden soll."}, {
                         "role": "user", "content": prompt}],
-                    model=self.llm_model
+                    model=self.llm_model,
+                    budget=token_budget,
+                    stats=self.stats
                 )
             except openai.APITimeoutError:
                 log.error("LLM API request timed out.")
                 return None
+            except openai.RateLimitError:
+                log.error("LLM API rate limit hit, giving up on this request.")
+                return None
+            except BudgetExhausted as e:
+                log.warning("%s, skipping the LLM request.", e)
+                self.stats.inc_value("llm/budget_exhausted")
+                return None
             except openai.AuthenticationError as e:
                 raise AuthenticationError(
                     "LLM API authentication failed.") from e
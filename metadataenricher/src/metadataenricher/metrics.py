@@ -0,0 +1,107 @@
+""" Latency histograms of the enrichment stages, in the Prometheus text format.
+
+The enricher records how long each stage (rendering, text extraction, the
+item loaders and each AI service) takes. The metadata API exposes these
+values on /metrics. This is a small subset of what prometheus_client does,
+so that the enricher does not need another dependency.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional
+
+# Upper bounds in seconds. Rendering and the AI services take seconds, the
+# loaders only milliseconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, math.inf)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_metric(name: str, kind: str, help_text: str,
+                  samples: Iterable[tuple[Labels, float]]) -> str:
+    """ Returns one metric family, e.g. a counter or gauge, in the text format. """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for labels, value in samples)
+    return "\n".join(lines) + "\n"
+
+
+class Histogram:
+    """ Counts observations in cumulative buckets, like a Prometheus histogram. """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: Labels) -> Iterator[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            bucket_labels = labels + (("le", format_value(bound)),)
+            yield f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+        yield f"{name}_sum{format_labels(labels)} {format_value(self.sum)}"
+        yield f"{name}_count{format_labels(labels)} {self.count}"
+
+
+class StageMetrics:
+    """ Latency histograms per stage of the enricher. Thread-safe, since the
+        Z-API calls are timed in worker threads. """
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """ Records the duration of the `with` block, also if it raises. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def get(self, stage: str) -> Optional[Histogram]:
+        return self._histograms.get(stage)
+
+    def render(self, name: str = "metadataenricher_stage_duration_seconds") -> str:
+        """ Returns the histograms in the Prometheus text format. """
+        lines = [f"# HELP {name} Duration of the enrichment stages",
+                 f"# TYPE {name} histogram"]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                lines.extend(histogram.samples(name, (("stage", stage),)))
+        return "\n".join(lines) + "\n"
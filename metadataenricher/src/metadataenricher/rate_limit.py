@@ -0,0 +1,277 @@
+""" Client-side rate limiting of the LLM API.
+
+All LLM calls of a process (the enricher and the hierarchy inference of the
+ExplorationSpider) go through one LlmRateLimiter, see shared_limiter(). It
+limits
+
+- the requests and the tokens per minute, with a token bucket each, and
+- the number of concurrent requests. This limit adapts (AIMD): it grows by
+  one for every `limit` successful requests, and is halved on a 429 or if a
+  request takes longer than the target latency.
+
+The limiter blocks while a request waits for its slot, so the calls are made
+from threads of the limiter's own executor (LlmRateLimiter.run). Waiting LLM
+calls then can't take the threads of the default executor, which the other
+blocking work (Z-API calls, extraction, thumbnails, caches) shares. Never call
+the limiter on the event loop or reactor thread.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+import openai
+
+log = logging.getLogger(__name__)
+
+# Rough estimate for prompts, ~4 characters per token
+CHARS_PER_TOKEN = 4
+# Assumed size of an answer, until the API reports the actual usage
+DEFAULT_COMPLETION_TOKENS = 500
+# Pause after a 429 without a Retry-After header
+DEFAULT_RETRY_AFTER = 1.0
+# Responses to requests that were sent at the same time arrive together, so
+# the concurrency is decreased at most once within this many seconds
+DECREASE_INTERVAL = 1.0
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class TokenBucket:
+    """ Allows `rate` units per second on average, and bursts of up to
+        `capacity`. Units can be taken on credit, the bucket is then
+        negative and the next callers wait longer. """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """ Seconds until `amount` units are available. """
+        self._refill(now)
+        # Requests larger than the bucket are let through when it is full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.level -= amount
+
+
+class TokenBudget:
+    """ Counts the tokens used by one crawl job (or one request to the
+        metadata API). A `limit` of 0 means no limit. """
+
+    def __init__(self, limit: int = 0):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    @property
+    def exhausted(self) -> bool:
+        return self.limit > 0 and self.used >= self.limit
+
+    def add(self, tokens: int):
+        with self._lock:
+            self.used += tokens
+
+
+class LlmRequest:
+    """ Handle of a request that holds a slot of the limiter. """
+
+    def __init__(self, estimated_tokens: int):
+        self.estimated_tokens = estimated_tokens
+        self.used_tokens: Optional[int] = None
+        self.throttled = False
+        self.retry_after: Optional[float] = None
+
+    def report_usage(self, tokens: int):
+        """ Sets the number of tokens the API actually counted. """
+        self.used_tokens = tokens
+
+    def report_throttled(self, retry_after: Optional[float] = None):
+        """ Marks the request as rejected with a 429. """
+        self.throttled = True
+        self.retry_after = retry_after
+
+
+class LlmRateLimiter:
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = 8, min_concurrency: int = 1, target_latency: float = 0):
+        """ Limits of 0 disable the request/token buckets and the latency signal. """
+        # Bursts of up to 5 seconds worth of requests, and 10 seconds worth of tokens
+        self.requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60 * 5)) \
+            if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute / 6)) \
+            if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(max_concurrency)
+        self.target_latency = target_latency
+        self.in_flight = 0
+        # No requests are sent before this time (time.monotonic) after a 429
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # At most max_concurrency requests are in flight, so more threads would only wait
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm")
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """ Calls `func`, which sends requests through this limiter, in a
+            thread of the limiter's executor. """
+        # Like asyncio.to_thread, so that tracing spans get the right parent
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, func, *args, **kwargs))
+
+    @contextmanager
+    def request(self, estimated_tokens: int, budget: Optional[TokenBudget] = None,
+                stats=None) -> Iterator[LlmRequest]:
+        """ Waits until a request with about `estimated_tokens` tokens may be
+            sent, and holds a slot while the `with` block runs. Raises
+            BudgetExhausted if the job's `budget` is used up. The tokens and
+            waiting times are counted in `stats`, a Scrapy-like stats
+            collector. """
+        if budget is not None and budget.exhausted:
+            raise BudgetExhausted(f"The LLM token budget of {budget.limit} tokens is used up")
+        waited = self._acquire(estimated_tokens)
+        req = LlmRequest(estimated_tokens)
+        start = time.monotonic()
+        try:
+            yield req
+        finally:
+            used = self._release(req, time.monotonic() - start)
+            if budget is not None:
+                budget.add(used)
+            if stats is not None:
+                stats.inc_value("llm/requests")
+                stats.inc_value("llm/tokens", used)
+                stats.inc_value("llm/rate_limit/wait_time", round(waited, 3))
+                if req.throttled:
+                    stats.inc_value("llm/rate_limit/throttled")
+                stats.set_value("llm/rate_limit/concurrency", math.floor(self.concurrency))
+
+    def _acquire(self, estimated_tokens: int) -> float:
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                if self.in_flight >= math.floor(self.concurrency):
+                    # Woken up by _release
+                    self._condition.wait()
+                    continue
+                now = time.monotonic()
+                wait = max([self.paused_until - now] + [bucket.wait_time(amount, now)
+                                                        for bucket, amount in self._buckets(estimated_tokens)])
+                if wait <= 0:
+                    break
+                self._condition.wait(wait)
+            for bucket, amount in self._buckets(estimated_tokens):
+                bucket.take(amount, now)
+            self.in_flight += 1
+        return time.monotonic() - start
+
+    def _buckets(self, estimated_tokens: int) -> list[tuple[TokenBucket, float]]:
+        buckets = []
+        if self.requests is not None:
+            buckets.append((self.requests, 1))
+        if self.tokens is not None:
+            buckets.append((self.tokens, estimated_tokens))
+        return buckets
+
+    def _release(self, req: LlmRequest, latency: float) -> int:
+        """ Frees the slot and adapts the concurrency. Returns the tokens used. """
+        used = req.used_tokens if req.used_tokens is not None else req.estimated_tokens
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if self.tokens is not None and req.used_tokens is not None:
+                # Settle the difference to the estimate
+                self.tokens.take(req.used_tokens - req.estimated_tokens, now)
+            if req.throttled:
+                pause = req.retry_after if req.retry_after is not None else DEFAULT_RETRY_AFTER
+                self.paused_until = max(self.paused_until, now + pause)
+                if self._decrease(now):
+                    log.warning("LLM API rate limit hit, reducing the concurrency to %d",
+                                math.floor(self.concurrency))
+            elif self.target_latency and latency > self.target_latency:
+                if self._decrease(now):
+                    log.info("LLM API latency %.1fs above target, reducing the concurrency to %d",
+                             latency, math.floor(self.concurrency))
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+        return used
+
+    def _decrease(self, now: float) -> bool:
+        if now - self._last_decrease < DECREASE_INTERVAL:
+            return False
+        self._last_decrease = now
+        self.concurrency = max(self.min_concurrency, self.concurrency / 2)
+        return True
+
+
+_shared_limiter: Optional[LlmRateLimiter] = None
+_shared_lock = threading.Lock()
+
+
+def shared_limiter(settings) -> LlmRateLimiter:
+    """ Returns the limiter of this process, created from the
+        GENERIC_CRAWLER_LLM_* settings on the first call. """
+    global _shared_limiter
+    with _shared_lock:
+        if _shared_limiter is None:
+            _shared_limiter = LlmRateLimiter(
+                requests_per_minute=float(settings.get('GENERIC_CRAWLER_LLM_REQUESTS_PER_MINUTE', 0)),
+                tokens_per_minute=float(settings.get('GENERIC_CRAWLER_LLM_TOKENS_PER_MINUTE', 0)),
+                max_concurrency=int(settings.get('GENERIC_CRAWLER_LLM_MAX_CONCURRENCY', 8)),
+                target_latency=float(settings.get('GENERIC_CRAWLER_LLM_TARGET_LATENCY', 0)))
+        return _shared_limiter
+
+
+def get_retry_after(error: openai.APIStatusError) -> Optional[float]:
+    try:
+        return float(error.response.headers.get("retry-after", ""))
+    except ValueError:
+        return None
+
+
+def create_chat_completion(client: openai.OpenAI, limiter: LlmRateLimiter, messages: list[dict],
+                           model: str, budget: Optional[TokenBudget] = None, stats=None,
+                           max_attempts: int = 4):
+    """ Sends a chat completion request through `limiter`, and sends it
+        again (after the pause the limiter imposes) if the API answers with
+        a 429. Raises openai.RateLimitError after `max_attempts`. """
+    estimated = sum(estimate_tokens(message["content"]) for message in messages) + DEFAULT_COMPLETION_TOKENS
+    for attempt in range(1, max_attempts + 1):
+        with limiter.request(estimated, budget, stats) as req:
+            try:
+                completion = client.chat.completions.create(messages=messages, model=model)
+            except openai.RateLimitError as e:
+                req.report_throttled(get_retry_after(e))
+                if attempt == max_attempts:
+                    raise
+                log.info("LLM API rate limit hit, retrying (attempt %d of %d)", attempt, max_attempts)
+                continue
+            if completion.usage is not None:
+                req.report_usage(completion.usage.total_tokens)
+            return completion
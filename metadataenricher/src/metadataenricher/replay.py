@@ -0,0 +1,85 @@
+""" Re-runs the enrichment over a snapshot archive, without a browser and
+without fetching the pages again.
+
+Usage: python -m metadataenricher.replay <snapshots.sqlite3> [options]
+
+Writes one JSON object per item to stdout (or --output).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import sys
+import time
+from typing import Optional
+
+from itemadapter import ItemAdapter
+
+from .config import settings_from_env
+from .metadata_enricher import MetadataEnricher
+from .snapshot_store import SnapshotStore
+
+log = logging.getLogger(__name__)
+
+# Per-process state, set up in init_worker
+_enricher: Optional[MetadataEnricher] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def init_worker(snapshot_path: str, ai_enabled: bool):
+    global _enricher, _loop  # pylint: disable=global-statement
+    _enricher = MetadataEnricher(ai_enabled=ai_enabled)
+    _enricher.setup(settings_from_env())
+    _enricher.set_snapshot_store(SnapshotStore(snapshot_path, readonly=True), replay=True)
+    _loop = asyncio.new_event_loop()
+
+
+def enrich_url(url: str) -> tuple[str, Optional[str]]:
+    """ Enriches a single page from the snapshots, returns it as JSON. """
+    assert _enricher is not None and _loop is not None
+    try:
+        item = _loop.run_until_complete(_enricher.parse_page(url))
+    except Exception:  # pylint: disable=broad-except
+        log.exception("Failed to enrich %s", url)
+        return url, None
+    if item is None:
+        return url, None
+    return url, json.dumps(ItemAdapter(item).asdict(), ensure_ascii=False, default=str)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m metadataenricher.replay", description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("snapshots", help="snapshot archive of a crawl job")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--ai", action="store_true", help="call the AI services (needs network access)")
+    parser.add_argument("--limit", type=int, default=None, help="only replay the first n pages")
+    parser.add_argument("--output", type=argparse.FileType("w", encoding="utf-8"), default=sys.stdout)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+
+    store = SnapshotStore(args.snapshots, readonly=True)
+    urls = store.urls()[:args.limit]
+    store.close()
+    print(f"Replaying {len(urls)} pages with {args.processes} processes", file=sys.stderr)
+
+    start = time.monotonic()
+    failed = 0
+    with multiprocessing.Pool(args.processes, initializer=init_worker,
+                              initargs=(args.snapshots, args.ai)) as pool:
+        for url, result in pool.imap_unordered(enrich_url, urls, chunksize=4):
+            if result is None:
+                failed += 1
+                print(f"Failed: {url}", file=sys.stderr)
+                continue
+            args.output.write(result + "\n")
+
+    elapsed = time.monotonic() - start
+    print(f"Replayed {len(urls) - failed} pages ({failed} failed) in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+""" Circuit breaker and hedged requests for the Z-API endpoints.
+
+Each endpoint (curriculum, statistics, disciplines) gets a ZapiEndpoint.
+Its circuit breaker opens after `failure_threshold` failed calls in a row.
+While it is open, calls fail immediately with CircuitOpen instead of waiting
+for the timeout. After `reset_timeout` seconds one probe call is let through
+(half-open); if it succeeds the circuit closes again, otherwise it stays
+open for another `reset_timeout`.
+
+With hedging enabled, a second identical request is sent if the first one
+has not answered within the p95 latency of the endpoint, and the first
+answer is used. The Z-API client is synchronous, so the slower request
+cannot be cancelled; it finishes in the background.
+
+The calls are made from worker threads (asyncio.to_thread), so all of this
+is thread-based.
+"""
+import concurrent.futures
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Hedging starts once this many latencies have been observed
+MIN_HEDGE_SAMPLES = 20
+# Number of recent latencies the p95 is computed from
+LATENCY_WINDOW = 200
+
+# Runs the requests of hedged calls. Shared by all endpoints; it only limits
+# how many requests are in flight, the threads are started on demand.
+_hedge_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix="zapi-hedge")
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """ Returns whether a call may be made now. In the half-open state,
+            only one probe call is allowed at a time. """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release_probe(self):
+        """ Ends a call that neither succeeded nor failed. """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self) -> bool:
+        """ Counts a failed call. Returns True if the circuit was opened by it. """
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+
+class LatencyTracker:
+    """ Keeps the latencies of the last `window` successful calls. """
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """ Returns e.g. the p95 for a `fraction` of 0.95, or None if too few
+            latencies were observed. """
+        with self._lock:
+            if len(self._latencies) < MIN_HEDGE_SAMPLES:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(fraction * len(latencies)) - 1)]
+
+
+class ZapiEndpoint:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 hedge: bool = False, hedge_percentile: float = 0.95,
+                 failure_exceptions: tuple[type[BaseException], ...] = (Exception,)):
+        """ `failure_exceptions` are the errors that count as failures of the
+            endpoint, e.g. timeouts and HTTP errors. """
+        self.name = name
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latencies = LatencyTracker()
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.failure_exceptions = failure_exceptions
+
+    def call(self, func: Callable[[], T], stats=None) -> T:
+        """ Calls `func` (possibly twice, if hedging) unless the circuit is
+            open. Raises CircuitOpen, or the error of `func`. The breaker
+            state is written to `stats`, a Scrapy-like stats collector. """
+        prefix = f"zapi/{self.name}"
+        if not self.breaker.allow():
+            if stats is not None:
+                stats.inc_value(f"{prefix}/circuit_rejected")
+            raise CircuitOpen(f"The circuit of the Z-API endpoint {self.name} is open")
+        start = time.monotonic()
+        try:
+            result = self._call_hedged(func, stats) if self.hedge else func()
+        except self.failure_exceptions:
+            if self.breaker.record_failure():
+                log.warning("Z-API endpoint %s failed %d times, failing fast for %.0fs",
+                            self.name, self.breaker.failures, self.breaker.reset_timeout)
+                if stats is not None:
+                    stats.inc_value(f"{prefix}/circuit_opened")
+            if stats is not None:
+                stats.inc_value(f"{prefix}/failures")
+                stats.set_value(f"{prefix}/circuit_state", self.breaker.state)
+            raise
+        except BaseException:
+            # Not the endpoint's fault, e.g. a bug in `func`
+            self.breaker.release_probe()
+            raise
+        if self.breaker.state != CLOSED:
+            log.info("Z-API endpoint %s recovered", self.name)
+        self.breaker.record_success()
+        self.latencies.observe(time.monotonic() - start)
+        if stats is not None:
+            stats.set_value(f"{prefix}/circuit_state", self.breaker.state)
+        return result
+
+    def _call_hedged(self, func: Callable[[], T], stats) -> T:
+        delay = self.latencies.percentile(self.hedge_percentile)
+        if delay is None:
+            return func()
+        first = _hedge_executor.submit(func)
+        try:
+            return first.result(timeout=delay)
+        except concurrent.futures.TimeoutError:
+            pass
+        if stats is not None:
+            stats.inc_value(f"zapi/{self.name}/hedged")
+        second = _hedge_executor.submit(func)
+        pending = {first, second}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second and stats is not None:
+                        stats.inc_value(f"zapi/{self.name}/hedge_won")
+                    return future.result()
+                error = future.exception()
+        assert error is not None
+        # Both requests failed
+        raise error
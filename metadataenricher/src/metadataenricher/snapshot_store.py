@@ -0,0 +1,103 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Optional
+
+from .web_tools import UrlDataDict
+
+log = logging.getLogger(__name__)
+
+
+class SnapshotStore:
+    """ Archive of rendered pages (the results of `get_url_data`), so the
+        enrichment can be re-run later without a browser or network access.
+
+        Each crawl job gets its own sqlite file. The HTML is compressed with
+        zlib, screenshots are stored as they are (PNG is already compressed).
+        The methods block on the compression and on sqlite, so call them
+        outside of the event loop (asyncio.to_thread). """
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        if readonly:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                url TEXT PRIMARY KEY,
+                final_url TEXT,
+                headers TEXT,
+                html BLOB NOT NULL,
+                raw_html BLOB,
+                screenshot BLOB,
+                created_at REAL NOT NULL
+            )""")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(snapshots)")]
+        if "raw_html" not in columns:
+            # Archives recorded before the raw HTML was stored
+            self.connection.execute("ALTER TABLE snapshots ADD COLUMN raw_html BLOB")
+        self.connection.commit()
+        log.info("Recording page snapshots to %s", path)
+
+    @staticmethod
+    def path_for_crawl_job(directory: str, crawl_job_id: int) -> str:
+        """ Returns the path of the snapshot archive of a crawl job. """
+        return os.path.join(directory, f"crawl_job_{crawl_job_id}.sqlite3")
+
+    def put(self, url: str, url_data: UrlDataDict):
+        """ Stores the rendered page for `url`, replacing an older snapshot. """
+        html = zlib.compress((url_data["html"] or "").encode("utf-8"))
+        raw_html = url_data.get("raw_html")
+        if raw_html is not None:
+            raw_html = zlib.compress(raw_html.encode("utf-8"))
+        headers = json.dumps(url_data.get("headers")) if url_data.get("headers") is not None else None
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO snapshots (url, final_url, headers, html, raw_html, screenshot, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, url_data.get("url"), headers, html, raw_html, url_data.get("screenshot_bytes"), time.time()))
+            self.connection.commit()
+
+    def get(self, url: str) -> Optional[UrlDataDict]:
+        """ Returns the rendered page for `url`, or None if there is no snapshot. """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT final_url, headers, html, raw_html, screenshot FROM snapshots WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        final_url, headers, html, raw_html, screenshot = row
+        return {"html": zlib.decompress(html).decode("utf-8"),
+                "raw_html": zlib.decompress(raw_html).decode("utf-8") if raw_html is not None else None,
+                "url": final_url or url,
+                "headers": json.loads(headers) if headers is not None else None,
+                "cookies": None,
+                "har": None,
+                "screenshot_bytes": screenshot}
+
+    def urls(self) -> list[str]:
+        """ Returns the URLs of all snapshots, in the order they were recorded. """
+        with self._lock:
+            return [row[0] for row in self.connection.execute(
+                "SELECT url FROM snapshots ORDER BY created_at")]
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            return self.connection.execute(
+                "SELECT 1 FROM snapshots WHERE url = ?", (url,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM snapshots").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
@@ -0,0 +1,39 @@
+import threading
+from typing import Any
+
+
+class EnricherStats:
+    """ Minimal stats collector for the MetadataEnricher.
+
+        It implements the subset of Scrapy's StatsCollector interface that we
+        use, so a spider can replace it with `crawler.stats` and the counters
+        show up in the crawl stats. Outside of Scrapy (e.g. in the metadata
+        API), the values are kept in memory. """
+
+    def __init__(self):
+        self._stats: dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def get_value(self, key: str, default: Any = None) -> Any:
+        return self._stats.get(key, default)
+
+    def get_stats(self) -> dict[str, Any]:
+        with self._lock:
+            return dict(self._stats)
+
+    def set_value(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._stats[key] = value
+
+    def inc_value(self, key: str, count: int = 1, start: int = 0) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.setdefault(key, start) + count
+
+    def max_value(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._stats[key] = max(self._stats.setdefault(key, value), value)
+
+    def min_value(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._stats[key] = min(self._stats.setdefault(key, value), value)
+
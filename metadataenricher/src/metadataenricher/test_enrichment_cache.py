@@ -0,0 +1,87 @@
+import sqlite3
+import time
+
+import pytest
+
+from .enrichment_cache import EnrichmentCache
+from .stats import EnricherStats
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "enrichment_cache.sqlite3")
+
+
+def test_roundtrip(cache_path):
+    stats = EnricherStats()
+    cache = EnrichmentCache(cache_path, stats=stats)
+    assert cache.get("llm", "some text", "v1") is None
+    cache.set("llm", "some text", {"description": "A text", "keywords": ["a", "b"]}, "v1")
+    assert cache.get("llm", "some text", "v1") == {"description": "A text", "keywords": ["a", "b"]}
+    assert stats.get_value("enrichment_cache/hit") == 1
+    assert stats.get_value("enrichment_cache/llm/miss") == 1
+
+
+def test_key_ignores_whitespace(cache_path):
+    cache = EnrichmentCache(cache_path)
+    cache.set("zapi_curriculum", "some   text\n with\twhitespace ", ["uri"])
+    assert cache.get("zapi_curriculum", "some text with whitespace") == ["uri"]
+
+
+def test_kind_and_version_are_part_of_key(cache_path):
+    cache = EnrichmentCache(cache_path)
+    cache.set("llm", "some text", {"a": 1}, "v1")
+    assert cache.get("llm", "some text", "v2") is None
+    assert cache.get("zapi_disciplines", "some text", "v1") is None
+
+
+def test_ttl(cache_path):
+    cache = EnrichmentCache(cache_path, ttl=60)
+    cache.set("llm", "some text", {"a": 1})
+    cache.connection.execute("UPDATE enrichment_cache SET created_at = ?", (time.time() - 120,))
+    assert cache.get("llm", "some text") is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction(cache_path):
+    # Each value takes up 10 bytes, room for two of them
+    cache = EnrichmentCache(cache_path, max_bytes=25)
+    for i in range(3):
+        cache.set("llm", f"text {i}", f"value {i:02}")
+        time.sleep(0.01)
+    # touch the oldest entry, so "text 1" is now the least recently used
+    assert cache.get("llm", "text 0") == "value 00"
+    cache.evict()
+    assert len(cache) == 2
+    assert cache.size() == 20
+    assert cache.get("llm", "text 1") is None
+    assert cache.get("llm", "text 0") == "value 00"
+
+
+def test_persistence(cache_path):
+    cache = EnrichmentCache(cache_path)
+    cache.set("zapi_statistics", "some text", ["classification", 1.5])
+    cache.close()
+
+    cache = EnrichmentCache(cache_path)
+    assert cache.get("zapi_statistics", "some text") == ["classification", 1.5]
+
+
+def test_adds_size_to_old_caches(cache_path):
+    connection = sqlite3.connect(cache_path)
+    connection.execute("""
+        CREATE TABLE enrichment_cache (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )""")
+    key = EnrichmentCache.make_key("llm", "some text")
+    connection.execute("INSERT INTO enrichment_cache VALUES (?, ?, ?, ?)",
+                       (key, '"value"', time.time(), time.time()))
+    connection.commit()
+    connection.close()
+
+    cache = EnrichmentCache(cache_path)
+    assert cache.get("llm", "some text") == "value"
+    assert cache.size() == 7
@@ -0,0 +1,69 @@
+import trafilatura  # type: ignore
+
+from .excerpt import build_excerpt, score_blocks
+from .extraction import parse_html
+
+ARTICLE = ("Plants use the energy of sunlight to convert water and carbon dioxide "
+           "into glucose and oxygen. This process takes place in the chloroplasts. ")
+
+PAGE = f"""
+<html>
+<body>
+<header><p>Welcome to our great learning portal for everyone</p></header>
+<ul class="menu">
+  <li><a href="/a">Biology for beginners and experts</a></li>
+  <li><a href="/b">Chemistry for beginners and experts</a></li>
+</ul>
+<article>
+  <h1>Photosynthesis</h1>
+  <p>{ARTICLE * 3}</p>
+  <h2>Light reactions</h2>
+  <p>The light reactions take place in the thylakoid membranes and produce ATP and NADPH. {ARTICLE}</p>
+  <p data-crawler="ignore">This text should never be part of an excerpt at all.</p>
+</article>
+<footer><p>Copyright 2024 by the people who wrote this page</p></footer>
+</body>
+</html>
+"""
+
+
+def get_blocks():
+    tree = parse_html(PAGE)
+    return score_blocks(tree, trafilatura.extract(tree))
+
+
+def test_score_blocks_skips_boilerplate():
+    texts = [block.text for block in get_blocks()]
+    assert "Photosynthesis" in texts
+    assert not any("Welcome" in text for text in texts)
+    assert not any("Copyright" in text for text in texts)
+    assert not any("never be part" in text for text in texts)
+
+
+def test_main_text_scores_higher_than_links():
+    scores = {block.text: block.score for block in get_blocks()}
+    assert scores["Biology for beginners and experts"] < scores["Light reactions"]
+    assert scores["Biology for beginners and experts"] < scores[(ARTICLE * 3).strip()]
+
+
+def test_build_excerpt_respects_budget():
+    blocks = get_blocks()
+    excerpt = build_excerpt(blocks, 100)
+    assert len(excerpt) <= 100 * 4
+    assert "Photosynthesis" in excerpt
+    assert "Biology" not in excerpt
+
+
+def test_build_excerpt_keeps_document_order():
+    excerpt = build_excerpt(get_blocks(), 10_000)
+    assert excerpt.index("Photosynthesis") < excerpt.index("Light reactions") < excerpt.index("thylakoid")
+
+
+def test_build_excerpt_truncates_long_block():
+    article_block = max(get_blocks(), key=lambda b: b.score)
+    excerpt = build_excerpt([article_block], 50)
+    assert excerpt == article_block.text[:200]
+
+
+def test_build_excerpt_empty():
+    assert build_excerpt([], 1000) == ""
@@ -0,0 +1,93 @@
+import pickle
+
+import lxml.html
+import trafilatura  # type: ignore
+
+from .extraction import extract_page, extract_page_text
+from .util.fingerprint import content_fingerprint
+
+PAGE = """
+<html lang="de">
+<head>
+<title>Page title</title>
+<meta name="description" content="Page description">
+<script type="application/ld+json">[{"@type": "VideoObject", "name": "Video"}, "ignored"]</script>
+<script type="application/ld+json">{"@type": "Article", "name": "Article"}</script>
+<script type="application/ld+json">{not json</script>
+</head>
+<body>
+<nav>Navigation</nav>
+<p>Some content</p>
+<div data-crawler="ignore">Hidden content</div>
+<p>More content</p>
+</body>
+</html>
+"""
+
+
+def test_extract_page():
+    extraction = extract_page(PAGE)
+    assert extraction["metadata"]["title"] == "Page title"
+    assert extraction["metadata"]["description"] == "Page description"
+    assert [o["name"] for o in extraction["lrmi_objects"]] == ["Video", "Article"]
+    assert extraction["selector"].xpath("//html/@lang").get() == "de"
+    assert extraction["main_text"] is None
+
+
+def test_cleaned_text():
+    cleaned_text = extract_page(PAGE)["cleaned_text"]
+    assert "Some content" in cleaned_text
+    assert "More content" in cleaned_text
+    assert "Navigation" not in cleaned_text
+    assert "Hidden content" not in cleaned_text
+
+
+def test_tree_is_not_modified():
+    extraction = extract_page(PAGE, with_main_text=True)
+    html = lxml.html.tostring(extraction["tree"], encoding="unicode")
+    assert "Navigation" in html
+    assert "Hidden content" in html
+    assert extraction["selector"].xpath("//nav/text()").get() == "Navigation"
+
+
+def test_empty_page():
+    extraction = extract_page("")
+    assert extraction["lrmi_objects"] == []
+    assert extraction["selector"].xpath("//title/text()").get() is None
+
+
+def test_extract_page_text():
+    page_text = extract_page_text(PAGE, with_main_text=True, with_blocks=True, hash_version="1")
+    # Sent from the worker processes
+    assert pickle.loads(pickle.dumps(page_text)) == page_text
+    assert page_text["metadata"]["title"] == "Page title"
+    assert "Some content" in page_text["cleaned_text"]
+    assert page_text["fingerprint"] == content_fingerprint(PAGE, "1")
+    # The values for the item loaders of the MetadataEnricher
+    assert page_text["xpath_values"]["title"] == ["Page title"]
+    assert page_text["xpath_values"]["lang"] == ["de"]
+    assert page_text["xpath_values"]["og_image"] == []
+
+
+def test_extract_page_text_extracts_main_text_once(monkeypatch):
+    expected = content_fingerprint(PAGE, "1")
+    calls = []
+    original = trafilatura.extract
+    monkeypatch.setattr(trafilatura, "extract", lambda *args, **kwargs: calls.append(1) or original(*args, **kwargs))
+    page_text = extract_page_text(PAGE, with_main_text=True, hash_version="1")
+    assert page_text["fingerprint"] == expected
+    assert len(calls) == 1
+
+
+def test_extract_page_text_hash_html():
+    raw_html = "<html><head><title>Before rendering</title></head></html>"
+    page_text = extract_page_text(PAGE, hash_version="1", hash_html=raw_html)
+    assert page_text["fingerprint"] == content_fingerprint(raw_html, "1")
+
+
+def test_extract_page_text_defaults():
+    page_text = extract_page_text(PAGE)
+    assert page_text["main_text"] is None
+    assert page_text["blocks"] == []
+    assert page_text["fingerprint"] is None
+    assert extract_page_text("", hash_version="1")["fingerprint"] == content_fingerprint("", "1")
@@ -0,0 +1,23 @@
+import pytest
+
+from .extraction import extract_page_text
+from .extraction_pool import ExtractionPool
+from .util.fingerprint import content_fingerprint
+
+PAGE = """
+<html>
+<head><title>Page title</title></head>
+<body><nav>Navigation</nav><p>Plants use the energy of sunlight to make glucose.</p></body>
+</html>
+"""
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+async def test_extraction_pool(workers):
+    pool = ExtractionPool(workers)
+    try:
+        page_text = await pool.extract_text(PAGE, with_main_text=True, with_blocks=True, hash_version="1")
+        assert page_text == extract_page_text(PAGE, with_main_text=True, with_blocks=True, hash_version="1")
+        assert await pool.fingerprint(PAGE, "1") == content_fingerprint(PAGE, "1")
+    finally:
+        pool.close()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+
+from .llm_batcher import LlmBatcher, parse_json_response
+from .rate_limit import TokenBudget
+from .stats import EnricherStats
+
+SINGLE_PROMPT = "single: %(text)s"
+BATCH_PROMPT = "batch: %(texts)s"
+
+
+class FakeLlm:
+    def __init__(self, batch_answer=None):
+        self.prompts = []
+        self.batch_answer = batch_answer
+
+    async def __call__(self, prompt, budget=None):
+        self.prompts.append(prompt)
+        if prompt.startswith("single: "):
+            return 'Sure! {"description": "%s"}' % prompt[len("single: "):]
+        items = json.loads(prompt[len("batch: "):])
+        if self.batch_answer is not None:
+            return self.batch_answer(items)
+        return json.dumps([{"id": item["id"], "description": item["text"]} for item in items])
+
+
+async def query_all(batcher, texts):
+    return await asyncio.gather(*[batcher.query(text) for text in texts])
+
+
+def test_parse_json_response():
+    assert parse_json_response('Here you go: {"a": [1]} Bye') == {"a": [1]}
+    assert parse_json_response('```json\n[{"id": 0}]\n```', "[", "]") == [{"id": 0}]
+
+
+async def test_batches_concurrent_queries():
+    llm = FakeLlm()
+    stats = EnricherStats()
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=3, window=10, stats=stats)
+    results = await query_all(batcher, ["a", "b", "c"])
+    assert [r.result for r in results] == [{"description": t} for t in "abc"]
+    assert len(llm.prompts) == 1
+    assert stats.get_value("llm_batch/items") == 3
+    # Each result only contains its own text
+    assert [r.prompt for r in results] == ["single: a", "single: b", "single: c"]
+
+
+async def test_flushes_after_window():
+    llm = FakeLlm()
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=10, window=0.01)
+    results = await query_all(batcher, ["a", "b"])
+    assert [r.result for r in results] == [{"description": "a"}, {"description": "b"}]
+    assert len(llm.prompts) == 1
+
+    # a single pending query is sent with the single prompt
+    result = await batcher.query("c")
+    assert result.result == {"description": "c"}
+    assert result.prompt == "single: c"
+
+
+async def test_falls_back_to_single_prompts():
+    # The answer for the second text is missing
+    llm = FakeLlm(batch_answer=lambda items: json.dumps([{"id": 0, "description": "a"}]))
+    stats = EnricherStats()
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=2, window=10, stats=stats)
+    results = await query_all(batcher, ["a", "b"])
+    assert [r.result for r in results] == [{"description": "a"}, {"description": "b"}]
+    assert llm.prompts[1:] == ["single: b"]
+    assert stats.get_value("llm_batch/fallback") == 1
+
+
+async def test_accepts_string_ids():
+    llm = FakeLlm(batch_answer=lambda items: json.dumps(
+        [{"id": str(item["id"]), "description": item["text"]} for item in items]))
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=2, window=10)
+    results = await query_all(batcher, ["a", "b"])
+    assert [r.result for r in results] == [{"description": "a"}, {"description": "b"}]
+    assert len(llm.prompts) == 1
+
+
+async def test_batches_per_budget():
+    llm = FakeLlm()
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=2, window=0.01)
+    job1, job2 = TokenBudget(), TokenBudget()
+    results = await asyncio.gather(batcher.query("a", job1), batcher.query("b", job2),
+                                   batcher.query("c", job1))
+    assert [r.result for r in results] == [{"description": t} for t in "abc"]
+    assert sorted(llm.prompts) == [BATCH_PROMPT % {"texts": json.dumps(
+        [{"id": 0, "text": "a"}, {"id": 1, "text": "c"}], indent=1)}, "single: b"]
+
+
+async def test_falls_back_on_invalid_json():
+    llm = FakeLlm(batch_answer=lambda items: "I can't do that")
+    batcher = LlmBatcher(llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=2, window=10)
+    results = await query_all(batcher, ["a", "b"])
+    assert [r.result for r in results] == [{"description": "a"}, {"description": "b"}]
+    assert sorted(p for p in llm.prompts if p.startswith("single")) == ["single: a", "single: b"]
+
+
+async def test_propagates_errors():
+    async def failing_llm(prompt, budget=None):
+        raise RuntimeError("boom")
+
+    batcher = LlmBatcher(failing_llm, SINGLE_PROMPT, BATCH_PROMPT, batch_size=2, window=10)
+    results = await asyncio.gather(batcher.query("a"), batcher.query("b"), return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
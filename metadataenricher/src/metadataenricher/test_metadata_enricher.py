@@ -222,3 +222,73 @@ async def test_planet_schule_video():
 
     LRT_VIDEO = "http://w3id.org/openeduhub/vocabs/learningResourceType/video"
     assert item['valuespaces']['learningResourceType'][0] == LRT_VIDEO
+
+
+async def test_partial_results(monkeypatch):
+    """ The metadata found in the page is reported before the AI services
+        are queried, and each AI service is reported when it answers. """
+    monkeypatch.setenv("Z_API_KEY", "test")
+    enricher = MetadataEnricher(ai_enabled=True)
+    enricher.setup({})
+    updates = []
+
+    async def query_llm(excerpt, general_loader, base_loader, valuespace_loader, token_budget):
+        assert [stage for stage, _ in updates] == ["page"]
+        general_loader.add_value("keyword", ["ai-keyword"])
+
+    enricher.query_llm = query_llm
+    enricher.zapi_get_curriculum = lambda text: ["curriculum"]
+    enricher.zapi_get_statistics = lambda text: ("easy", 1.5)
+    enricher.zapi_get_disciplines = lambda text: ["discipline"]
+
+    item = await enricher.parse_page_inner(
+        "https://example.com", META_TAGS_DOCUMENT,
+        on_update=lambda stage, fields: updates.append((stage, fields)))
+
+    stage, fields = updates[0]
+    assert stage == "page"
+    assert fields["description"] == "This is a sample description."
+    assert fields["keyword"] == ["keyword1", "keyword2", "keyword3"]
+    results = dict(updates[1:])
+    assert set(results) == {"llm", "curriculum", "statistics", "disciplines"}
+    assert results["llm"]["keyword"] == ["keyword1", "keyword2", "keyword3", "ai-keyword"]
+    assert results["statistics"] == {"text_difficulty": "easy", "text_reading_time": 1.5}
+    assert item["kidra_raw"]["curriculum"] == ["curriculum"]
+    assert item["kidra_raw"]["kidraDisciplines"] == ["discipline"]
+    assert item["lom"]["general"]["keyword"] == ["keyword1", "keyword2", "keyword3", "ai-keyword"]
+    for stage in ("extraction", "loaders", "llm", "zapi_curriculum", "zapi_statistics", "zapi_disciplines"):
+        assert enricher.metrics.get(stage).count == 1, stage
+
+
+def test_stages_for_fields(monkeypatch):
+    monkeypatch.setenv("Z_API_KEY", "test")
+    enricher = MetadataEnricher(ai_enabled=True)
+    assert enricher.stages_for_fields(["lom.general.title", "lom.technical"]) == set()
+    assert enricher.stages_for_fields(["lom.general.keyword"]) == {"llm"}
+    assert enricher.stages_for_fields(["kidra_raw"]) == {"curriculum", "statistics", "disciplines"}
+    assert enricher.stages_for_fields(["lom", "kidra_raw.curriculum"]) == {"llm", "curriculum"}
+
+
+async def test_skipped_stages(monkeypatch):
+    monkeypatch.setenv("Z_API_KEY", "test")
+    enricher = MetadataEnricher(ai_enabled=True)
+    enricher.setup({})
+    called = []
+
+    def service(name, result):
+        def query(*args):
+            called.append(name)
+            return result
+        return query
+
+    enricher.query_llm = service("llm", None)
+    enricher.zapi_get_curriculum = service("curriculum", ["curriculum"])
+    enricher.zapi_get_statistics = service("statistics", ("easy", 1.5))
+    enricher.zapi_get_disciplines = service("disciplines", ["discipline"])
+
+    item = await enricher.parse_page_inner("https://example.com", META_TAGS_DOCUMENT,
+                                           stages={"curriculum"})
+    assert called == ["curriculum"]
+    assert item["kidra_raw"] == {"curriculum": ["curriculum"]}
+    # Without the LLM, the description comes from the page
+    assert item["lom"]["general"]["description"] == "This is a sample description."
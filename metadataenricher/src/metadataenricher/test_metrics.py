@@ -0,0 +1,37 @@
+import pytest
+
+from .metrics import Histogram, StageMetrics, format_metric
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0, float("inf")))
+    for value in (0.05, 0.5, 0.7, 30):
+        histogram.observe(value)
+    lines = list(histogram.samples("duration", (("stage", "render"),)))
+    assert lines == [
+        'duration_bucket{stage="render",le="0.1"} 1',
+        'duration_bucket{stage="render",le="1.0"} 3',
+        'duration_bucket{stage="render",le="+Inf"} 4',
+        'duration_sum{stage="render"} 31.25',
+        'duration_count{stage="render"} 4',
+    ]
+
+
+def test_time_records_failures():
+    metrics = StageMetrics()
+    with pytest.raises(ValueError):
+        with metrics.time("llm"):
+            raise ValueError("timeout")
+    histogram = metrics.get("llm")
+    assert histogram is not None
+    assert histogram.count == 1
+    assert metrics.get("render") is None
+    assert '# TYPE metadataenricher_stage_duration_seconds histogram' in metrics.render()
+
+
+def test_format_metric():
+    text = format_metric("pages", "gauge", "Pages", [((("state", 'say "hi"\n'),), 2), ((), 1.5)])
+    assert text == ('# HELP pages Pages\n'
+                    '# TYPE pages gauge\n'
+                    'pages{state="say \\"hi\\"\\n"} 2\n'
+                    'pages 1.5\n')
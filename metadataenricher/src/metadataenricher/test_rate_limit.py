@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from . import rate_limit
+from .rate_limit import (BudgetExhausted, LlmRateLimiter, TokenBucket, TokenBudget,
+                         create_chat_completion)
+from .stats import EnricherStats
+
+
+def test_token_bucket_wait_time():
+    bucket = TokenBucket(rate=2, capacity=4)
+    bucket.updated = 0.0
+    assert bucket.wait_time(4, now=0.0) == 0
+    bucket.take(4, now=0.0)
+    assert bucket.wait_time(1, now=0.0) == 0.5
+    # Requests larger than the bucket wait until it is full
+    assert bucket.wait_time(100, now=1.0) == 1.0
+    assert bucket.wait_time(1, now=10.0) == 0
+    assert bucket.level == 4
+
+
+def test_concurrency_is_halved_on_throttle_and_grows_again(monkeypatch):
+    monkeypatch.setattr(rate_limit, "DECREASE_INTERVAL", 0)
+    limiter = LlmRateLimiter(max_concurrency=8)
+    with limiter.request(10) as req:
+        req.report_throttled(retry_after=0)
+    assert limiter.concurrency == 4
+    with limiter.request(10) as req:
+        req.report_throttled(retry_after=0)
+    assert limiter.concurrency == 2
+    # Additive increase: +1 after about `concurrency` successful requests
+    for _ in range(3):
+        with limiter.request(10):
+            pass
+    assert 3 <= limiter.concurrency < 3.5
+    assert limiter.in_flight == 0
+
+
+def test_throttles_within_interval_decrease_once():
+    limiter = LlmRateLimiter(max_concurrency=8)
+    for _ in range(3):
+        with limiter.request(10) as req:
+            req.report_throttled(retry_after=0)
+    assert limiter.concurrency == 4
+
+
+def test_budget_and_stats():
+    limiter = LlmRateLimiter()
+    budget = TokenBudget(limit=100)
+    stats = EnricherStats()
+    with limiter.request(50, budget, stats) as req:
+        req.report_usage(120)
+    assert budget.used == 120
+    assert budget.exhausted
+    assert stats.get_value("llm/requests") == 1
+    assert stats.get_value("llm/tokens") == 120
+    with pytest.raises(BudgetExhausted):
+        with limiter.request(50, budget, stats):
+            pass
+    assert stats.get_value("llm/requests") == 1
+
+
+class FakeCompletions:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+
+    def create(self, messages, model):
+        self.calls += 1
+        if self.calls <= self.failures:
+            response = httpx.Response(429, headers={"retry-after": "0"},
+                                      request=httpx.Request("POST", "http://llm/chat/completions"))
+            raise openai.RateLimitError("rate limited", response=response, body=None)
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=42),
+                               choices=[SimpleNamespace(message=SimpleNamespace(content="ok"))])
+
+
+def fake_client(failures: int):
+    completions = FakeCompletions(failures)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions)), completions
+
+
+def test_create_chat_completion_retries_after_429():
+    client, completions = fake_client(failures=2)
+    stats = EnricherStats()
+    completion = create_chat_completion(client, LlmRateLimiter(), [{"role": "user", "content": "Hi"}],
+                                        model="model", stats=stats)
+    assert completion.choices[0].message.content == "ok"
+    assert completions.calls == 3
+    assert stats.get_value("llm/rate_limit/throttled") == 2
+
+
+def test_create_chat_completion_gives_up():
+    client, completions = fake_client(failures=5)
+    with pytest.raises(openai.RateLimitError):
+        create_chat_completion(client, LlmRateLimiter(), [{"role": "user", "content": "Hi"}],
+                               model="model", max_attempts=2)
+    assert completions.calls == 2
+
+
+async def test_run_uses_own_threads():
+    limiter = LlmRateLimiter(max_concurrency=2)
+    names = await asyncio.gather(*[limiter.run(lambda: threading.current_thread().name) for _ in range(4)])
+    assert all(name.startswith("llm") for name in names)
+    assert len(set(names)) <= 2
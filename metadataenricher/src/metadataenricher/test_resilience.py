@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+from . import resilience
+from .resilience import CLOSED, HALF_OPEN, OPEN, CircuitOpen, ZapiEndpoint
+from .stats import EnricherStats
+
+
+def fail():
+    raise TimeoutError("slow")
+
+
+def test_circuit_opens_and_recovers():
+    endpoint = ZapiEndpoint("curriculum", failure_threshold=2, reset_timeout=0.05,
+                            failure_exceptions=(TimeoutError,))
+    stats = EnricherStats()
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            endpoint.call(fail, stats)
+    assert endpoint.breaker.state == OPEN
+    assert stats.get_value("zapi/curriculum/circuit_state") == OPEN
+    assert stats.get_value("zapi/curriculum/circuit_opened") == 1
+
+    calls = []
+    with pytest.raises(CircuitOpen):
+        endpoint.call(lambda: calls.append(1), stats)
+    assert not calls
+    assert stats.get_value("zapi/curriculum/circuit_rejected") == 1
+
+    time.sleep(0.06)
+    assert endpoint.call(lambda: "ok", stats) == "ok"
+    assert endpoint.breaker.state == CLOSED
+    assert stats.get_value("zapi/curriculum/circuit_state") == CLOSED
+
+
+def test_failed_probe_reopens():
+    endpoint = ZapiEndpoint("statistics", failure_threshold=1, reset_timeout=0.05,
+                            failure_exceptions=(TimeoutError,))
+    with pytest.raises(TimeoutError):
+        endpoint.call(fail)
+    time.sleep(0.06)
+    assert endpoint.breaker.allow()
+    assert endpoint.breaker.state == HALF_OPEN
+    # Only one probe at a time
+    assert not endpoint.breaker.allow()
+    endpoint.breaker.record_failure()
+    assert endpoint.breaker.state == OPEN
+
+
+def test_other_errors_do_not_count():
+    endpoint = ZapiEndpoint("disciplines", failure_threshold=1, failure_exceptions=(TimeoutError,))
+    with pytest.raises(KeyError):
+        endpoint.call(lambda: {}["x"])
+    assert endpoint.breaker.state == CLOSED
+
+
+def test_hedged_request_wins(monkeypatch):
+    monkeypatch.setattr(resilience, "MIN_HEDGE_SAMPLES", 1)
+    endpoint = ZapiEndpoint("curriculum", hedge=True)
+    endpoint.latencies.observe(0.01)
+    stats = EnricherStats()
+    first_call = threading.Event()
+    release = threading.Event()
+
+    def query():
+        if not first_call.is_set():
+            first_call.set()
+            # The first request hangs
+            release.wait(5)
+            return "slow"
+        return "fast"
+
+    start = time.monotonic()
+    assert endpoint.call(query, stats) == "fast"
+    release.set()
+    assert time.monotonic() - start < 1
+    assert stats.get_value("zapi/curriculum/hedged") == 1
+    assert stats.get_value("zapi/curriculum/hedge_won") == 1
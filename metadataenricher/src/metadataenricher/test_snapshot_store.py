@@ -0,0 +1,83 @@
+import sqlite3
+
+import pytest
+
+from .metadata_enricher import MetadataEnricher
+from .snapshot_store import SnapshotStore
+from .util.fingerprint import content_fingerprint
+
+HTML = """<html lang="de"><head><title>Page title</title></head>
+<body><p>Some content</p></body></html>"""
+
+
+def make_url_data(html=HTML):
+    return {"html": html,
+            "raw_html": "<html><head><title>Page title</title></head></html>",
+            "url": "https://example.com/final",
+            "headers": {"content-type": "text/html"},
+            "cookies": None,
+            "har": None,
+            "screenshot_bytes": b"\x89PNG..."}
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "crawl_job_1.sqlite3")
+
+
+def test_roundtrip(snapshot_path):
+    store = SnapshotStore(snapshot_path)
+    store.put("https://example.com/", make_url_data())
+    assert store.get("https://example.com/") == make_url_data()
+    assert store.get("https://example.com/other") is None
+    assert "https://example.com/" in store
+    assert len(store) == 1
+
+
+def test_replaces_snapshot(snapshot_path):
+    store = SnapshotStore(snapshot_path)
+    store.put("https://example.com/", make_url_data())
+    store.put("https://example.com/", make_url_data("<html></html>"))
+    assert store.get("https://example.com/")["html"] == "<html></html>"
+    assert store.urls() == ["https://example.com/"]
+
+
+def test_adds_raw_html_column(snapshot_path):
+    connection = sqlite3.connect(snapshot_path)
+    connection.execute("CREATE TABLE snapshots (url TEXT PRIMARY KEY, final_url TEXT, headers TEXT, "
+                       "html BLOB NOT NULL, screenshot BLOB, created_at REAL NOT NULL)")
+    connection.close()
+    store = SnapshotStore(snapshot_path)
+    store.put("https://example.com/", make_url_data())
+    assert store.get("https://example.com/") == make_url_data()
+
+
+def test_readonly(snapshot_path):
+    store = SnapshotStore(snapshot_path)
+    store.put("https://example.com/", make_url_data())
+    store.close()
+
+    store = SnapshotStore(snapshot_path, readonly=True)
+    assert store.get("https://example.com/")["url"] == "https://example.com/final"
+    with pytest.raises(sqlite3.OperationalError):
+        store.put("https://example.com/other", make_url_data())
+
+
+def test_path_for_crawl_job():
+    assert SnapshotStore.path_for_crawl_job("/data", 12) == "/data/crawl_job_12.sqlite3"
+
+
+async def test_enricher_replays_snapshots(snapshot_path):
+    store = SnapshotStore(snapshot_path)
+    store.put("https://example.com/", make_url_data())
+
+    enricher = MetadataEnricher(ai_enabled=False)
+    enricher.setup({})
+    enricher.set_snapshot_store(store, replay=True)
+    item = await enricher.parse_page("https://example.com/", with_screenshot=True)
+    assert item is not None
+    assert item["lom"]["general"]["title"] == "Page title"
+    assert item["screenshot_bytes"] == b"\x89PNG..."
+    # Hashed like a crawler that checks the unrendered page
+    assert item["hash"] == content_fingerprint(make_url_data()["raw_html"], enricher.hash_version)
+    assert await enricher.parse_page("https://example.com/missing") is None
@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+import pytest
+
+from .tracing import NOOP_SPAN, Tracer
+
+
+def read_spans(path) -> dict[str, dict]:
+    with open(path, encoding="utf-8") as f:
+        return {span["name"]: span for span in map(json.loads, f)}
+
+
+def test_disabled():
+    tracer = Tracer()
+    with tracer.span("render", url="https://example.com") as span:
+        assert span is NOOP_SPAN
+
+
+async def test_nested_spans(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    tracer = Tracer()
+    tracer.configure({"GENERIC_CRAWLER_TRACE_FILE": str(path)})
+
+    def extract():
+        with tracer.span("extract"):
+            pass
+
+    with tracer.span("parse_page", url="https://example.com") as span:
+        span.set_attribute("status", 200)
+        await asyncio.gather(asyncio.to_thread(extract), asyncio.create_task(asyncio.sleep(0)))
+        with pytest.raises(ValueError):
+            with tracer.span("llm"):
+                raise ValueError("timeout")
+    with tracer.span("other_page"):
+        pass
+    tracer.close()
+
+    spans = read_spans(path)
+    root = spans["parse_page"]
+    assert root["parentSpanId"] == ""
+    assert root["attributes"] == {"url": "https://example.com", "status": 200}
+    assert root["endTimeUnixNano"] >= root["startTimeUnixNano"]
+    for name in ("extract", "llm"):
+        assert spans[name]["traceId"] == root["traceId"]
+        assert spans[name]["parentSpanId"] == root["spanId"]
+    assert spans["llm"]["status"]["code"] == "ERROR"
+    assert spans["other_page"]["traceId"] != root["traceId"]
+
+
+def test_configure_is_idempotent(tmp_path):
+    tracer = Tracer()
+    settings = {"GENERIC_CRAWLER_TRACE_FILE": str(tmp_path / "trace.jsonl")}
+    tracer.configure(settings)
+    exporter = tracer.exporter
+    tracer.configure(settings)
+    assert tracer.exporter is exporter
+    tracer.configure({})
+    assert not tracer.enabled
@@ -0,0 +1,23 @@
+import asyncio
+
+from .web_tools import CountingSemaphore
+
+
+async def test_counting_semaphore():
+    semaphore = CountingSemaphore(1)
+    await semaphore.acquire()
+    waiter = asyncio.create_task(semaphore.acquire())
+    await asyncio.sleep(0)
+    assert (semaphore.in_use, semaphore.waiting) == (1, 1)
+
+    semaphore.release()
+    await waiter
+    assert (semaphore.in_use, semaphore.waiting) == (1, 0)
+
+    waiter = asyncio.create_task(semaphore.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+    assert (semaphore.in_use, semaphore.waiting) == (1, 0)
+    semaphore.release()
+    assert semaphore.in_use == 0
@@ -0,0 +1,156 @@
+""" Lightweight tracing of the enrichment stages.
+
+Spans are created with `tracer.span(name, **attributes)`, which works in
+sync and async code. The current span is kept in a context variable, so
+spans opened in other tasks or in asyncio.to_thread() get the right parent.
+
+Tracing is off by default, and then a span costs only about a microsecond.
+It is switched on by MetadataEnricher.setup():
+
+- GENERIC_CRAWLER_TRACE_FILE: writes each finished span as one JSON line,
+  with the field names of the OpenTelemetry (OTLP/JSON) span format.
+- GENERIC_CRAWLER_TRACE_OTEL: passes the spans to the OpenTelemetry API
+  instead, so they go to the collector configured for the OpenTelemetry SDK
+  (e.g. with OTEL_EXPORTER_OTLP_ENDPOINT). Needs the opentelemetry packages.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator, Optional
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:
+    otel_trace = None
+
+log = logging.getLogger(__name__)
+
+
+class Span:
+    """ A finished or running span. `set_attribute` can be called while the
+        span is open. """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+class FileExporter:
+    """ Appends finished spans as JSON lines to a file. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Tracer:
+    def __init__(self):
+        self.exporter: Optional[FileExporter] = None
+        self.otel_tracer = None
+        self._config: tuple = (False, "")
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None or self.otel_tracer is not None
+
+    def configure(self, settings):
+        """ Enables tracing according to the GENERIC_CRAWLER_TRACE_* settings.
+            Can be called several times, e.g. by each enricher. """
+        config = (bool(settings.get('GENERIC_CRAWLER_TRACE_OTEL', False)),
+                  settings.get('GENERIC_CRAWLER_TRACE_FILE') or "")
+        if config == self._config:
+            return
+        self.close()
+        self._config = config
+        if settings.get('GENERIC_CRAWLER_TRACE_OTEL', False):
+            if otel_trace is None:
+                raise RuntimeError(
+                    "GENERIC_CRAWLER_TRACE_OTEL is set, but the opentelemetry packages are not installed.")
+            self.otel_tracer = otel_trace.get_tracer("metadataenricher")
+            log.info("Tracing to OpenTelemetry")
+        elif path := settings.get('GENERIC_CRAWLER_TRACE_FILE'):
+            self.exporter = FileExporter(path)
+            log.info("Tracing to %s", path)
+
+    def close(self):
+        if self.exporter is not None:
+            self.exporter.close()
+        self.exporter = None
+        self.otel_tracer = None
+        self._config = (False, "")
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Any]:
+        """ Traces the `with` block. Exceptions are recorded and re-raised. """
+        if self.otel_tracer is not None:
+            with self.otel_tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+                yield otel_span
+            return
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+
+        parent = _current_span.get()
+        span = Span(name, parent.trace_id if parent else os.urandom(16).hex(),
+                    parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            exporter = self.exporter
+            if exporter is not None:
+                exporter.export(span)
+
+
+# One tracer per process, since the browser and the extractors are shared as well
+tracer = Tracer()
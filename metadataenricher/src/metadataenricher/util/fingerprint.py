@@ -0,0 +1,61 @@
+import hashlib
+from typing import Optional
+
+import lxml.html
+import trafilatura  # type: ignore
+from trafilatura.utils import load_html  # type: ignore
+
+from .text_utils import normalize_whitespace
+
+# Metadata that is part of the fingerprint, in addition to the main text.
+# Changes to anything else on the page (ads, navigation, timestamps, session
+# tokens, ...) should not cause the item to be re-enriched.
+FINGERPRINT_META_XPATHS = [
+    '//title//text()',
+    '//meta[@name="description"]/@content',
+    '//meta[@name="keywords"]/@content',
+    '//meta[@property="og:image"]/@content',
+    '//meta[@name="license"]/@content',
+    '//link[@rel="license"]/@href',
+]
+
+
+def content_fingerprint(html: str, version: str = "") -> str:
+    """ Returns a deterministic fingerprint of a page, built from its normalized
+        main text, some key metadata and `version` (e.g. the crawler version,
+        so a new version re-processes everything).
+
+        The format is `<sha256>v<version>`. """
+    tree = _parse(html)
+    if tree is None:
+        h = hashlib.sha256()
+        h.update(normalize_whitespace(html).encode("utf-8"))
+        return f"{h.hexdigest()}v{version}"
+    return tree_fingerprint(tree, version)
+
+
+def tree_fingerprint(tree: lxml.html.HtmlElement, version: str = "",
+                     main_text: Optional[str] = None) -> str:
+    """ Like content_fingerprint, for a page that has already been parsed.
+        `main_text` can be given if the caller already extracted it with
+        main_text_of. """
+    h = hashlib.sha256()
+    for xpath in FINGERPRINT_META_XPATHS:
+        values = [normalize_whitespace(str(v)) for v in tree.xpath(xpath)]
+        h.update(" ".join(values).encode("utf-8"))
+        h.update(b"\0")
+    if main_text is None:
+        main_text = main_text_of(tree)
+    h.update(normalize_whitespace(main_text or "").encode("utf-8"))
+    return f"{h.hexdigest()}v{version}"
+
+
+def main_text_of(tree: lxml.html.HtmlElement) -> Optional[str]:
+    """ The trafilatura main text of the page, as used in the fingerprint. """
+    return trafilatura.extract(tree, include_comments=False)
+
+
+def _parse(html: str) -> Optional[lxml.html.HtmlElement]:
+    if not html or not html.strip():
+        return None
+    return load_html(html)
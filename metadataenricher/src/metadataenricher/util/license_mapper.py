@@ -1,3 +1,4 @@
+import functools
 import logging
 import re
 
@@ -5,6 +6,9 @@ from .constants import Constants
 
 logger = logging.getLogger(__name__)
 
+# Most sites use the same few license strings, so the results are memoized
+CACHE_SIZE = 1024
+
 
 class LicenseMapper:
     """
@@ -24,6 +28,12 @@ class LicenseMapper:
         r"|(?P<PDM>public.?domain|pdm|gemeinfrei)"
         r"|(?P<CC_ZERO>c{2}.?0|cc.zero|creative.?commons.?zero)"
     )
+    # licenses with a deed suffix could appear in two variations, e.g.:
+    # - "deed.de" / "deed.CA" (2-char language code)
+    # - "deed.es_ES" (4-char language code)
+    deed_pattern = re.compile(r"deed\.\w{2}(_?\w{2})?")
+    # URLs that end in "/de", "/de/", "/fr", "/es/" etc.
+    url_language_code_pattern = re.compile(r"/([a-z]{2}/?)$")
 
     # ToDo:
     #  - gather more license string edge-cases from debug crawlers for test cases:
@@ -46,7 +56,7 @@ class LicenseMapper:
         """
         license_string: str = license_string
         if license_string:
-            return self.identify_cc_license(license_string)
+            return self._cached_license_url(license_string)
         else:
             logger.debug(f"LicenseMapper ('url'): The provided '{license_string}' does not seem to be a valid string.")
             return None
@@ -59,13 +69,7 @@ class LicenseMapper:
         """
         license_string: str = license_string
         if license_string:
-            license_string = license_string.lower()
-            copyright_hit = self.identify_if_string_contains_copyright(license_string)
-            internal_hit = self.fallback_to_license_internal_key(license_string)
-            if copyright_hit:
-                return Constants.LICENSE_COPYRIGHT_LAW
-            if internal_hit:
-                return internal_hit
+            return self._cached_license_internal_key(license_string.lower())
         else:
             logger.debug(
                 f"LicenseMapper ('internal'): Could not map '{license_string}' to 'license.internal'-key since it "
@@ -73,6 +77,23 @@ class LicenseMapper:
             )
             return None
 
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _cached_license_url(license_string: str) -> str | None:
+        return LicenseMapper().identify_cc_license(license_string)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _cached_license_internal_key(license_string: str) -> str | None:
+        mapper = LicenseMapper()
+        copyright_hit = mapper.identify_if_string_contains_copyright(license_string)
+        internal_hit = mapper.fallback_to_license_internal_key(license_string)
+        if copyright_hit:
+            return Constants.LICENSE_COPYRIGHT_LAW
+        if internal_hit:
+            return internal_hit
+        return None
+
     @staticmethod
     def identify_if_string_contains_copyright(license_string: str = None) -> bool:
         """
@@ -106,8 +127,9 @@ class LicenseMapper:
         if license_string:
             if self.identify_if_string_contains_copyright(license_string):
                 return Constants.LICENSE_COPYRIGHT_LAW
-            if self.cc_pattern.search(license_string):
-                result_dict = self.cc_pattern.search(license_string).groupdict()
+            cc_match = self.cc_pattern.search(license_string)
+            if cc_match:
+                result_dict = cc_match.groupdict()
                 cc_type = result_dict.get("CC_TYPE")
                 cc_zero = result_dict.get("CC_ZERO")
                 public_domain = result_dict.get("PDM")
@@ -155,17 +177,11 @@ class LicenseMapper:
             if "http://" in license_url_candidate:
                 license_url_candidate = license_url_candidate.replace("http://", "https://")
             if "deed" in license_url_candidate:
-                # licenses with a deed suffix could appear in two variations, e.g.:
-                # - "deed.de" / "deed.CA" (2-char language code)
-                # - "deed.es_ES" (4-char language code)
-                regex_deed = re.compile(r"deed\.\w{2}(_?\w{2})?")
-                regex_deed_hit = regex_deed.search(license_url_candidate)
+                regex_deed_hit = self.deed_pattern.search(license_url_candidate)
                 if regex_deed_hit:
                     deed_hit = regex_deed_hit.group()
                     license_url_candidate = license_url_candidate[: -len(deed_hit)]
-            url_ending_in_two_char_language_code_regex = re.compile(r"/([a-z]{2}/?)$")
-            # RegEx pattern for handling URLs that end in "/de", "/de/", "/fr", "/es/" etc.
-            two_char_language_code_hit = url_ending_in_two_char_language_code_regex.search(license_url_candidate)
+            two_char_language_code_hit = self.url_language_code_pattern.search(license_url_candidate)
             if two_char_language_code_hit:
                 # checks if the URL pattern ends in "/de", "/de/" or any other type of 2-char language code, e.g.:
                 # http://creativecommons.org/licenses/by/3.0/de or https://creativecommons.org/licenses/by/3.0/es/
@@ -181,8 +197,9 @@ class LicenseMapper:
         elif license_string:
             license_string = license_string.lower()
             logger.debug(f"LicenseMapper: Received license string '{license_string}'")
-            if self.cc_pattern.search(license_string):
-                result_dict: dict = self.cc_pattern.search(license_string).groupdict()
+            cc_match = self.cc_pattern.search(license_string)
+            if cc_match:
+                result_dict: dict = cc_match.groupdict()
                 cc_type = result_dict.get("CC_TYPE")
                 cc_version = result_dict.get("CC_VERSION")
                 cc_zero = result_dict.get("CC_ZERO")
@@ -0,0 +1,56 @@
+from .fingerprint import content_fingerprint
+
+PAGE = """
+<html>
+<head>
+  <title>Photosynthesis</title>
+  <meta name="description" content="How plants make food">
+  <meta name="csrf-token" content="%(token)s">
+</head>
+<body>
+  <nav>Home | Biology | %(nav)s</nav>
+  <article>
+    <h1>Photosynthesis</h1>
+    <p>%(text)s</p>
+  </article>
+  <footer>Generated at %(timestamp)s</footer>
+</body>
+</html>
+"""
+
+TEXT = ("Plants use the energy of sunlight to convert water and carbon dioxide "
+        "into glucose and oxygen. This process takes place in the chloroplasts. ") * 5
+
+
+def make_page(text=TEXT, token="abc", nav="Chemistry", timestamp="2024-01-01 12:00"):
+    return PAGE % {"text": text, "token": token, "nav": nav, "timestamp": timestamp}
+
+
+def test_fingerprint_is_deterministic():
+    assert content_fingerprint(make_page(), "1") == content_fingerprint(make_page(), "1")
+
+
+def test_fingerprint_ignores_boilerplate():
+    assert content_fingerprint(make_page(), "1") == content_fingerprint(
+        make_page(token="xyz", timestamp="2025-06-30 08:15"), "1")
+
+
+def test_fingerprint_ignores_whitespace():
+    assert content_fingerprint(make_page(), "1") == content_fingerprint(
+        make_page(text=TEXT.replace(" ", "\n   ")), "1")
+
+
+def test_fingerprint_detects_content_changes():
+    assert content_fingerprint(make_page(), "1") != content_fingerprint(
+        make_page(text=TEXT.replace("glucose", "sugar")), "1")
+    assert content_fingerprint(make_page(), "1") != content_fingerprint(
+        make_page().replace("How plants make food", "How plants grow"), "1")
+
+
+def test_fingerprint_contains_version():
+    assert content_fingerprint(make_page(), "1") != content_fingerprint(make_page(), "2")
+    assert content_fingerprint(make_page(), "0.1.4").endswith("v0.1.4")
+
+
+def test_fingerprint_empty_page():
+    assert content_fingerprint("", "1") == content_fingerprint("   ", "1")
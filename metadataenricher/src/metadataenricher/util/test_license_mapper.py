@@ -79,3 +79,10 @@ class TestLicenseMapper:
     def test_get_license_internal_key(self, test_input, expected_result):
         test_mapper = LicenseMapper()
         assert LicenseMapper.get_license_internal_key(test_mapper, license_string=test_input) == expected_result
+
+    def test_results_are_memoized(self):
+        LicenseMapper._cached_license_url.cache_clear()
+        for _ in range(3):
+            assert LicenseMapper().get_license_url(" CC BY 4.0 ") == Constants.LICENSE_CC_BY_40
+        assert LicenseMapper._cached_license_url.cache_info().misses == 1
+        assert LicenseMapper._cached_license_url.cache_info().hits == 2
@@ -0,0 +1,9 @@
+import re
+
+_whitespace_pattern = re.compile(r"\s+")
+
+
+def normalize_whitespace(text: str) -> str:
+    """ Collapses all runs of whitespace into a single space and strips the
+        result, so that texts which only differ in formatting compare equal. """
+    return _whitespace_pattern.sub(" ", text).strip()
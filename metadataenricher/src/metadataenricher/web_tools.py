@@ -1,18 +1,18 @@
+import asyncio
 import base64
 import logging
 import socket
 import urllib.parse
 from asyncio import Semaphore
-from typing import TypedDict
+from typing import Optional, TypedDict
 
-import html2text
-import trafilatura
-from playwright.async_api import async_playwright
+import playwright.async_api
+from playwright.async_api import Browser, Playwright, async_playwright
 
 from . import env
+from .tracing import tracer
 
 log = logging.getLogger(__name__)
-logging.getLogger("trafilatura").setLevel(logging.INFO)  # trafilatura is quite spammy
 
 ignored_file_extensions: list[str] = [
     # file extensions that cause unexpected behavior when trying to render them with a headless browser
@@ -66,13 +66,44 @@ ignored_file_extensions: list[str] = [
 
 class UrlDataDict(TypedDict):
     html: str
-    text: str
+    # The HTML as served, before rendering. The content fingerprint is built
+    # from it, so it can be checked without rendering the page.
+    raw_html: str | None
+    # URL after redirects
+    url: str
+    headers: dict[str, str] | None
     cookies: dict[str, str] | None
     har: str | None
     screenshot_bytes: bytes | None
 
 
-_sem_playwright: Semaphore = Semaphore(10)
+class CountingSemaphore(Semaphore):
+    """ Semaphore that counts its holders and the tasks waiting for it, so
+        they can be monitored. """
+
+    def __init__(self, value: int):
+        super().__init__(value)
+        self.limit = value
+        self.in_use = 0
+        self.waiting = 0
+
+    async def acquire(self):
+        self.waiting += 1
+        try:
+            await super().acquire()
+        finally:
+            self.waiting -= 1
+        self.in_use += 1
+        return True
+
+    def release(self):
+        self.in_use -= 1
+        super().release()
+
+
+# Number of pages that are rendered at the same time
+MAX_CONCURRENT_PAGES = 10
+page_semaphore: CountingSemaphore = CountingSemaphore(MAX_CONCURRENT_PAGES)
 # reminder: if you increase this Semaphore value, you NEED to change the "browserless v2"-docker-container
 # configuration accordingly! (e.g., by increasing the MAX_CONCURRENT_SESSIONS and MAX_QUEUE_LENGTH configuration
 # settings, see: https://www.browserless.io/docs/docker)
@@ -93,7 +124,61 @@ def replace_host_with_ip(cdp_endpoint: str) -> str:
     return f"{parsed.scheme}://{ip_address}:{port}{path}"
 
 
-async def get_url_data(url: str) -> UrlDataDict | None:
+class BrowserConnection:
+    """ A connection to the browser at PLAYWRIGHT_CDP_ENDPOINT, shared by all
+        page loads of the process instead of connecting for every page. It is
+        re-established if the browser went away. """
+
+    def __init__(self):
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def get(self) -> Browser:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Playwright objects are bound to the event loop they were created in
+            self._playwright = self._browser = None
+            self._loop = loop
+            self._lock = asyncio.Lock()
+        assert self._lock is not None
+        async with self._lock:
+            if self._browser is None or not self._browser.is_connected():
+                await self._disconnect()
+                self._playwright = await async_playwright().start()
+                cdp_endpoint = env.get("PLAYWRIGHT_CDP_ENDPOINT")
+                log.info("PLAYWRIGHT_CDP_ENDPOINT: %s", cdp_endpoint)
+                # Chrome does not allow connections if a host header is sent which is not
+                # localhost or an IP address. Passing headers to connect_over_cdp doesn't
+                # seem to work, so we resolve the IP address here.
+                cdp_endpoint = replace_host_with_ip(cdp_endpoint)
+                log.info("Connecting to the browser at %s", cdp_endpoint)
+                self._browser = await self._playwright.chromium.connect_over_cdp(cdp_endpoint)
+            return self._browser
+
+    async def close(self):
+        if self._lock is None or self._loop is not asyncio.get_running_loop():
+            return
+        async with self._lock:
+            await self._disconnect()
+
+    async def _disconnect(self):
+        try:
+            if self._browser is not None:
+                await self._browser.close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning("Error while disconnecting from the browser: %s", e)
+        finally:
+            self._browser = self._playwright = None
+
+
+browser_connection = BrowserConnection()
+
+
+async def get_url_data(url: str, with_screenshot: bool = True) -> UrlDataDict | None:
     # Ignore URLs that look like binary files.
     # Note that this does not detect the case when a problematic MIME type is served
     # but the URL looks OK.
@@ -104,63 +189,70 @@ async def get_url_data(url: str) -> UrlDataDict | None:
 
     # relevant docs for this implementation: https://hub.docker.com/r/browserless/chrome#playwright and
     # https://playwright.dev/python/docs/api/class-browsertype#browser-type-connect-over-cdp
-    async with _sem_playwright:
-        async with async_playwright() as p:
+    with tracer.span("get_url_data", url=url) as span:
+        with tracer.span("wait_for_page_slot", waiting=page_semaphore.waiting):
+            await page_semaphore.acquire()
+        try:
             log.info("Fetching URL with Playwright: %s", url)
-            cdp_endpoint = env.get("PLAYWRIGHT_CDP_ENDPOINT")
-            log.info("PLAYWRIGHT_CDP_ENDPOINT: %s", cdp_endpoint)
-
-            # Chrome does not allow connections if a host header is sent which is not
-            # localhost or an IP address. Passing headers to connect_over_cdp doesn't
-            # seem to work, so we resolve the IP address here.
-            cdp_endpoint = replace_host_with_ip(cdp_endpoint)
-            log.info("CDP endpoint with resolved IP: %s", cdp_endpoint)
-
-            browser = await p.chromium.connect_over_cdp(cdp_endpoint)
-            # Use the default browser context so extensions (uBlock, ISDCAC) are active
-            context = browser.contexts[0]
-            page = await context.new_page()
-            await page.goto(url, wait_until="load", timeout=90000)
-            # waits for a website to fire the DOMContentLoaded event or for a timeout of 90s
-            # since waiting for 'networkidle' seems to cause timeouts
-            html = await page.content()
-
-            # Use CDP to capture a 2x retina screenshot.
-            # Playwright's page.screenshot() ignores CDP emulation overrides
-            # on the default browser context, so we use raw CDP calls instead.
-            cdp = await context.new_cdp_session(page)
-            await cdp.send("Emulation.setDeviceMetricsOverride", {
-                "width": 1280,
-                "height": 800,
-                "deviceScaleFactor": 2,
-                "mobile": False,
-            })
-            result = await cdp.send("Page.captureScreenshot", {
-                "format": "png",
-                "captureBeyondViewport": False,
-            })
-            screenshot_bytes = base64.b64decode(result["data"])
-            await cdp.detach()
-
-            # ToDo: HAR / cookies
-            #  if we are able to replicate the Splash response with all its fields,
-            #  we could save traffic/requests that are currently still being handled by Splash
-            #  see: https://playwright.dev/python/docs/api/class-browsercontext#browser-context-cookies
-
-        fulltext = ""
-        html_bytes: bytes = html.encode()
-        trafilatura_text: str | None = trafilatura.extract(html_bytes)
-        if trafilatura_text:
-            # trafilatura text extraction is (in general) more precise than html2Text, so we'll use it if available
-            fulltext = trafilatura_text
-        else:
-            h = html2text.HTML2Text()
-            h.ignore_links = True
-            h.ignore_images = True
-            fulltext = h.handle(html)
+            with tracer.span("connect"):
+                browser = await browser_connection.get()
+                # Use the default browser context so extensions (uBlock, ISDCAC) are active
+                context = browser.contexts[0]
+                page = await context.new_page()
+            try:
+                with tracer.span("goto"):
+                    response = await page.goto(url, wait_until="load", timeout=90000)
+                # waits for a website to fire the DOMContentLoaded event or for a timeout of 90s
+                # since waiting for 'networkidle' seems to cause timeouts
+                with tracer.span("content"):
+                    html = await page.content()
+                    raw_html = None
+                    if response is not None:
+                        try:
+                            raw_html = await response.text()
+                        except playwright.async_api.Error as e:
+                            log.warning("Could not get the response body of %s: %s", url, e)
+                final_url = page.url
+                headers = await response.all_headers() if response else None
+                span.set_attribute("status", response.status if response else None)
+                span.set_attribute("html_size", len(html))
+
+                screenshot_bytes = None
+                if with_screenshot:
+                    with tracer.span("screenshot"):
+                        # Use CDP to capture a 2x retina screenshot.
+                        # Playwright's page.screenshot() ignores CDP emulation overrides
+                        # on the default browser context, so we use raw CDP calls instead.
+                        cdp = await context.new_cdp_session(page)
+                        await cdp.send("Emulation.setDeviceMetricsOverride", {
+                            "width": 1280,
+                            "height": 800,
+                            "deviceScaleFactor": 2,
+                            "mobile": False,
+                        })
+                        result = await cdp.send("Page.captureScreenshot", {
+                            "format": "png",
+                            "captureBeyondViewport": False,
+                        })
+                        screenshot_bytes = base64.b64decode(result["data"])
+                        await cdp.detach()
+
+                # ToDo: HAR / cookies
+                #  if we are able to replicate the Splash response with all its fields,
+                #  we could save traffic/requests that are currently still being handled by Splash
+                #  see: https://playwright.dev/python/docs/api/class-browsercontext#browser-context-cookies
+            finally:
+                # The connection stays open, so the page has to be closed explicitly
+                await page.close()
+        finally:
+            page_semaphore.release()
 
+        # Text extraction happens in extraction.extract_page, which parses
+        # the page only once for all extractors.
         return {"html": html,
-                "text": fulltext,
+                "raw_html": raw_html,
+                "url": final_url,
+                "headers": headers,
                 "cookies": None,
                 "har": None,
                 "screenshot_bytes": screenshot_bytes}
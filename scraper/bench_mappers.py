@@ -0,0 +1,93 @@
+""" Measures the language and license normalization with and without the
+memoization in LanguageMapper and LicenseMapper.
+
+The corpus consists of raw values found on crawled sites. Each site repeats
+a few of them, so the values are drawn with a skewed distribution.
+
+Usage: python bench_mappers.py [--items N]
+"""
+import argparse
+import random
+import time
+
+from metadataenricher.util.license_mapper import LicenseMapper
+
+from scraper.util.language_mapper import LanguageMapper
+
+LANGUAGES = ["de", "de-DE", "de_DE", "DE", "deu", "ger", "en", "en-US", "en_GB", "en-GB", "fr-FR", "fra",
+             "Deutsch", "deutsch", "German", "englisch", "English", "französisch", "español", " de ", "no_NO"]
+
+LICENSES = [
+    "https://creativecommons.org/licenses/by/4.0/",
+    "https://creativecommons.org/licenses/by-sa/4.0/deed.de",
+    "http://creativecommons.org/licenses/by-nc-nd/3.0/de/",
+    "https://creativecommons.org/licenses/by-nc-sa/4.0/deed.es_ES",
+    "https://creativecommons.org/publicdomain/zero/1.0/deed.de",
+    "https://creativecommons.org/publicdomain/mark/1.0/",
+    "CC BY 4.0",
+    "CC-BY-SA-4.0",
+    "CC BY-NC-ND",
+    "Public Domain",
+    "Creative Commons (CC) BY-NC-ND Namensnennung-Nicht kommerziell-Keine Bearbeitungen 4.0 International",
+    "Creative Commons (CC) BY-SA Namensnennung-Weitergabe unter gleichen Bedingungen 4.0 International",
+    "Creative Commons (CC) CC0 gemeinfrei (public domain - no rights reserved)",
+    "Copyright Zweites Deutsches Fernsehen, ZDF",
+    "© 2023 Landesbildungsserver. Alle Rechte vorbehalten. Die Inhalte dieser Seite dürfen ohne "
+    "ausdrückliche Genehmigung nicht weiterverwendet werden.",
+]
+
+
+def skewed_sample(rng: random.Random, values: list[str], count: int) -> list[str]:
+    weights = [1 / (rank + 1) for rank in range(len(values))]
+    return rng.choices(values, weights=weights, k=count)
+
+
+def normalize_languages(languages: list[str]):
+    LanguageMapper(languages=languages).normalize_list_of_language_strings()
+
+
+def normalize_license(license_string: str):
+    mapper = LicenseMapper()
+    if mapper.get_license_url(license_string) is None:
+        mapper.get_license_internal_key(license_string)
+
+
+def clear_caches():
+    LanguageMapper._normalize_string_to_language_code.cache_clear()
+    LanguageMapper._find_language_tag.cache_clear()
+    LicenseMapper._cached_license_url.cache_clear()
+    LicenseMapper._cached_license_internal_key.cache_clear()
+
+
+def measure(func, values: list, memoized: bool) -> float:
+    clear_caches()
+    start = time.perf_counter()
+    for value in values:
+        if not memoized:
+            clear_caches()
+        func(value)
+    return (time.perf_counter() - start) / len(values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    languages = [skewed_sample(rng, LANGUAGES, rng.randint(1, 2)) for _ in range(args.items)]
+    licenses = skewed_sample(rng, LICENSES, args.items)
+    # Load babel's locale data and langcodes' name index before measuring
+    normalize_languages(LANGUAGES)
+
+    for name, func, values in (("language", normalize_languages, languages),
+                               ("license", normalize_license, licenses)):
+        uncached = measure(func, values, memoized=False)
+        cached = measure(func, values, memoized=True)
+        print(f"{name}:")
+        print(f"  uncached: {uncached * 1e6:8.1f} µs per item")
+        print(f"  memoized: {cached * 1e6:8.1f} µs per item ({uncached / cached:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+""" Measures the thumbnail generation of the ProcessThumbnailPipeline.
+
+Compares the previous implementation (full decode, both sizes scaled from
+the original in steps of 0.9) with scraper.util.thumbnails.create_thumbnails
+(JPEG draft decoding, direct target size, small thumbnail from the large
+one). Reports images per second and the peak memory (RSS) of a process
+that only creates thumbnails. Needs Linux (/proc).
+
+Usage: python bench_thumbnails.py [--images N] [image ...]
+If no files are given, a synthetic 12 MP photo (JPEG) and a 2x retina
+screenshot (PNG) are used.
+"""
+import argparse
+import base64
+import multiprocessing
+import time
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from scraper.util.thumbnails import ThumbnailSettings, create_thumbnails
+
+
+def legacy_scale_image(img, max_size):
+    w = float(img.width)
+    h = float(img.height)
+    while w * h > max_size:
+        w *= 0.9
+        h *= 0.9
+    return img.resize((int(w), int(h)), Image.Resampling.LANCZOS).convert("RGB")
+
+
+def legacy_create_thumbnails(image_bytes: bytes, settings: ThumbnailSettings = ThumbnailSettings()) -> dict:
+    image = Image.open(BytesIO(image_bytes))
+    small_buffer = BytesIO()
+    large_buffer = BytesIO()
+    if image.format == "PNG":
+        small_copy = image.copy()
+        large_copy = image.copy()
+        small_copy.thumbnail(size=(250, 250))
+        large_copy.thumbnail(size=(800, 800))
+        small_copy.save(small_buffer, format="PNG")
+        large_copy.save(large_buffer, format="PNG")
+        return {"mimetype": "image/png",
+                "small": base64.b64encode(large_buffer.getvalue()).decode(),
+                "large": base64.b64encode(large_buffer.getvalue()).decode()}
+    legacy_scale_image(image, settings.small_size).save(small_buffer, "JPEG", quality=settings.small_quality)
+    legacy_scale_image(image, settings.large_size).save(large_buffer, "JPEG", quality=settings.large_quality)
+    return {"mimetype": "image/jpeg",
+            "small": base64.b64encode(small_buffer.getvalue()).decode(),
+            "large": base64.b64encode(large_buffer.getvalue()).decode()}
+
+
+def synthetic_image(format: str, size: tuple[int, int]) -> bytes:
+    image = Image.linear_gradient("L").resize(size).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for i in range(0, size[0], 40):
+        draw.line((i, 0, size[0] - i, size[1]), fill=(i % 255, 80, 160), width=3)
+    buffer = BytesIO()
+    image.save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+def memory_mb(field: str) -> float:
+    """ Returns VmRSS (current) or VmHWM (peak) of this process. Unlike
+        ru_maxrss, the peak is not inherited from the parent process. """
+    with open("/proc/self/status", encoding="ascii") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise ValueError(field)
+
+
+def run(name: str, image_bytes: bytes, images: int, queue):
+    func = {"legacy": legacy_create_thumbnails, "new": create_thumbnails}[name]
+    before = memory_mb("VmRSS")
+    start = time.perf_counter()
+    for _ in range(images):
+        func(image_bytes)
+    elapsed = time.perf_counter() - start
+    queue.put((images / elapsed, memory_mb("VmHWM") - before))
+
+
+def measure(name: str, image_bytes: bytes, images: int) -> tuple[float, float]:
+    # A fresh process for each run, so that the peak memory is not shared
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run, args=(name, image_bytes, images, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    inputs = {name: open(name, "rb").read() for name in args.files}
+    if not inputs:
+        inputs = {"photo 4000x3000 JPEG": synthetic_image("JPEG", (4000, 3000)),
+                  "screenshot 2560x1600 PNG": synthetic_image("PNG", (2560, 1600))}
+
+    for name, image_bytes in inputs.items():
+        print(f"{name} ({len(image_bytes) // 1024} KiB):")
+        for variant in ("legacy", "new"):
+            rate, memory = measure(variant, image_bytes, args.images)
+            print(f"  {variant:6}: {rate:6.1f} images/s, peak memory +{memory:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
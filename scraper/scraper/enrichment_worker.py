@@ -0,0 +1,194 @@
+""" Enrichment workers for content crawls that use a work queue.
+
+Takes rendered pages from the "enrich" stage of GENERIC_CRAWLER_WORK_QUEUE,
+runs the metadata extraction and the AI enrichment, and puts the items into
+the "upload" stage, which is processed by the content_upload spider.
+
+Each worker process enriches up to GENERIC_CRAWLER_ENRICHMENT_WORKER_CONCURRENCY
+pages at the same time, so that it can wait for several AI services (and fill
+LLM batches) at once.
+
+Usage:
+    python -m scraper.enrichment_worker [--processes N] [--concurrency N]
+    python -m scraper.enrichment_worker --status
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Optional
+
+from metadataenricher.metadata_enricher import MetadataEnricher
+from metadataenricher.rate_limit import TokenBudget
+from scrapy.utils.project import get_project_settings
+
+from scraper.work_queue import (STAGE_ENRICH, STAGE_UPLOAD, STAGES, Task, WorkQueue,
+                                open_work_queue, pack_item, unpack_page)
+
+log = logging.getLogger(__name__)
+
+
+class EnrichmentWorker:
+    """ Processes the tasks of the "enrich" stage, up to `concurrency` at a time. """
+
+    def __init__(self, queue: WorkQueue, settings, consumer: str, poll: float = 1.0,
+                 concurrency: Optional[int] = None):
+        self.queue = queue
+        self.settings = settings
+        self.consumer = consumer
+        self.poll = poll
+        self.max_depth = settings.getint('GENERIC_CRAWLER_WORK_QUEUE_MAX_DEPTH')
+        self.concurrency = concurrency or settings.getint('GENERIC_CRAWLER_ENRICHMENT_WORKER_CONCURRENCY', 8)
+        # One enricher for each value of ai_enabled
+        self.enrichers: dict[bool, MetadataEnricher] = {}
+        # LLM tokens used for each crawl job, by this worker
+        self.token_budgets: dict[Optional[int], TokenBudget] = {}
+        self.stopping = False
+
+    def get_enricher(self, ai_enabled: bool) -> MetadataEnricher:
+        if ai_enabled not in self.enrichers:
+            enricher = MetadataEnricher(ai_enabled=ai_enabled)
+            enricher.setup(self.settings)
+            self.enrichers[ai_enabled] = enricher
+        return self.enrichers[ai_enabled]
+
+    async def run(self):
+        log.info("Enrichment worker %s started, processing up to %d pages at a time",
+                 self.consumer, self.concurrency)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        in_flight: set[asyncio.Task] = set()
+
+        def done(future: asyncio.Task):
+            in_flight.discard(future)
+            semaphore.release()
+
+        while not self.stopping:
+            await semaphore.acquire()
+            await self.wait_for_capacity(in_flight)
+            if self.stopping:
+                break
+            task = await asyncio.to_thread(self.queue.get, STAGE_ENRICH, self.consumer)
+            if task is None:
+                semaphore.release()
+                await asyncio.sleep(self.poll)
+                continue
+            future = asyncio.create_task(self.process(task))
+            in_flight.add(future)
+            future.add_done_callback(done)
+        if in_flight:
+            await asyncio.wait(in_flight)
+        for enricher in self.enrichers.values():
+            enricher.close()
+
+    async def wait_for_capacity(self, in_flight: set[asyncio.Task]):
+        """ Backpressure: don't produce more items than the upload stage can
+            handle, including the ones of the pages that are being enriched. """
+        while self.max_depth > 0 and \
+                await asyncio.to_thread(self.queue.depth, STAGE_UPLOAD) + len(in_flight) >= self.max_depth:
+            await asyncio.sleep(self.poll)
+
+    async def process(self, task: Task):
+        payload = task.payload
+        url, url_data = unpack_page(payload)
+        log.info("Enriching %s (attempt %d)", url, task.attempts)
+        start = time.monotonic()
+        try:
+            enricher = self.get_enricher(payload["ai_enabled"])
+            token_budget = self.token_budgets.setdefault(payload.get("crawl_job_id"),
+                                                         enricher.new_token_budget())
+            # The enricher is shared by the pages of all crawl jobs
+            item = await enricher.enrich_page(url, url_data, source_hash=payload["source_hash"],
+                                              with_screenshot=True, token_budget=token_budget,
+                                              inherited_fields=payload["inherited_fields"])
+        except Exception:  # pylint: disable=broad-except
+            # The task is not acknowledged, so it will be retried after the lease expires
+            log.exception("Failed to enrich %s", url)
+            return
+
+        if payload.get("origin"):
+            item["origin"] = payload["origin"]
+        if not payload.get("dry_run"):
+            await asyncio.to_thread(self.queue.put, STAGE_UPLOAD, {
+                "item": pack_item(item),
+                "crawler_id": payload.get("crawler_id"),
+                "crawl_job_id": payload.get("crawl_job_id"),
+            })
+        await asyncio.to_thread(self.queue.ack, STAGE_ENRICH, task.id)
+        log.info("Enriched %s in %.1fs", url, time.monotonic() - start)
+
+
+def run_worker(queue_url: str, consumer: str, concurrency: Optional[int] = None):
+    """ Entry point of a worker process. """
+    settings = get_project_settings()
+    logging.basicConfig(level=settings.get("LOG_LEVEL"),
+                        format=f"%(asctime)s [{consumer}] %(name)s %(levelname)s: %(message)s")
+    queue = open_work_queue(queue_url, lease=settings.getint('GENERIC_CRAWLER_WORK_QUEUE_LEASE'))
+    worker = EnrichmentWorker(queue, settings, consumer, concurrency=concurrency)
+
+    def stop(signum, frame):  # pylint: disable=unused-argument
+        log.info("Stopping after the current tasks")
+        worker.stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        asyncio.run(worker.run())
+    finally:
+        queue.close()
+
+
+def print_status(queue: WorkQueue):
+    for stage in STAGES:
+        stats = queue.stage_stats(stage)
+        print(f"{stage:>8}: {stats['queued']} queued, {stats['in_flight']} in flight, {stats['dead']} dead")
+
+
+def main(argv: Optional[list[str]] = None):
+    settings = get_project_settings()
+    parser = argparse.ArgumentParser(
+        prog="python -m scraper.enrichment_worker", description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queue", default=settings.get('GENERIC_CRAWLER_WORK_QUEUE'),
+                        help="work queue URL (default: GENERIC_CRAWLER_WORK_QUEUE)")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--concurrency", type=int,
+                        help="pages enriched at the same time by each process "
+                             "(default: GENERIC_CRAWLER_ENRICHMENT_WORKER_CONCURRENCY)")
+    parser.add_argument("--status", action="store_true", help="print the depth of each stage and exit")
+    args = parser.parse_args(argv)
+
+    if not args.queue:
+        parser.error("No work queue configured, set GENERIC_CRAWLER_WORK_QUEUE or use --queue")
+
+    if args.status:
+        queue = open_work_queue(args.queue)
+        print_status(queue)
+        queue.close()
+        return
+
+    hostname = socket.gethostname()
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.queue, f"{hostname}-{os.getpid()}-{i}", args.concurrency))
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # The workers got the SIGINT as well, and finish their current tasks
+        for process in processes:
+            process.join()
+    sys.exit(max(process.exitcode or 0 for process in processes))
+
+
+if __name__ == "__main__":
+    main()
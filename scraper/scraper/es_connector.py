@@ -27,6 +27,7 @@ from edu_sharing_client.api.node_v1_api import NODEV1Api
 from edu_sharing_client.api_client import ApiClient
 from edu_sharing_client.configuration import Configuration
 from edu_sharing_client.rest import ApiException
+from metadataenricher.tracing import tracer
 
 log = logging.getLogger(__name__)
 
@@ -696,13 +697,18 @@ class EduSharing:
         async with self._sem:
             # inserting items is controlled with a Semaphore, otherwise we'd get PoolTimeout Exceptions when there's a
             # temporary burst of items that need to be inserted
-            node = self.sync_node(spider, "ccm:io", self.transform_item(uuid, spider, item))
-            log.info("In insert_item, got node: %s", pprint.pformat(node))
-            self.set_node_permissions(node["ref"]["id"], item)
-            await self.set_node_preview(node["ref"]["id"], item)
-            if not await self.set_node_binary_data(node["ref"]["id"], item):
-                await self.set_node_text(node["ref"]["id"], item)
-            return node
+            with tracer.span("edusharing.insert_item", uuid=uuid):
+                with tracer.span("edusharing.sync_node"):
+                    node = self.sync_node(spider, "ccm:io", self.transform_item(uuid, spider, item))
+                log.info("In insert_item, got node: %s", pprint.pformat(node))
+                with tracer.span("edusharing.set_permissions"):
+                    self.set_node_permissions(node["ref"]["id"], item)
+                with tracer.span("edusharing.set_preview"):
+                    await self.set_node_preview(node["ref"]["id"], item)
+                with tracer.span("edusharing.set_content"):
+                    if not await self.set_node_binary_data(node["ref"]["id"], item):
+                        await self.set_node_text(node["ref"]["id"], item)
+                return node
 
     async def update_item(self, spider, uuid, item):
         await self.insert_item(spider, uuid, item)
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import logging
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse
+
+log = logging.getLogger(__name__)
+
+# The snapshot contains the decoded, uncompressed body as UTF-8
+IGNORED_SNAPSHOT_HEADERS = {"content-encoding", "content-length", "content-type", "transfer-encoding"}
+
+
+class SnapshotReplayMiddleware:
+    """ Answers requests from the snapshot archive of an earlier crawl job, if
+        the spider is replaying one (see ContentSpider.replay_crawl_job_id). """
+
+    def process_request(self, request, spider):
+        store = getattr(spider, "snapshot_replay_store", None)
+        if store is None:
+            return None
+
+        url_data = store.get(request.url)
+        if url_data is None:
+            raise IgnoreRequest(f"No snapshot found for {request.url}")
+
+        headers = {key: value for key, value in (url_data["headers"] or {}).items()
+                   if key.lower() not in IGNORED_SNAPSHOT_HEADERS}
+        headers["Content-Type"] = "text/html; charset=utf-8"
+        # The page as it was served, so the content hash is the same as in the recorded crawl
+        body = url_data.get("raw_html") or url_data["html"]
+        return HtmlResponse(url=request.url, body=body.encode("utf-8"),
+                            encoding="utf-8", headers=headers, request=request)
@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import asyncio
 import base64
 # Define your item pipelines here
 #
@@ -15,7 +16,6 @@ import re
 import time
 from abc import ABCMeta
 from asyncio import Future
-from io import BytesIO
 from typing import BinaryIO, TextIO, Optional
 
 import PIL
@@ -24,9 +24,8 @@ import dateutil.parser
 import isodate
 import scrapy
 import scrapy.crawler
+import scrapy.signals
 import twisted.internet.error
-from PIL import Image
-from async_lru import alru_cache
 from itemadapter import ItemAdapter
 from scrapy import settings
 from scrapy.exceptions import DropItem, CloseSpider
@@ -44,6 +43,10 @@ from scraper.items import BaseItem
 from scraper.spiders.content import ContentSpider
 from scraper.util.edu_sharing_source_template_helper import EduSharingSourceTemplateHelper
 from scraper.util.language_mapper import LanguageMapper
+from scraper.util.thumbnail_cache import ThumbnailCache
+from scraper.util.thumbnail_download import ThumbnailDownloadGuard, download_meta, stopped_reason
+from scraper.util.thumbnails import ThumbnailPool, ThumbnailSettings
+from metadataenricher.tracing import tracer
 from metadataenricher.web_tools import get_url_data
 from valuespace_converter.valuespaces import Valuespaces
 from scraper.log_utils import format_item
@@ -288,27 +291,9 @@ class ProcessValuespacePipeline(BasicPipeline):
             # remap to new i18n layout
             mapped = []
             for entry in json[key]:
-                _id = {}
-                valuespace: list[dict] = self.valuespaces.data[key]
-                found = False
-                for v in valuespace:
-                    labels = list(v["prefLabel"].values())
-                    if "altLabel" in v:
-                        # the Skohub update on 2024-04-19 generates altLabels as a list[str] per language ("de", "en)
-                        # (for details, see: https://github.com/openeduhub/oeh-metadata-vocabs/pull/65)
-                        alt_labels: list[list[str]] = list(v["altLabel"].values())
-                        if alt_labels and isinstance(alt_labels, list):
-                            for alt_label in alt_labels:
-                                if alt_label and isinstance(alt_label, list):
-                                    labels.extend(alt_label)
-                                if alt_label and isinstance(alt_label, str):
-                                    labels.append(alt_label)
-                    labels = list(map(lambda x: x.casefold(), labels))
-                    if v["id"].endswith(entry) or entry.casefold() in labels:
-                        _id = v["id"]
-                        found = True
-                        break
-                if found and len(list(filter(lambda x: x == _id, mapped))) == 0:
+                # matches the end of the concept id or one of its (casefolded) labels
+                _id = self.valuespaces.lookup(key, entry)
+                if _id is not None and _id not in mapped:
                     mapped.append(_id)
             if len(mapped):
                 json[key] = mapped
@@ -324,15 +309,31 @@ class ProcessThumbnailPipeline(BasicPipeline):
     """
     generate thumbnails
     """
+    thumbnail_pool: ThumbnailPool | None = None
+    thumbnail_cache: ThumbnailCache | None = None
 
-    @staticmethod
-    def scale_image(img, max_size):
-        w = float(img.width)
-        h = float(img.height)
-        while w * h > max_size:
-            w *= 0.9
-            h *= 0.9
-        return img.resize((int(w), int(h)), Image.Resampling.LANCZOS).convert("RGB")
+    def open_spider(self, spider):
+        self.thumbnail_pool = ThumbnailPool(int(spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_WORKERS", 0)))
+        # Without a path, the thumbnails are only cached for this crawl job
+        self.thumbnail_cache = ThumbnailCache(
+            spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_PATH") or ":memory:",
+            max_bytes=int(spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_MAX_BYTES", 500 * 1024 * 1024)),
+            url_ttl=float(spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_URL_TTL", 7 * 24 * 60 * 60)),
+            stats=spider.crawler.stats)
+        # Stops thumbnail downloads that are not images or too large while they are running
+        self.download_guard = ThumbnailDownloadGuard(
+            max_bytes=int(spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_MAX_DOWNLOAD_SIZE", 10 * 1024 * 1024)),
+            max_svg_bytes=int(spider.settings.get("THUMBNAIL_MAX_SIZE")),
+            max_pixels=int(spider.settings.get("GENERIC_CRAWLER_THUMBNAIL_MAX_PIXELS", 50_000_000)),
+            stats=spider.crawler.stats)
+        spider.crawler.signals.connect(self.download_guard.headers_received, signal=scrapy.signals.headers_received)
+        spider.crawler.signals.connect(self.download_guard.bytes_received, signal=scrapy.signals.bytes_received)
+
+    def close_spider(self, spider):
+        if self.thumbnail_pool is not None:
+            self.thumbnail_pool.close()
+        if self.thumbnail_cache is not None:
+            self.thumbnail_cache.close()
 
     async def process_item(self, raw_item, spider):
         """
@@ -357,8 +358,7 @@ class ProcessThumbnailPipeline(BasicPipeline):
             log.info("screenshot_bytes provided by crawler, using it to create thumbnail without additional HTTP request")
             # in case we are already using playwright in a spider, we can skip one additional HTTP Request by
             # accessing the (temporary available) "screenshot_bytes"-field
-            img = Image.open(BytesIO(item["screenshot_bytes"]))
-            self.create_thumbnails_from_image_bytes(img, item, settings_crawler)
+            await self.create_thumbnails_from_image_bytes(item["screenshot_bytes"], item, settings_crawler)
             # The final BaseItem data model doesn't use screenshot_bytes.
             # Therefore, we delete it after we're done with processing it
             del item["screenshot_bytes"]
@@ -366,6 +366,15 @@ class ProcessThumbnailPipeline(BasicPipeline):
             log.info("Thumbnail URL provided by crawler, trying to download it: %s", item["thumbnail"])
             # a thumbnail (url) was provided within the item -> we will try to fetch it from the url
             url: str = item["thumbnail"]
+            cached = None
+            if self.thumbnail_cache is not None:
+                cached = await asyncio.to_thread(self.thumbnail_cache.get_by_url, url,
+                                                 ThumbnailSettings.from_settings(settings_crawler))
+            if cached is not None:
+                # Placeholder images are used for many pages, don't download them again
+                log.debug(f"Thumbnail of {url} found in the thumbnail cache.")
+                item["thumbnail"] = cached
+                return raw_item
             time_start: datetime = datetime.datetime.now()
             try:
                 thumbnail_response: scrapy.http.Response = await self.download_thumbnail_url(url, spider)
@@ -384,7 +393,11 @@ class ProcessThumbnailPipeline(BasicPipeline):
                 return await self.process_item(raw_item, spider)
             time_end: datetime = datetime.datetime.now()
             log.debug(f"Loading thumbnail from {url} took {time_end - time_start} (incl. awaiting).")
-            log.debug(f"Thumbnail-URL-Cache: {self.download_thumbnail_url.cache_info()} after trying to query {url} ")
+            if reason := stopped_reason(thumbnail_response):
+                log.warning(f"Thumbnail download of URL {url} was stopped early ({reason}). "
+                            f"Falling back to website screenshot.")
+                del item["thumbnail"]
+                return await self.process_item(raw_item, spider)
             if thumbnail_response.status != 200:
                 log.debug(f"Thumbnail-Pipeline received a unexpected response (status: {thumbnail_response.status}) "
                           f"from {url} (-> resolved URL: {thumbnail_response.url}")
@@ -440,8 +453,7 @@ class ProcessThumbnailPipeline(BasicPipeline):
                 target_url: str = item["lom"]["technical"]["location"][0]
                 playwright_dict = await get_url_data(url=target_url)
                 screenshot_bytes = playwright_dict.get("screenshot_bytes")
-                img = Image.open(BytesIO(screenshot_bytes))
-                self.create_thumbnails_from_image_bytes(img, item, settings_crawler)
+                await self.create_thumbnails_from_image_bytes(screenshot_bytes, item, settings_crawler)
 
         if response is None:
             pass
@@ -466,8 +478,7 @@ class ProcessThumbnailPipeline(BasicPipeline):
                         response.body
                     ).decode()
                 else:
-                    img = Image.open(BytesIO(response.body))
-                    self.create_thumbnails_from_image_bytes(img, item, settings_crawler)
+                    await self.create_thumbnails_from_image_bytes(response.body, item, settings_crawler, url=url)
             except PIL.UnidentifiedImageError:
                 # this error can be observed when a website serves broken / malformed images
                 if url:
@@ -489,25 +500,19 @@ class ProcessThumbnailPipeline(BasicPipeline):
                     )
         return raw_item
 
-    @alru_cache(maxsize=128)
     async def download_thumbnail_url(self, url: str, spider: scrapy.Spider):
         """
-        Download a thumbnail URL and **caches** the result.
+        Download a thumbnail URL.
 
-        The cache works similarly to Python's built-in `functools.lru_cache`-decorator and discards the
-        least recently used items first.
-        (see: https://github.com/aio-libs/async-lru)
-
-        Typical use-case:
-        Some webhosters serve generic placeholder images as their default thumbnail.
-        By caching the response of such URLs, we can save a significant amount of time and traffic.
+        Some webhosters serve generic placeholder images as their default thumbnail. The thumbnails created from
+        them are cached in the thumbnail cache, so such URLs are only downloaded once (see process_item).
 
         :param spider: The spider process that collected the URL.
         :param url: URL of a thumbnail/image.
         :return: Response or None
         """
         try:
-            request = scrapy.Request(url=url, callback=NO_CALLBACK, priority=1)
+            request = scrapy.Request(url=url, callback=NO_CALLBACK, priority=1, meta=download_meta())
             # Thumbnail downloads will be executed with a slightly higher priority (default: 0), so there's less delay
             # between metadata processing and thumbnail retrieval steps in the pipelines
             response: Deferred | Future = await maybe_deferred_to_future(
@@ -520,46 +525,25 @@ class ProcessThumbnailPipeline(BasicPipeline):
     # override the project settings with the given ones from the current spider
     # see PR 56 for details
 
-    def create_thumbnails_from_image_bytes(self, image: Image.Image, item, settings):
-        small_buffer: BytesIO = BytesIO()
-        large_buffer: BytesIO = BytesIO()
-        if image.format == "PNG":
-            # PNG images with image.mode == "RGBA" cannot be converted cleanly to JPEG,
-            # which is why we're handling PNGs separately
-            small_copy = image.copy()
-            large_copy = image.copy()
-            # Pillow modifies the image object in place -> remember to use the correct copy
-            small_copy.thumbnail(size=(250, 250))
-            large_copy.thumbnail(size=(800, 800))
-            # ToDo:
-            #  Rework settings.py thumbnail config to retrieve values as width & height instead of sum(int)
-            small_copy.save(small_buffer, format="PNG")
-            large_copy.save(large_buffer, format="PNG")
-            item["thumbnail"] = {}
-            item["thumbnail"]["mimetype"] = "image/png"
-            item["thumbnail"]["small"] = base64.b64encode(large_buffer.getvalue()).decode()
-            item["thumbnail"]["large"] = base64.b64encode(large_buffer.getvalue()).decode()
-        else:
-            self.scale_image(image, settings.get("THUMBNAIL_SMALL_SIZE")).save(
-                small_buffer,
-                "JPEG",
-                mode="RGB",
-                quality=settings.get("THUMBNAIL_SMALL_QUALITY"),
-            )
-            self.scale_image(image, settings.get("THUMBNAIL_LARGE_SIZE")).save(
-                large_buffer,
-                "JPEG",
-                mode="RGB",
-                quality=settings.get("THUMBNAIL_LARGE_QUALITY"),
-            )
-            item["thumbnail"] = {}
-            item["thumbnail"]["mimetype"] = "image/jpeg"
-            item["thumbnail"]["small"] = base64.b64encode(
-                small_buffer.getvalue()
-            ).decode()
-            item["thumbnail"]["large"] = base64.b64encode(
-                large_buffer.getvalue()
-            ).decode()
+    async def create_thumbnails_from_image_bytes(self, image_bytes: bytes, item, settings, url: str | None = None):
+        """ Scales the image down to the small and large thumbnail, outside of the reactor thread.
+            Images downloaded from `url` are cached by their content, screenshots are not.
+            The cache is accessed from a thread as well, since it uses blocking disk I/O. """
+        if self.thumbnail_pool is None:
+            self.thumbnail_pool = ThumbnailPool()
+        thumbnail_settings = ThumbnailSettings.from_settings(settings)
+        content_hash = None
+        if url is not None and self.thumbnail_cache is not None:
+            content_hash, cached = await asyncio.to_thread(
+                self.thumbnail_cache.get_image, image_bytes, thumbnail_settings, url)
+            if cached is not None:
+                item["thumbnail"] = cached
+                return
+        with tracer.span("create_thumbnails", size=len(image_bytes)):
+            item["thumbnail"] = await self.thumbnail_pool.create_thumbnails(image_bytes, thumbnail_settings)
+        if content_hash is not None:
+            await asyncio.to_thread(self.thumbnail_cache.set, content_hash, item["thumbnail"], url,
+                                    thumbnail_settings)
 
 
 def get_settings_for_crawler(spider) -> scrapy.settings.Settings:
@@ -597,12 +581,11 @@ class EduSharingCheckPipeline(EduSharing, BasicPipeline):
         if db_item:
             if item["hash"] != db_item[1]:
                 log.debug(f"hash has changed, continuing pipelines for item {item['sourceId']}")
+            elif getattr(spider, "forceUpdate", False):
+                log.debug(f"hash unchanged, but updating item {item['sourceId']} anyway")
             else:
                 log.debug(f"hash unchanged, skipping item {item['sourceId']}")
-                # self.update(item['sourceId'], spider)
-                # for tests, we update everything for now
-                # activate this later
-                # raise DropItem()
+                raise DropItem(f"Item {item['sourceId']} has not changed")
         return raw_item
 
 
@@ -612,6 +595,8 @@ class EduSharingStorePipeline(EduSharing, BasicPipeline):
         self.counter = 0
 
     def open_spider(self, spider):
+        # The upload spider has no enricher that would set up the tracing
+        tracer.configure(spider.settings)
         logging.debug("Entering EduSharingStorePipeline...\n"
                       "Checking if 'crawler source template' ('Quellendatensatz-Template') should be used "
                       "(see: 'EDU_SHARING_SOURCE_TEMPLATE_ENABLED' .env setting)...")
@@ -155,3 +155,80 @@ GENERIC_CRAWLER_LLM_API_BASE_URL = env.get("GENERIC_CRAWLER_LLM_API_BASE_URL",
                                            default="https://chat-ai.academiccloud.de/v1")
 GENERIC_CRAWLER_LLM_MODEL = env.get("GENERIC_CRAWLER_LLM_MODEL",
                                     default="meta-llama-3.1-8b-instruct")
+# Send the LLM prompts of up to n concurrently processed pages as one prompt.
+# Prompts are collected for at most GENERIC_CRAWLER_LLM_BATCH_WINDOW seconds.
+GENERIC_CRAWLER_LLM_BATCH_SIZE = int(env.get("GENERIC_CRAWLER_LLM_BATCH_SIZE", default="1"))
+GENERIC_CRAWLER_LLM_BATCH_WINDOW = float(env.get("GENERIC_CRAWLER_LLM_BATCH_WINDOW", default="2.0"))
+# Client-side limits of the LLM API, shared by all LLM calls of the process (0 = no limit).
+# The concurrency starts at GENERIC_CRAWLER_LLM_MAX_CONCURRENCY and is halved when the
+# API answers with 429 or takes longer than GENERIC_CRAWLER_LLM_TARGET_LATENCY seconds.
+GENERIC_CRAWLER_LLM_REQUESTS_PER_MINUTE = float(env.get("GENERIC_CRAWLER_LLM_REQUESTS_PER_MINUTE", default="0"))
+GENERIC_CRAWLER_LLM_TOKENS_PER_MINUTE = float(env.get("GENERIC_CRAWLER_LLM_TOKENS_PER_MINUTE", default="0"))
+GENERIC_CRAWLER_LLM_MAX_CONCURRENCY = int(env.get("GENERIC_CRAWLER_LLM_MAX_CONCURRENCY", default="8"))
+GENERIC_CRAWLER_LLM_TARGET_LATENCY = float(env.get("GENERIC_CRAWLER_LLM_TARGET_LATENCY", default="0"))
+# Maximum number of LLM tokens per crawl job, or per request to the metadata API
+# (0 = no limit). Pages are processed without the LLM once the budget is used up.
+GENERIC_CRAWLER_LLM_TOKEN_BUDGET = int(env.get("GENERIC_CRAWLER_LLM_TOKEN_BUDGET", default="0"))
+# Token budget (~4 characters per token) of the page excerpt sent to each AI service
+GENERIC_CRAWLER_EXCERPT_TOKENS_LLM = int(env.get("GENERIC_CRAWLER_EXCERPT_TOKENS_LLM", default="1000"))
+GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_CURRICULUM = int(env.get("GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_CURRICULUM",
+                                                             default="1000"))
+GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_STATISTICS = int(env.get("GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_STATISTICS",
+                                                             default="1000"))
+GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_DISCIPLINES = int(env.get("GENERIC_CRAWLER_EXCERPT_TOKENS_ZAPI_DISCIPLINES",
+                                                              default="1000"))
+# After this many failed calls in a row, a Z-API endpoint is skipped for
+# GENERIC_CRAWLER_ZAPI_RESET_TIMEOUT seconds, then probed with one call.
+GENERIC_CRAWLER_ZAPI_FAILURE_THRESHOLD = int(env.get("GENERIC_CRAWLER_ZAPI_FAILURE_THRESHOLD", default="5"))
+GENERIC_CRAWLER_ZAPI_RESET_TIMEOUT = float(env.get("GENERIC_CRAWLER_ZAPI_RESET_TIMEOUT", default="30"))
+# Send a second request if a Z-API call takes longer than the p95 latency of its endpoint
+GENERIC_CRAWLER_ZAPI_HEDGE = env.get_bool("GENERIC_CRAWLER_ZAPI_HEDGE", default=False)
+# Number of worker processes for the CPU-bound text extraction (trafilatura,
+# html2text). With 0, the extraction runs in a thread of the crawler process.
+GENERIC_CRAWLER_EXTRACTION_WORKERS = int(env.get("GENERIC_CRAWLER_EXTRACTION_WORKERS", default="0"))
+# Number of worker processes for the thumbnail generation. With 0, thumbnails
+# are created in a thread of the crawler process.
+GENERIC_CRAWLER_THUMBNAIL_WORKERS = int(env.get("GENERIC_CRAWLER_THUMBNAIL_WORKERS", default="0"))
+# Thumbnail downloads are stopped as soon as they exceed this many bytes, or the
+# image header declares more than GENERIC_CRAWLER_THUMBNAIL_MAX_PIXELS pixels
+# (SVGs are limited to THUMBNAIL_MAX_SIZE)
+GENERIC_CRAWLER_THUMBNAIL_MAX_DOWNLOAD_SIZE = int(env.get("GENERIC_CRAWLER_THUMBNAIL_MAX_DOWNLOAD_SIZE",
+                                                          default=str(10 * 1024 * 1024)))
+GENERIC_CRAWLER_THUMBNAIL_MAX_PIXELS = int(env.get("GENERIC_CRAWLER_THUMBNAIL_MAX_PIXELS", default="50000000"))
+# Cache of the thumbnails created from downloaded images, shared by all crawl jobs
+# (a sqlite file). Leave empty to cache the thumbnails only during a crawl job.
+GENERIC_CRAWLER_THUMBNAIL_CACHE_PATH = env.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_PATH", default="")
+GENERIC_CRAWLER_THUMBNAIL_CACHE_MAX_BYTES = int(env.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_MAX_BYTES",
+                                                        default=str(500 * 1024 * 1024)))
+# Thumbnail URLs are downloaded again after this many seconds, in case the image changed
+GENERIC_CRAWLER_THUMBNAIL_CACHE_URL_TTL = int(env.get("GENERIC_CRAWLER_THUMBNAIL_CACHE_URL_TTL",
+                                                      default=str(7 * 24 * 60 * 60)))
+# Directory for the rendered-page archives of each content crawl job (one sqlite
+# file per job). Needed to replay a crawl job (spider argument
+# replay_crawl_job_id). Leave empty to disable recording.
+GENERIC_CRAWLER_SNAPSHOT_DIR = env.get("GENERIC_CRAWLER_SNAPSHOT_DIR", default="")
+# Run the enrichment in separate worker processes (python -m scraper.enrichment_worker)
+# and the upload in the content_upload spider. The ContentSpider then only renders
+# pages and puts them into this queue: a redis:// URL or the path of a sqlite file.
+# Leave empty to do everything in the ContentSpider.
+GENERIC_CRAWLER_WORK_QUEUE = env.get("GENERIC_CRAWLER_WORK_QUEUE", default="")
+# Producers wait while a stage has more unfinished tasks than this (0 = unlimited)
+GENERIC_CRAWLER_WORK_QUEUE_MAX_DEPTH = int(env.get("GENERIC_CRAWLER_WORK_QUEUE_MAX_DEPTH", default="100"))
+# Tasks are handed out again if they are not done after this many seconds
+GENERIC_CRAWLER_WORK_QUEUE_LEASE = int(env.get("GENERIC_CRAWLER_WORK_QUEUE_LEASE", default="600"))
+# Pages that each enrichment worker process enriches at the same time
+GENERIC_CRAWLER_ENRICHMENT_WORKER_CONCURRENCY = int(env.get("GENERIC_CRAWLER_ENRICHMENT_WORKER_CONCURRENCY",
+                                                            default="8"))
+# Persistent cache for LLM / Z-API results, keyed by a fingerprint of the
+# page text. Leave empty to disable.
+GENERIC_CRAWLER_ENRICHMENT_CACHE_PATH = env.get("GENERIC_CRAWLER_ENRICHMENT_CACHE_PATH", default="")
+GENERIC_CRAWLER_ENRICHMENT_CACHE_TTL = int(env.get("GENERIC_CRAWLER_ENRICHMENT_CACHE_TTL",
+                                                   default=str(30 * 24 * 60 * 60)))
+# The least recently used results are evicted when they take up more than this
+GENERIC_CRAWLER_ENRICHMENT_CACHE_MAX_BYTES = int(env.get("GENERIC_CRAWLER_ENRICHMENT_CACHE_MAX_BYTES",
+                                                         default=str(100 * 1024 * 1024)))
+# Tracing of the rendering, extraction, AI and upload steps (see
+# metadataenricher/tracing.py): write the spans as JSON lines to this file,
+# or pass them to OpenTelemetry. Both are off by default.
+GENERIC_CRAWLER_TRACE_FILE = env.get("GENERIC_CRAWLER_TRACE_FILE", default="")
+GENERIC_CRAWLER_TRACE_OTEL = env.get_bool("GENERIC_CRAWLER_TRACE_OTEL", default=False)
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-import datetime
+import asyncio
 import logging
 import json
+import os
 import sqlite3
 from typing import Optional
 
@@ -11,7 +12,10 @@ import playwright.async_api
 import scrapy.signals
 from metadataenricher import metadata_enricher
 from metadataenricher.metadata_enricher import MetadataEnricher
-from scrapy.exceptions import CloseSpider
+from metadataenricher.rate_limit import TokenBudget
+from metadataenricher.snapshot_store import SnapshotStore
+from metadataenricher.util.fingerprint import content_fingerprint
+from scrapy.exceptions import CloseSpider, DontCloseSpider
 from scrapy.http.response import Response
 from scrapy.http.response.text import TextResponse
 from scrapy.spiders import Spider
@@ -22,6 +26,7 @@ from scraper.es_connector import EduSharing
 
 from .. import env
 from ..util.generic_crawler_db import fetch_urls_passing_filterset
+from ..work_queue import STAGE_ENRICH, WorkQueue, open_work_queue, pack_page
 from .state_helper import StateHelper
 from .utils import check_db
 from ..log_utils import format_item
@@ -47,13 +52,16 @@ class ContentSpider(Spider):
             "scraper.pipelines_edusharing.ProcessValuespacePipeline": 250,
             "scraper.pipelines_edusharing.ProcessThumbnailPipeline": 300,
             "scraper.pipelines_edusharing.EduSharingStorePipeline": 1000,
-        }
+        },
+        "DOWNLOADER_MIDDLEWARES": {
+            "scraper.middlewares.SnapshotReplayMiddleware": 50,
+        },
     }
 
     def __init__(self, urltocrawl:str="", ai_enabled:str="True",
                  max_urls:str="3", filter_set_id:str="",
                  crawler_id:str|None=None, crawl_job_id:str|None=None,
-                 dry_run:str|None=None, **kwargs):
+                 dry_run:str|None=None, replay_crawl_job_id:str|None=None, **kwargs):
         EduSharing.resetVersion = True
         super().__init__(**kwargs)
 
@@ -66,6 +74,7 @@ class ContentSpider(Spider):
         log.info("  crawler_id: %r", crawler_id)
         log.info("  crawl_job_id: %r", crawl_job_id)
         log.info("  dry_run: %r", dry_run)
+        log.info("  replay_crawl_job_id: %r", replay_crawl_job_id)
         log.info("  kwargs: %r", kwargs)
         log.info("scraper module: %r", scraper)
         log.info("__file__: %r", __file__)
@@ -74,7 +83,8 @@ class ContentSpider(Spider):
         if urltocrawl and filter_set_id:
             raise ValueError("You must set either 'urltocrawl' or 'filter_set_id', not both.")
 
-        if not urltocrawl and not filter_set_id:
+        # When replaying a crawl job, the URLs can be taken from its snapshots
+        if not urltocrawl and not filter_set_id and not replay_crawl_job_id:
             raise ValueError("You must set either 'urltocrawl' or 'filter_set_id'.")
 
         if filter_set_id != "":
@@ -96,6 +106,19 @@ class ContentSpider(Spider):
         self.crawler_output_node: Optional[str] = None
         self.dry_run = False if dry_run is None else to_bool(dry_run)
         self.crawler_name: Optional[str] = None  # set in spider_opened
+        # Re-run the enrichment on the pages recorded by an earlier crawl job,
+        # without rendering or downloading them again
+        self.replay_crawl_job_id: Optional[int] = int(replay_crawl_job_id) if replay_crawl_job_id else None
+        self.snapshot_replay_store: Optional[SnapshotStore] = None  # set in spider_opened
+        # If set, rendered pages are passed to the enrichment workers (see
+        # scraper.enrichment_worker) instead of being enriched here
+        self.work_queue: Optional[WorkQueue] = None  # set in spider_opened
+        self.llm_token_budget: Optional[TokenBudget] = None  # set in spider_opened
+        # Unfinished tasks of this crawl job in the work queue, as of the last check in spider_idle
+        self.unfinished_tasks: Optional[int] = None
+        self.unfinished_tasks_check: Optional[asyncio.Task] = None
+        # Process items even if their hash has not changed
+        self.forceUpdate = self.replay_crawl_job_id is not None
 
         if crawler_id is None:
             log.info("No crawler_id provided, this is a dry run without "
@@ -116,6 +139,9 @@ class ContentSpider(Spider):
             raise
 
         self.enricher = MetadataEnricher(ai_enabled=ai_enabled_bool)
+        # The content hash is checked before rendering, the enricher has to
+        # compute it the same way if it has to
+        self.enricher.hash_version = self.version
         self.state_helper = StateHelper(self.dry_run,
             int(crawler_id) if crawler_id else None,
             int(crawl_job_id) if crawl_job_id else None)
@@ -127,6 +153,9 @@ class ContentSpider(Spider):
         crawler.signals.connect(spider.spider_opened, signal=scrapy.signals.spider_opened)
         crawler.signals.connect(spider.spider_closed, signal=scrapy.signals.spider_closed)
         crawler.signals.connect(spider.spider_error, signal=scrapy.signals.spider_error)
+        crawler.signals.connect(spider.spider_idle, signal=scrapy.signals.spider_idle)
+        # Report enricher statistics (e.g. cache hits) in the crawl stats
+        spider.enricher.stats = crawler.stats
         return spider
 
     def spider_opened(self, spider: ContentSpider):
@@ -220,16 +249,75 @@ class ContentSpider(Spider):
                         log.warning("Inherited field '%s' not found in source item metadata", field)
                 self.enricher.set_inherited_fields(inherited_fields_data)
 
+        self.setup_snapshots()
         self.enricher.setup(self.settings)
-
-    def spider_closed(self, spider: ContentSpider, reason: str):
+        # LLM tokens used by this crawl job
+        self.llm_token_budget = self.enricher.new_token_budget()
+
+        if work_queue_url := self.settings.get('GENERIC_CRAWLER_WORK_QUEUE'):
+            log.info("Passing rendered pages to the enrichment workers via %s", work_queue_url)
+            self.work_queue = open_work_queue(work_queue_url)
+
+    def setup_snapshots(self):
+        """ Opens the snapshot archive to replay from, or to record to. """
+        snapshot_dir = self.settings.get('GENERIC_CRAWLER_SNAPSHOT_DIR')
+        if self.replay_crawl_job_id is not None:
+            if not snapshot_dir:
+                raise CloseSpider("Replaying a crawl job requires GENERIC_CRAWLER_SNAPSHOT_DIR to be set.")
+            path = SnapshotStore.path_for_crawl_job(snapshot_dir, self.replay_crawl_job_id)
+            log.info("Replaying pages from %s", path)
+            try:
+                self.snapshot_replay_store = SnapshotStore(path, readonly=True)
+                urls = self.snapshot_replay_store.urls()
+            except sqlite3.Error as e:
+                self.spider_failed = True
+                raise CloseSpider(f"Could not open snapshots of crawl job {self.replay_crawl_job_id}: {e}") from e
+            if not self.start_urls:
+                self.start_urls = urls[:self.max_urls]
+            self.enricher.set_snapshot_store(self.snapshot_replay_store, replay=True)
+        elif snapshot_dir and self.crawl_job_id is not None:
+            os.makedirs(snapshot_dir, exist_ok=True)
+            path = SnapshotStore.path_for_crawl_job(snapshot_dir, self.crawl_job_id)
+            self.enricher.set_snapshot_store(SnapshotStore(path))
+
+    def spider_idle(self, spider: ContentSpider):
+        """ Called when all pages are crawled. With a work queue, the crawl job
+            keeps running until the enrichment and upload stages have
+            processed its pages. """
+        if self.work_queue is None or self.dry_run or self.crawl_job_id is None or self.spider_failed:
+            return
+        if self.unfinished_tasks == 0:
+            return
+        # The signal handler can't wait, so the queue is checked in a thread,
+        # and spider_idle is called again a few seconds later
+        if self.unfinished_tasks_check is None or self.unfinished_tasks_check.done():
+            self.unfinished_tasks_check = asyncio.ensure_future(self.check_unfinished_tasks())
+        raise DontCloseSpider
+
+    async def check_unfinished_tasks(self):
+        assert self.work_queue is not None and self.crawl_job_id is not None
+        stats = await asyncio.to_thread(self.work_queue.job_stats, self.crawl_job_id)
+        self.unfinished_tasks = stats["unfinished"]
+        if self.unfinished_tasks:
+            log.info("Waiting for %d pages of crawl job %d in the enrichment and upload stages",
+                     self.unfinished_tasks, self.crawl_job_id)
+
+    async def spider_closed(self, spider: ContentSpider, reason: str):
         """ Called when the spider is closed. """
         log.info("Closed spider %s, reason: %s", spider.name, reason)
+        self.enricher.close()
+        dead = 0
+        if self.work_queue is not None:
+            if not self.dry_run and self.crawl_job_id is not None:
+                dead = (await asyncio.to_thread(self.work_queue.job_stats, self.crawl_job_id))["dead"]
+            self.work_queue.close()
         if self.dry_run:
             return
 
-        # Persist the final processed URL count before updating state
-        self.state_helper.publish_progress_update("", self.items_processed)
+        # Persist the final processed URL count before updating state. With a
+        # work queue, the upload stage counts the processed URLs.
+        if self.work_queue is None:
+            self.state_helper.publish_progress_update("", self.items_processed)
 
         spider_cancelled = reason in ('cancelled', 'shutdown')
 
@@ -238,6 +326,10 @@ class ContentSpider(Spider):
             self.state_helper.update_spider_state(spider, 'FAILED')
         elif spider_cancelled:
             self.state_helper.update_spider_state(spider, 'CANCELED')
+        elif dead:
+            log.error("%d pages of crawl job %d failed in the enrichment or upload stage",
+                      dead, self.crawl_job_id)
+            self.state_helper.update_spider_state(spider, 'FAILED')
         else:
             self.state_helper.update_spider_state(spider, 'COMPLETED')
 
@@ -253,15 +345,20 @@ class ContentSpider(Spider):
         assert response
         return response.url
 
-    def getHash(self, response: Optional[Response] = None) -> str:  # pylint: disable=unused-argument
+    def getHash(self, response: Optional[Response] = None) -> str:
         """
         Return a stable hash to detect content changes (for future crawls).
+
+        The hash is built from the main text and key metadata of the (unrendered)
+        page and the spider version, so it can be checked before the expensive
+        rendering and enrichment.
         """
-        return f"{datetime.datetime.now().isoformat()}v{self.version}"
+        assert isinstance(response, TextResponse)
+        return content_fingerprint(response.text, self.enricher.hash_version)
 
-    def hasChanged(self, response: Response) -> bool:
-        # if self.forceUpdate:
-        #     return True
+    def hasChanged(self, response: Response, source_hash: Optional[str] = None) -> bool:
+        if self.forceUpdate:
+            return True
         # if self.uuid:
         #     if self.getUUID(response) == self.uuid:
         #         logging.info(f"matching requested id: {self.uuid}")
@@ -272,19 +369,25 @@ class ContentSpider(Spider):
         #         logging.info(f"matching requested id: {self.remoteId}")
         #         return True
         #     return False
+        if source_hash is None:
+            source_hash = self.getHash(response)
         db = EduSharing().find_item(self.getId(response), self)
-        if db is None or db[1] != self.getHash(response):
+        if db is None or db[1] != source_hash:
             return True
-        logging.info("Item %s (uuid: %s) has not changed", self.getId(response), db[0])
+        log.info("Item %s (uuid: %s) has not changed", self.getId(response), db[0])
         return False
 
     async def parse(self, response: Response):
-        if not self.hasChanged(response):
-            return
-
         if not isinstance(response, TextResponse):
             log.warning("Response is not a TextResponse, but %s, skipping: %s", type(response), response.url)
             return
+
+        # Skip unchanged pages before rendering and enriching them
+        source_hash = await self.enricher.extraction_pool.fingerprint(response.text, self.enricher.hash_version)
+        if not self.dry_run and not self.hasChanged(response, source_hash):
+            if self.crawler.stats:
+                self.crawler.stats.inc_value("content/unchanged")
+            return
         
         # Respect robots meta tags
         robot_meta_tags: list[str] = response.xpath(
@@ -319,7 +422,11 @@ class ContentSpider(Spider):
                 return
 
         try:
-            item = await self.enricher.parse_page(response_url=response.url)
+            if self.work_queue is not None:
+                await self.enqueue_page(response.url, source_hash)
+                return
+            item = await self.enricher.parse_page(response_url=response.url, source_hash=source_hash,
+                                                  with_screenshot=True, token_budget=self.llm_token_budget)
         except metadata_enricher.AuthenticationError as auth_error:
             log.error("Authentication error while enriching metadata for %s: %s",
                       response.url, auth_error)
@@ -352,6 +459,36 @@ class ContentSpider(Spider):
 
         yield item
 
+    async def enqueue_page(self, url: str, source_hash: str):
+        """ Renders the page and puts it into the work queue of the enrichment workers. """
+        assert self.work_queue is not None
+        # Backpressure: don't render more pages than the workers can handle
+        await self.work_queue.wait_for_capacity(
+            STAGE_ENRICH, self.settings.getint('GENERIC_CRAWLER_WORK_QUEUE_MAX_DEPTH'))
+
+        url_data = await self.enricher.fetch_page(url)
+        if not url_data:
+            log.warning("Could not render %s", url)
+            return
+
+        await asyncio.to_thread(self.work_queue.put, STAGE_ENRICH, pack_page(
+            url, dict(url_data),
+            source_hash=source_hash,
+            ai_enabled=self.enricher.ai_enabled,
+            inherited_fields=self.enricher.inherited_fields,
+            origin=self.crawler_name,
+            crawler_id=self.crawler_id,
+            crawl_job_id=self.crawl_job_id,
+            dry_run=self.dry_run))
+        if self.crawler.stats:
+            self.crawler.stats.inc_value("work_queue/enrich/put")
+            self.crawler.stats.max_value("work_queue/enrich/max_depth",
+                                         await asyncio.to_thread(self.work_queue.depth, STAGE_ENRICH))
+
+        self.items_processed += 1
+        # Only the current URL, the upload stage counts the processed URLs
+        self.state_helper.publish_progress_update(url)
+
 
 def to_bool(value: str) -> bool:
     """ Converts a string to a bool. Yes, true, t, 1 is True.
@@ -8,6 +8,8 @@ from urllib.parse import urldefrag, urlparse
 import openai
 import scrapy
 import scrapy.signals
+from metadataenricher.rate_limit import (BudgetExhausted, TokenBudget,
+                                         create_chat_completion, shared_limiter)
 from scrapy.crawler import Crawler
 from scrapy.exceptions import CloseSpider
 from scrapy.http.response import Response
@@ -116,6 +118,8 @@ class ExplorationSpider(scrapy.Spider):
         log.info("GENERIC_CRAWLER_LLM_API_BASE_URL: %r", base_url)
         log.info("GENERIC_CRAWLER_LLM_MODEL: %r", self.llm_model)
         self.llm_client = openai.OpenAI(api_key=api_key, base_url=base_url)
+        self.llm_limiter = shared_limiter(self.settings)
+        self.llm_token_budget = TokenBudget(int(self.settings.get('GENERIC_CRAWLER_LLM_TOKEN_BUDGET', 0)))
 
     @classmethod
     def from_crawler(cls, crawler: Crawler, *args, **kwargs):
@@ -187,7 +191,7 @@ class ExplorationSpider(scrapy.Spider):
         log.error("Spider %s encountered an error: %s", spider.name, failure)
         self.state_helper.update_spider_state(spider, 'FAILED')
 
-    def parse(self, response: Response, from_url=None, depth=0):
+    async def parse(self, response: Response, from_url=None, depth=0):
         """
             from_url: the url that linked to this page, None if it is the start page
             respose.request.url: the url of this page
@@ -264,13 +268,24 @@ class ExplorationSpider(scrapy.Spider):
             html = response.text
             query = INFER_HIERARCHY_QUERY + "\n\n" + html
 
-            chat_completion = self.llm_client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": "You are an HTML analysis assistant. You extract structured data from HTML source code. You only report what is actually present in the HTML - never invent or assume content that isn't there."},
-                    {"role": "user", "content": query},
-                ],
-                model=self.llm_model,
-            )
+            try:
+                # The limiter blocks while waiting for capacity, which must not stall the reactor
+                chat_completion = await self.llm_limiter.run(
+                    create_chat_completion, self.llm_client, self.llm_limiter,
+                    messages=[
+                        {"role": "system", "content": "You are an HTML analysis assistant. You extract structured data from HTML source code. You only report what is actually present in the HTML - never invent or assume content that isn't there."},
+                        {"role": "user", "content": query},
+                    ],
+                    model=self.llm_model,
+                    budget=self.llm_token_budget,
+                    stats=self.crawler.stats,
+                )
+            except BudgetExhausted as e:
+                log.warning("%s, not inferring the hierarchy of %s", e, response.request.url)
+                return
+            except openai.RateLimitError:
+                log.error("LLM API rate limit hit, not inferring the hierarchy of %s", response.request.url)
+                return
             llm_response = chat_completion.choices[0].message.content
             assert llm_response is not None
             log.info("Hierarchy inference response: %s", llm_response)
@@ -206,6 +206,24 @@ class StateHelper:
         except (sqlite3.Error, redis.RedisError) as e:
             log.warning("Failed to publish progress update: %s", e)
 
+    def increment_urls_processed(self, current_url: str):
+        """ Adds one to urls_processed of the crawl job and publishes a progress
+            update. Used by the upload stage, which may run in several processes. """
+        if self.dry_run:
+            return
+
+        try:
+            connection = sqlite3.connect(self.settings.get('DB_PATH'))
+            connection.execute(
+                "UPDATE crawls_crawljob SET urls_processed=COALESCE(urls_processed, 0) + 1 WHERE id=?",
+                (self.crawl_job_id,))
+            connection.commit()
+            connection.close()
+        except sqlite3.Error as e:
+            log.warning("Failed to update urls_processed: %s", e)
+            return
+        self.publish_progress_update(current_url)
+
     def spider_opened(self, spider: Spider, start_url: str, follow_links: bool, crawl_type: str):
         if self.dry_run:
             return
@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import socket
+import time
+
+import scrapy.signals
+from scrapy.http import Request
+from scrapy.http.response import Response
+from scrapy.spiders import Spider
+
+from ..items import BaseItem
+from ..work_queue import STAGE_UPLOAD, Task, WorkQueue, open_work_queue, unpack_item
+from .content import ContentSpider, to_bool
+from .state_helper import StateHelper
+
+log = logging.getLogger(__name__)
+
+# Scrapy needs a request to call a callback, this one is answered without network access
+POLL_URL = "data:,"
+
+
+class UploadSpider(Spider):
+    """ Upload stage of content crawls that use a work queue
+        (GENERIC_CRAWLER_WORK_QUEUE). Takes the enriched items from the queue
+        and runs them through the same pipelines as the ContentSpider.
+
+        An item is only removed from the queue after it went through all
+        pipelines (or was dropped by one), so it is uploaded at least once.
+        Processed items are counted in the urls_processed of their crawl job,
+        which is completed by the ContentSpider once its queued pages are done. """
+    name = "content_upload"
+    version = ContentSpider.version
+    custom_settings = {
+        "ITEM_PIPELINES": dict(ContentSpider.custom_settings["ITEM_PIPELINES"]),
+    }
+
+    def __init__(self, idle_timeout: str = "60", batch_size: str = "16", force_update: str = "false",
+                 **kwargs):
+        # The items belong to the "content" source in edu-sharing
+        kwargs.setdefault("name", ContentSpider.name)
+        super().__init__(**kwargs)
+        # Stop after the queue has been empty for this many seconds (0 = never)
+        self.idle_timeout = float(idle_timeout)
+        self.batch_size = int(batch_size)
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}-upload"
+        self.work_queue: WorkQueue | None = None
+        self.crawler_output_node: str | None = None
+        self.dry_run = False
+        # Upload items even if their hash has not changed
+        self.forceUpdate = to_bool(force_update)
+        # Queue tasks of the items that are currently in the pipelines
+        self.pending_tasks: dict[int, Task] = {}
+        # Progress updates of the crawl jobs, by crawl job id
+        self.state_helpers: dict[int, StateHelper] = {}
+        self.idle_since = time.monotonic()
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        # pylint: disable=E1101
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_opened, signal=scrapy.signals.spider_opened)
+        crawler.signals.connect(spider.spider_closed, signal=scrapy.signals.spider_closed)
+        crawler.signals.connect(spider.item_done, signal=scrapy.signals.item_scraped)
+        crawler.signals.connect(spider.item_done, signal=scrapy.signals.item_dropped)
+        crawler.signals.connect(spider.item_error, signal=scrapy.signals.item_error)
+        return spider
+
+    def spider_opened(self, spider: UploadSpider):
+        work_queue_url = self.settings.get('GENERIC_CRAWLER_WORK_QUEUE')
+        if not work_queue_url:
+            raise ValueError("The content_upload spider requires GENERIC_CRAWLER_WORK_QUEUE to be set.")
+        self.work_queue = open_work_queue(
+            work_queue_url, lease=self.settings.getint('GENERIC_CRAWLER_WORK_QUEUE_LEASE'))
+
+    def spider_closed(self, spider: UploadSpider, reason: str):
+        log.info("Closed spider %s, reason: %s", spider.name, reason)
+        if self.pending_tasks:
+            log.warning("%d items were not processed completely, they will be retried",
+                        len(self.pending_tasks))
+        if self.work_queue is not None:
+            self.work_queue.close()
+
+    def start_requests(self):
+        yield self.poll_request()
+
+    def poll_request(self) -> Request:
+        return Request(POLL_URL, callback=self.consume, dont_filter=True, meta={"dont_cache": True})
+
+    async def consume(self, response: Response):  # pylint: disable=unused-argument
+        """ Yields the next batch of items from the queue, followed by the next poll request. """
+        assert self.work_queue is not None
+        # The queue blocks on sqlite locks or the Redis connection, not on the reactor
+        tasks = await asyncio.to_thread(self.get_tasks)
+
+        if self.crawler.stats:
+            self.crawler.stats.max_value("work_queue/upload/max_depth",
+                                         await asyncio.to_thread(self.work_queue.depth, STAGE_UPLOAD))
+
+        if not tasks:
+            if self.idle_timeout and time.monotonic() - self.idle_since > self.idle_timeout:
+                log.info("Work queue has been empty for %ds, stopping", self.idle_timeout)
+                return
+            await asyncio.sleep(1)
+        else:
+            self.idle_since = time.monotonic()
+
+        for task in tasks:
+            item = BaseItem(**unpack_item(task.payload["item"]))
+            self.pending_tasks[id(item)] = task
+            yield item
+        yield self.poll_request()
+
+    def get_tasks(self) -> list[Task]:
+        """ Leases up to batch_size tasks. """
+        assert self.work_queue is not None
+        tasks = []
+        while len(tasks) < self.batch_size:
+            task = self.work_queue.get(STAGE_UPLOAD, self.consumer)
+            if task is None:
+                break
+            tasks.append(task)
+        return tasks
+
+    async def item_done(self, item, response, spider, **kwargs):  # pylint: disable=unused-argument
+        """ Called when an item went through all pipelines, or was dropped. """
+        if task := self.pending_tasks.pop(id(item), None):
+            assert self.work_queue is not None
+            if state_helper := self.get_state_helper(task):
+                state_helper.increment_urls_processed(item.get("sourceId") or "")
+            await asyncio.to_thread(self.work_queue.ack, STAGE_UPLOAD, task.id)
+            if self.crawler.stats:
+                self.crawler.stats.inc_value("work_queue/upload/done")
+
+    def item_error(self, item, response, spider, failure):  # pylint: disable=unused-argument
+        """ Called when a pipeline failed, the item will be retried after the lease expires. """
+        if task := self.pending_tasks.pop(id(item), None):
+            log.error("Failed to upload item (task %s): %s", task.id, failure.getErrorMessage())
+            if self.crawler.stats:
+                self.crawler.stats.inc_value("work_queue/upload/failed")
+
+    def get_state_helper(self, task: Task) -> StateHelper | None:
+        """ Returns the StateHelper of the crawl job the task belongs to. """
+        crawl_job_id = task.payload.get("crawl_job_id")
+        if crawl_job_id is None:
+            return None
+        if crawl_job_id not in self.state_helpers:
+            state_helper = StateHelper(False, task.payload.get("crawler_id"), crawl_job_id)
+            state_helper.setup(self.settings)
+            self.state_helpers[crawl_job_id] = state_helper
+        return self.state_helpers[crawl_job_id]
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from scrapy.settings import Settings
+
+from .enrichment_worker import EnrichmentWorker
+from .items import BaseItem
+from .work_queue import STAGE_ENRICH, STAGE_UPLOAD, SqliteWorkQueue, pack_page
+
+
+class FakeEnricher:
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+
+    def new_token_budget(self):
+        return None
+
+    async def enrich_page(self, url, url_data, inherited_fields=None, **kwargs):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        return BaseItem(sourceId=url, license=inherited_fields)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "queue.sqlite3"), lease=60)
+    yield queue
+    queue.close()
+
+
+def run_until_empty(worker: EnrichmentWorker, queue: SqliteWorkQueue):
+    async def stop():
+        while queue.depth(STAGE_ENRICH):
+            await asyncio.sleep(0.01)
+        worker.stopping = True
+
+    async def run():
+        await asyncio.wait_for(asyncio.gather(worker.run(), stop()), 5)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("max_depth, expected_concurrency", [(0, 3), (2, 2)])
+def test_enriches_pages_concurrently(queue, max_depth, expected_concurrency):
+    for i in range(6):
+        queue.put(STAGE_ENRICH, pack_page(f"https://example.com/{i}", {"html": ""}, source_hash=None,
+                                          ai_enabled=True, inherited_fields={"job": i % 2}))
+    settings = Settings({"GENERIC_CRAWLER_WORK_QUEUE_MAX_DEPTH": max_depth})
+    worker = EnrichmentWorker(queue, settings, "worker", poll=0.01, concurrency=3)
+    enricher = worker.enrichers[True] = FakeEnricher()
+    if max_depth:
+        # Make room in the upload stage as the items arrive
+        original_put = queue.put
+
+        def put(stage, payload):
+            task_id = original_put(stage, payload)
+            if stage == STAGE_UPLOAD:
+                queue.ack(STAGE_UPLOAD, task_id)
+            return task_id
+        queue.put = put
+
+    run_until_empty(worker, queue)
+    # The upload stage has room for `max_depth` items
+    assert enricher.max_running == expected_concurrency
+    if not max_depth:
+        items = [queue.get(STAGE_UPLOAD, "upload").payload["item"] for _ in range(6)]
+        assert [item["license"] for item in items] == [{"job": i % 2} for i in range(6)]
@@ -0,0 +1,177 @@
+import asyncio
+import os
+import time
+
+import pytest
+import redis
+
+from .items import BaseItem
+from .work_queue import (STAGE_ENRICH, STAGE_UPLOAD, RedisWorkQueue, SqliteWorkQueue, open_work_queue,
+                         pack_item, pack_page, unpack_item, unpack_page)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "queue.sqlite3"), lease=60, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_put_get_ack(queue):
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/1"})
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/2"})
+    assert queue.stage_stats(STAGE_ENRICH) == {"queued": 2, "in_flight": 0, "dead": 0}
+
+    task = queue.get(STAGE_ENRICH, "worker-1")
+    assert task.payload == {"url": "https://example.com/1"}
+    assert task.attempts == 1
+    assert queue.stage_stats(STAGE_ENRICH) == {"queued": 1, "in_flight": 1, "dead": 0}
+    assert queue.get(STAGE_UPLOAD, "worker-1") is None
+
+    queue.ack(STAGE_ENRICH, task.id)
+    assert queue.depth(STAGE_ENRICH) == 1
+    assert queue.get(STAGE_ENRICH, "worker-1").payload == {"url": "https://example.com/2"}
+    assert queue.get(STAGE_ENRICH, "worker-1") is None
+
+
+def test_expired_lease_is_redelivered(tmp_path):
+    queue = SqliteWorkQueue(str(tmp_path / "queue.sqlite3"), lease=0.05)
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/1"})
+    task = queue.get(STAGE_ENRICH, "worker-1")
+    assert queue.get(STAGE_ENRICH, "worker-2") is None
+
+    time.sleep(0.1)
+    redelivered = queue.get(STAGE_ENRICH, "worker-2")
+    assert redelivered.id == task.id
+    assert redelivered.attempts == 2
+    queue.close()
+
+
+def test_dead_letter(queue):
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/1"})
+    queue.lease = 0
+    assert queue.get(STAGE_ENRICH, "worker-1") is not None
+    time.sleep(0.01)
+    assert queue.get(STAGE_ENRICH, "worker-1") is not None
+    time.sleep(0.01)
+    # failed max_attempts times
+    assert queue.get(STAGE_ENRICH, "worker-1") is None
+    assert queue.stage_stats(STAGE_ENRICH) == {"queued": 0, "in_flight": 0, "dead": 1}
+
+
+def test_tasks_are_leased_once(tmp_path):
+    path = str(tmp_path / "queue.sqlite3")
+    queues = [SqliteWorkQueue(path) for _ in range(2)]
+    for i in range(10):
+        queues[0].put(STAGE_ENRICH, {"i": i})
+    leased = []
+    while task := queues[len(leased) % 2].get(STAGE_ENRICH, "worker"):
+        leased.append(task.payload["i"])
+    assert sorted(leased) == list(range(10))
+
+
+def test_job_stats(queue):
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/1", "crawl_job_id": 1})
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/2", "crawl_job_id": 1})
+    queue.put(STAGE_ENRICH, {"url": "https://example.com/3", "crawl_job_id": 2})
+    assert queue.job_stats(1) == {"unfinished": 2, "dead": 0}
+
+    # The item moves on to the upload stage
+    task = queue.get(STAGE_ENRICH, "worker")
+    queue.put(STAGE_UPLOAD, {"item": {}, "crawl_job_id": 1})
+    queue.ack(STAGE_ENRICH, task.id)
+    assert queue.job_stats(1) == {"unfinished": 2, "dead": 0}
+    queue.ack(STAGE_UPLOAD, queue.get(STAGE_UPLOAD, "worker").id)
+    assert queue.job_stats(1) == {"unfinished": 1, "dead": 0}
+
+    queue.lease = 0
+    for _ in range(3):
+        queue.get(STAGE_ENRICH, "worker")
+        time.sleep(0.01)
+    assert queue.job_stats(1) == {"unfinished": 0, "dead": 1}
+    assert queue.job_stats(2) == {"unfinished": 1, "dead": 0}
+
+
+def test_wait_for_capacity(queue):
+    def wait(max_depth, timeout):
+        asyncio.run(asyncio.wait_for(queue.wait_for_capacity(STAGE_UPLOAD, max_depth, poll=0.01), timeout))
+
+    queue.put(STAGE_UPLOAD, {})
+    queue.put(STAGE_UPLOAD, {})
+    with pytest.raises(asyncio.TimeoutError):
+        wait(2, 0.05)
+    queue.ack(STAGE_UPLOAD, queue.get(STAGE_UPLOAD, "worker").id)
+    wait(2, 1)
+    # 0 means unlimited
+    queue.put(STAGE_UPLOAD, {})
+    wait(0, 1)
+
+
+def test_pack_page():
+    url_data = {"html": "<html></html>", "url": "https://example.com/", "headers": None,
+                "cookies": None, "har": None, "screenshot_bytes": b"\x89PNG"}
+    payload = pack_page("https://example.com/", url_data, source_hash="abc")
+    assert payload["source_hash"] == "abc"
+    assert unpack_page(payload) == ("https://example.com/", url_data)
+
+
+def test_pack_item():
+    item = BaseItem(sourceId="https://example.com/", hash="abc", screenshot_bytes=b"\x89PNG")
+    assert unpack_item(pack_item(item)) == dict(item)
+
+
+def test_open_work_queue(tmp_path):
+    queue = open_work_queue(f"sqlite://{tmp_path}/queue.sqlite3")
+    assert isinstance(queue, SqliteWorkQueue)
+    queue.close()
+
+
+@pytest.fixture
+def redis_queue():
+    url = os.getenv("REDIS_URL", "redis://localhost:6379/15")
+    queue = RedisWorkQueue(url, prefix=f"test:{os.getpid()}", lease=60, max_attempts=2)
+    try:
+        queue.redis.ping()
+    except redis.ConnectionError:
+        pytest.skip("Redis is not available")
+    yield queue
+    for key in queue.redis.keys(f"{queue.prefix}:*"):
+        queue.redis.delete(key)
+    queue.close()
+
+
+def test_redis_put_get_ack(redis_queue):
+    redis_queue.put(STAGE_ENRICH, {"url": "https://example.com/1"})
+    task = redis_queue.get(STAGE_ENRICH, "worker-1")
+    assert task.payload == {"url": "https://example.com/1"}
+    assert redis_queue.stage_stats(STAGE_ENRICH) == {"queued": 0, "in_flight": 1, "dead": 0}
+    redis_queue.ack(STAGE_ENRICH, task.id)
+    assert redis_queue.depth(STAGE_ENRICH) == 0
+    assert redis_queue.get(STAGE_ENRICH, "worker-1") is None
+
+
+def test_redis_expired_lease_is_redelivered(redis_queue):
+    redis_queue.put(STAGE_ENRICH, {"url": "https://example.com/1"})
+    task = redis_queue.get(STAGE_ENRICH, "worker-1")
+    redis_queue.lease = 0
+    redelivered = redis_queue.get(STAGE_ENRICH, "worker-2")
+    assert redelivered.id == task.id
+    assert redelivered.attempts == 2
+    time.sleep(0.01)
+    assert redis_queue.get(STAGE_ENRICH, "worker-2") is None
+    assert redis_queue.stage_stats(STAGE_ENRICH)["dead"] == 1
+
+
+def test_redis_job_stats(redis_queue):
+    redis_queue.put(STAGE_ENRICH, {"url": "https://example.com/1", "crawl_job_id": 1})
+    redis_queue.put(STAGE_ENRICH, {"url": "https://example.com/2", "crawl_job_id": 1})
+    task = redis_queue.get(STAGE_ENRICH, "worker-1")
+    redis_queue.ack(STAGE_ENRICH, task.id)
+    redis_queue.ack(STAGE_ENRICH, task.id)
+    assert redis_queue.job_stats(1) == {"unfinished": 1, "dead": 0}
+
+    redis_queue.lease = 0
+    for _ in range(3):
+        redis_queue.get(STAGE_ENRICH, "worker-1")
+        time.sleep(0.01)
+    assert redis_queue.job_stats(1) == {"unfinished": 0, "dead": 1}
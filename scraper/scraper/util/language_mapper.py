@@ -1,9 +1,15 @@
+import functools
 import logging
 import re
 
 import babel
 import langcodes
 
+# Most sites use the same few language strings, so the results are memoized
+CACHE_SIZE = 1024
+
+LANGUAGE_CODE_PATTERN = re.compile(r"^(?P<lang_code_1st>\w{2,3})" r"((?P<separator>[_-])(?P<lang_code_2nd>\w{2}))?$")
+
 
 class LanguageMapper:
     """Helper class to detect ISO-639-1 language codes from potentially malformed strings and natural language."""
@@ -12,6 +18,7 @@ class LanguageMapper:
         self.languages = languages
 
     @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
     def _normalize_string_to_language_code(raw_string: str) -> str | None:
         """
         Transform raw string to language code if a mapping was possible. If no mapping was possible, return None.
@@ -22,8 +29,7 @@ class LanguageMapper:
         :param raw_string: a string which might or might not contain a language code
         :return: string of mapped language code (2-letter) or None
         """
-        regex_lang_code = re.compile(r"^(?P<lang_code_1st>\w{2,3})" r"((?P<separator>[_-])(?P<lang_code_2nd>\w{2}))?$")
-        regex_result = regex_lang_code.search(raw_string)
+        regex_result = LANGUAGE_CODE_PATTERN.search(raw_string)
         separator: str | None = None
         if regex_result:
             regex_result_dict = regex_result.groupdict()
@@ -58,6 +64,23 @@ class LanguageMapper:
         else:
             return None
 
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def _find_language_tag(natural_language_string: str) -> str | None:
+        """
+        Returns the language tag that langcodes finds for a language name like "Deutsch" or "english", or None.
+        """
+        try:
+            # using the langcodes Package as a fallback for ambiguous strings
+            # see: https://github.com/rspeer/langcodes/tree/master#recognizing-language-names-in-natural-language
+            langcodes_result: langcodes.Language = langcodes.find(natural_language_string)
+        except LookupError:
+            # if langcodes couldn't find a natural language description, it will throw a LookupError
+            return None
+        if langcodes_result:
+            return langcodes_result.to_tag()
+        return None
+
     def normalize_list_of_language_strings(self) -> list[str] | None:
         """
         Transform list of (raw/potential) language strings into ISO-639-1 normalized 2-letter-codes.
@@ -110,22 +133,18 @@ class LanguageMapper:
                         #     f"(String is too long to be a 2- or 4-letter-code). "
                         #     f"Trying to match natural language string to language code..."
                         # )
-                        try:
-                            langcodes_result: langcodes.Language = langcodes.find(language_item)
-                            # using the langcodes Package as a fallback for ambiguous strings
-                            # see: https://github.com/rspeer/langcodes/tree/master#recognizing-language-names-in-natural-language
-                            if langcodes_result:
-                                langcode_detected = langcodes_result.to_tag()
-                                # logging.debug(
-                                #     f"Detected language code '{langcode_detected}' from string '{language_item}'."
-                                # )
-                                # ToDo - optional: maybe compare distance between 'langcodes' and 'babel' result?
-                                #  see: https://github.com/rspeer/langcodes/tree/master#comparing-and-matching-languages
-                                #
-                                normalized_str: str | None = self._normalize_string_to_language_code(langcode_detected)
-                                normalized_set.add(normalized_str)
-                        except LookupError:
-                            # if langcodes couldn't find a natural language description, it will throw a LookupError
+                        langcode_detected: str | None = self._find_language_tag(language_item)
+                        if langcode_detected:
+                            # logging.debug(
+                            #     f"Detected language code '{langcode_detected}' from string '{language_item}'."
+                            # )
+                            # ToDo - optional: maybe compare distance between 'langcodes' and 'babel' result?
+                            #  see: https://github.com/rspeer/langcodes/tree/master#comparing-and-matching-languages
+                            #
+                            normalized_str: str | None = self._normalize_string_to_language_code(langcode_detected)
+                            normalized_set.add(normalized_str)
+                        else:
+                            # langcodes couldn't find a natural language description,
                             # in that case we can't map the value and add it to our collected edge-cases
                             edge_cases.add(language_item)
 
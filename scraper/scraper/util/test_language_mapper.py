@@ -55,3 +55,11 @@ class TestLanguageMapper:
     def test_normalize_list_of_language_strings(self, test_input, expected_result):
         test_mapper = LanguageMapper(languages=test_input)
         assert test_mapper.normalize_list_of_language_strings() == expected_result
+
+    def test_results_are_memoized(self):
+        LanguageMapper._normalize_string_to_language_code.cache_clear()
+        LanguageMapper._find_language_tag.cache_clear()
+        for _ in range(3):
+            assert LanguageMapper(languages=["de-DE", "Deutsch"]).normalize_list_of_language_strings() == ["de"]
+        assert LanguageMapper._normalize_string_to_language_code.cache_info().misses == 2
+        assert LanguageMapper._find_language_tag.cache_info().misses == 1
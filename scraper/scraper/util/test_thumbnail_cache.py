@@ -0,0 +1,104 @@
+import time
+
+import pytest
+
+from .thumbnail_cache import ThumbnailCache
+from .thumbnails import ThumbnailSettings
+
+THUMBNAIL = {"mimetype": "image/jpeg", "small": "c21hbGw=", "large": "bGFyZ2U="}
+SETTINGS = ThumbnailSettings()
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "thumbnail_cache.sqlite3")
+
+
+def test_url_and_content_lookup(cache_path):
+    cache = ThumbnailCache(cache_path)
+    content_hash = ThumbnailCache.content_hash(b"image", SETTINGS)
+    assert cache.get_by_url("https://example.com/placeholder.png", SETTINGS) is None
+    cache.set(content_hash, THUMBNAIL, url="https://example.com/placeholder.png", settings=SETTINGS)
+    cache.set_url("https://example.com/other.png", SETTINGS, content_hash)
+    cache.close()
+
+    # Shared between crawl jobs
+    cache = ThumbnailCache(cache_path)
+    assert cache.get_by_url("https://example.com/placeholder.png", SETTINGS) == THUMBNAIL
+    assert cache.get_by_url("https://example.com/other.png", SETTINGS) == THUMBNAIL
+    assert cache.get(content_hash) == THUMBNAIL
+    # Thumbnails created with other settings are not used
+    assert cache.get_by_url("https://example.com/placeholder.png", ThumbnailSettings(large_quality=80)) is None
+
+
+def test_settings_are_part_of_hash():
+    assert (ThumbnailCache.content_hash(b"image", ThumbnailSettings())
+            != ThumbnailCache.content_hash(b"image", ThumbnailSettings(small_quality=80)))
+
+
+def test_urls_expire():
+    cache = ThumbnailCache(url_ttl=0.01)
+    cache.set("hash", THUMBNAIL, url="https://example.com/a.png", settings=SETTINGS)
+    time.sleep(0.02)
+    assert cache.get_by_url("https://example.com/a.png", SETTINGS) is None
+    assert cache.get("hash") == THUMBNAIL
+
+
+def test_evicts_least_recently_used(monkeypatch):
+    entry_size = len('{"mimetype": "image/jpeg", "small": "c21hbGw=", "large": "bGFyZ2U="}')
+    cache = ThumbnailCache(max_bytes=2 * entry_size)
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    for name in ("a", "b", "c"):
+        now[0] += 100
+        cache.set(name, THUMBNAIL, url=f"https://example.com/{name}.png", settings=SETTINGS)
+    now[0] += 100
+    cache.get("a")
+    cache.evict()
+    assert cache.size() == 2 * entry_size
+    assert cache.get("b") is None
+    assert cache.get_by_url("https://example.com/b.png", SETTINGS) is None
+    assert cache.get("a") == THUMBNAIL
+    assert cache.get("c") == THUMBNAIL
+
+
+def test_access_time_is_updated_once_per_interval(monkeypatch):
+    cache = ThumbnailCache()
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache.set("a", THUMBNAIL)
+
+    def accessed_at():
+        return cache.connection.execute("SELECT accessed_at FROM thumbnails").fetchone()[0]
+
+    now[0] += 10
+    cache.get("a")
+    assert accessed_at() == 1000.0
+    now[0] += ThumbnailCache.ACCESS_UPDATE_INTERVAL
+    cache.get("a")
+    assert accessed_at() == now[0]
+
+
+def test_get_image():
+    cache = ThumbnailCache()
+    content_hash, thumbnail = cache.get_image(b"image", SETTINGS, "https://example.com/a.png")
+    assert content_hash == ThumbnailCache.content_hash(b"image", SETTINGS)
+    assert thumbnail is None
+    cache.set(content_hash, THUMBNAIL, url="https://example.com/a.png", settings=SETTINGS)
+    # The same image under another URL
+    assert cache.get_image(b"image", SETTINGS, "https://example.com/b.png") == (content_hash, THUMBNAIL)
+    assert cache.get_by_url("https://example.com/b.png", SETTINGS) == THUMBNAIL
+
+
+class Stats(dict):
+    def inc_value(self, key, count=1):
+        self[key] = self.get(key, 0) + count
+
+
+def test_stats():
+    stats = Stats()
+    cache = ThumbnailCache(stats=stats)
+    cache.get_by_url("https://example.com/a.png", SETTINGS)
+    cache.set("hash", THUMBNAIL)
+    cache.get("hash")
+    assert stats == {"thumbnail_cache/url/miss": 1, "thumbnail_cache/content/hit": 1}
@@ -0,0 +1,95 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+from scrapy.exceptions import StopDownload
+from scrapy.http import Headers, Request, Response
+
+from .thumbnail_download import ThumbnailDownloadGuard, download_meta, stopped_reason
+
+
+class Stats(dict):
+    def inc_value(self, key, count=1):
+        self[key] = self.get(key, 0) + count
+
+
+def png_bytes(size: tuple[int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.new("L", size).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def stats():
+    return Stats()
+
+
+@pytest.fixture
+def guard(stats):
+    return ThumbnailDownloadGuard(max_bytes=1000, max_svg_bytes=100, max_pixels=100 * 100, stats=stats)
+
+
+def thumbnail_request():
+    return Request("https://example.com/thumbnail.png", meta=download_meta())
+
+
+def test_stops_non_images(guard, stats):
+    request = thumbnail_request()
+    with pytest.raises(StopDownload):
+        guard.headers_received(Headers({"Content-Type": "text/html; charset=utf-8"}), 500, request, None)
+    response = Response(request.url, request=request, flags=["download_stopped"])
+    assert stopped_reason(response) == "content_type"
+    assert stats == {"thumbnail_download/stopped/content_type": 1, "thumbnail_download/bytes_avoided": 500}
+
+
+def test_stops_on_content_length(guard, stats):
+    request = thumbnail_request()
+    with pytest.raises(StopDownload):
+        guard.headers_received(Headers({"Content-Type": "image/jpeg"}), 5000, request, None)
+    assert request.meta["thumbnail_download"]["stopped"] == "size"
+    assert stats["thumbnail_download/bytes_avoided"] == 5000
+
+
+def test_stops_on_received_bytes(guard, stats):
+    request = thumbnail_request()
+    # No Content-Length
+    guard.headers_received(Headers({"Content-Type": "image/jpeg"}), None, request, None)
+    guard.bytes_received(b"x" * 600, request, None)
+    with pytest.raises(StopDownload):
+        guard.bytes_received(b"x" * 600, request, None)
+    assert request.meta["thumbnail_download"]["stopped"] == "size"
+    assert stats == {"thumbnail_download/stopped/size": 1}
+
+
+def test_svgs_have_their_own_limit(guard):
+    request = thumbnail_request()
+    with pytest.raises(StopDownload):
+        guard.headers_received(Headers({"Content-Type": "image/svg+xml"}), 500, request, None)
+
+
+def test_stops_on_image_dimensions(guard, stats):
+    image = png_bytes((200, 200))
+    request = thumbnail_request()
+    guard.headers_received(Headers({"Content-Type": "image/png"}), None, request, None)
+    with pytest.raises(StopDownload):
+        guard.bytes_received(image[:100], request, None)
+    assert request.meta["thumbnail_download"]["stopped"] == "dimensions"
+
+    image = png_bytes((50, 50))
+    request = thumbnail_request()
+    guard.headers_received(Headers({"Content-Type": "image/png"}), len(image), request, None)
+    guard.bytes_received(image, request, None)
+    response = Response(request.url, request=request, body=image)
+    assert stopped_reason(response) is None
+
+
+def test_ignores_other_requests_and_redirects(guard, stats):
+    request = Request("https://example.com/page.html")
+    guard.headers_received(Headers({"Content-Type": "text/html"}), 5000, request, None)
+    guard.bytes_received(b"x" * 5000, request, None)
+
+    request = thumbnail_request()
+    guard.headers_received(Headers({"Content-Type": "text/html", "Location": "/image.png"}), 5000,
+                           request, None)
+    guard.bytes_received(b"x" * 5000, request, None)
+    assert stats == {}
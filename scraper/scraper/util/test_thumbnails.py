@@ -0,0 +1,48 @@
+import asyncio
+import base64
+from io import BytesIO
+
+from PIL import Image
+
+from .thumbnails import ThumbnailPool, ThumbnailSettings, create_thumbnails, target_size
+
+
+def image_bytes(format: str, size: tuple[int, int], mode: str = "RGB") -> bytes:
+    buffer = BytesIO()
+    Image.new(mode, size, "teal").save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def decode(data: str) -> Image.Image:
+    return Image.open(BytesIO(base64.b64decode(data)))
+
+
+def test_target_size():
+    assert target_size(4000, 3000, 800 * 800) == (923, 692)
+    assert target_size(300, 200, 800 * 800) == (300, 200)
+    assert target_size(100000, 10, 100) == (1000, 1)
+
+
+def test_jpeg_thumbnails():
+    thumbnail = create_thumbnails(image_bytes("JPEG", (4000, 3000)), ThumbnailSettings())
+    assert thumbnail["mimetype"] == "image/jpeg"
+    large = decode(thumbnail["large"])
+    small = decode(thumbnail["small"])
+    assert large.format == small.format == "JPEG"
+    assert large.size == (923, 692)
+    assert small.width * small.height <= 250 * 250
+    assert abs(small.width / small.height - 4 / 3) < 0.01
+
+
+def test_png_thumbnails_have_two_sizes():
+    thumbnail = create_thumbnails(image_bytes("PNG", (2560, 1600), mode="RGBA"))
+    assert thumbnail["mimetype"] == "image/png"
+    assert decode(thumbnail["large"]).size == (800, 500)
+    assert decode(thumbnail["small"]).size == (250, 156)
+
+
+def test_pool_runs_in_thread():
+    pool = ThumbnailPool()
+    thumbnail = asyncio.run(pool.create_thumbnails(image_bytes("GIF", (50, 40))))
+    assert thumbnail["mimetype"] == "image/jpeg"
+    assert decode(thumbnail["large"]).size == (50, 40)
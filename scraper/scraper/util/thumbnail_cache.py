@@ -0,0 +1,193 @@
+""" Persistent, content-addressed cache of the thumbnails created by the
+ProcessThumbnailPipeline.
+
+Many sites use the same placeholder image (e.g. og:image) for thousands of
+pages. The cache maps
+
+- a thumbnail URL (and the thumbnail settings) to the hash of the image it
+  returned, so the image is not downloaded again (for `url_ttl` seconds,
+  since the image behind a URL can change), and
+- the hash of an image to its encoded small and large thumbnails, so an
+  image found under several URLs is scaled only once.
+
+The thumbnails are stored in a sqlite database, so they can be shared
+between crawl jobs and scrapyd processes. If the thumbnails take up more
+than `max_bytes`, the least recently used ones are evicted.
+
+All methods do blocking disk I/O and may wait for the database lock of
+another process, call them outside of the reactor thread (asyncio.to_thread).
+"""
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from .thumbnails import ThumbnailSettings
+
+log = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    # Evict surplus entries every n writes
+    EVICT_EVERY = 100
+    # The access time of a thumbnail is only updated if it is older than
+    # this, so that readers don't have to write (and lock the database) on
+    # every hit
+    ACCESS_UPDATE_INTERVAL = 60.0
+
+    def __init__(self, path: str = ":memory:", max_bytes: int = 500 * 1024 * 1024,
+                 url_ttl: float = 7 * 24 * 60 * 60, stats=None):
+        """ `stats` is a Scrapy-like stats collector. """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.url_ttl = url_ttl
+        self.stats = stats
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnail_urls (
+                url TEXT NOT NULL,
+                settings_digest TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (url, settings_digest)
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS thumbnails (
+                content_hash TEXT PRIMARY KEY,
+                thumbnail TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS thumbnails_accessed_at ON thumbnails (accessed_at)")
+        self.connection.commit()
+        log.info("Opened thumbnail cache at %s (max_bytes=%d)", path, max_bytes)
+
+    @staticmethod
+    def content_hash(image_bytes: bytes, settings: ThumbnailSettings) -> str:
+        """ Returns the key of the thumbnails of an image. The settings are
+            part of it, since they change the thumbnails. """
+        h = hashlib.sha256()
+        h.update(json.dumps(settings).encode())
+        h.update(b"\0")
+        h.update(image_bytes)
+        return h.hexdigest()
+
+    @staticmethod
+    def settings_digest(settings: ThumbnailSettings) -> str:
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def get_by_url(self, url: str, settings: ThumbnailSettings) -> Optional[dict[str, str]]:
+        """ Returns the thumbnails (created with `settings`) of the image last
+            downloaded from `url`. """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT content_hash FROM thumbnail_urls "
+                "WHERE url = ? AND settings_digest = ? AND created_at >= ?",
+                (url, self.settings_digest(settings), time.time() - self.url_ttl)).fetchone()
+            thumbnail = self._get(row[0]) if row is not None else None
+        self._inc_stats("url", thumbnail is not None)
+        return thumbnail
+
+    def get_image(self, image_bytes: bytes, settings: ThumbnailSettings,
+                  url: str) -> tuple[str, Optional[dict[str, str]]]:
+        """ Returns the content hash of an image downloaded from `url`, and
+            its thumbnails if they are cached. On a hit, the image is stored
+            for `url` as well. Hashing a large image takes a while, so it is
+            done here, in the caller's thread. """
+        content_hash = self.content_hash(image_bytes, settings)
+        thumbnail = self.get(content_hash)
+        if thumbnail is not None:
+            # The same image under another URL
+            self.set_url(url, settings, content_hash)
+        return content_hash, thumbnail
+
+    def get(self, content_hash: str) -> Optional[dict[str, str]]:
+        """ Returns the thumbnails of the image with the given hash. """
+        with self._lock:
+            thumbnail = self._get(content_hash)
+        self._inc_stats("content", thumbnail is not None)
+        return thumbnail
+
+    def _get(self, content_hash: str) -> Optional[dict[str, str]]:
+        row = self.connection.execute(
+            "SELECT thumbnail, accessed_at FROM thumbnails WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row is None:
+            return None
+        thumbnail, accessed_at = row
+        now = time.time()
+        if now - accessed_at > self.ACCESS_UPDATE_INTERVAL:
+            self.connection.execute(
+                "UPDATE thumbnails SET accessed_at = ? WHERE content_hash = ?", (now, content_hash))
+            self.connection.commit()
+        return json.loads(thumbnail)
+
+    def set(self, content_hash: str, thumbnail: dict[str, str], url: Optional[str] = None,
+            settings: Optional[ThumbnailSettings] = None):
+        """ Stores the thumbnails of an image, and that `url` returned it. The
+            `settings` the thumbnails were created with are required with `url`. """
+        value = json.dumps(thumbnail)
+        now = time.time()
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO thumbnails (content_hash, thumbnail, size, accessed_at) "
+                "VALUES (?, ?, ?, ?)", (content_hash, value, len(value), now))
+            if url is not None:
+                assert settings is not None
+                self._set_url(url, settings, content_hash, now)
+            self.connection.commit()
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def set_url(self, url: str, settings: ThumbnailSettings, content_hash: str):
+        """ Stores that `url` returned the image with the given hash. """
+        with self._lock:
+            self._set_url(url, settings, content_hash, time.time())
+            self.connection.commit()
+
+    def _set_url(self, url: str, settings: ThumbnailSettings, content_hash: str, now: float):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO thumbnail_urls (url, settings_digest, content_hash, created_at) "
+            "VALUES (?, ?, ?, ?)", (url, self.settings_digest(settings), content_hash, now))
+
+    def evict(self):
+        """ Removes the least recently used thumbnails while they take up
+            more than `max_bytes`, and outdated URLs. """
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # Keep the most recently used thumbnails whose sizes add up to max_bytes
+        surplus = self.connection.execute("""
+            DELETE FROM thumbnails WHERE content_hash IN (
+                SELECT content_hash FROM (
+                    SELECT content_hash, SUM(size) OVER (ORDER BY accessed_at DESC) AS total
+                    FROM thumbnails)
+                WHERE total > ?)""", (self.max_bytes,)).rowcount
+        urls = self.connection.execute(
+            "DELETE FROM thumbnail_urls WHERE created_at < ? "
+            "OR content_hash NOT IN (SELECT content_hash FROM thumbnails)",
+            (time.time() - self.url_ttl,)).rowcount
+        self.connection.commit()
+        if surplus or urls:
+            log.info("Evicted %d thumbnails and %d URLs from the thumbnail cache", surplus, urls)
+
+    def size(self) -> int:
+        """ Returns the size of the stored thumbnails in bytes. """
+        with self._lock:
+            return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM thumbnails").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _inc_stats(self, kind: str, hit: bool):
+        if self.stats is not None:
+            self.stats.inc_value(f"thumbnail_cache/{kind}/{'hit' if hit else 'miss'}")
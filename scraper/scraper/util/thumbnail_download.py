@@ -0,0 +1,118 @@
+""" Early checks of thumbnail downloads.
+
+Thumbnail URLs sometimes point to huge images, videos or HTML pages.
+ThumbnailDownloadGuard looks at a thumbnail download while it is running
+(Scrapy's headers_received and bytes_received signals) and stops it as soon
+as it is clear that the response cannot be used:
+
+- the Content-Type is not an image,
+- the Content-Length, or the bytes received so far, exceed the byte cap,
+- the image header (parsed from the first bytes) declares more pixels than
+  allowed.
+
+Stopped downloads are returned with the "download_stopped" flag, see
+stopped_reason().
+"""
+import logging
+from io import BytesIO
+from typing import Optional
+
+import PIL
+from PIL import Image
+from scrapy.exceptions import StopDownload
+from scrapy.http import Headers, Request
+
+log = logging.getLogger(__name__)
+
+# Marks the requests of thumbnail downloads, see download_meta()
+META_KEY = "thumbnail_download"
+# Give up parsing the image header if it is not complete after this many bytes
+MAX_HEADER_BYTES = 64 * 1024
+
+
+def download_meta() -> dict:
+    """ Returns the meta of a thumbnail download request. """
+    return {META_KEY: {}}
+
+
+def stopped_reason(response) -> Optional[str]:
+    """ Returns why the download of `response` was stopped (e.g. "size"), or None. """
+    state = response.meta.get(META_KEY)
+    if state is None or "download_stopped" not in response.flags:
+        return None
+    return state.get("stopped")
+
+
+def get_content_type(headers: Headers) -> str:
+    content_type = headers.get("Content-Type") or b""
+    return content_type.decode("latin-1").split(";")[0].strip().lower()
+
+
+def read_image_size(prefix: bytes) -> Optional[tuple[int, int]]:
+    """ Returns the size declared in the header of an image file, or None if
+        `prefix` does not contain the complete header (yet). Pillow only
+        reads the header when opening an image. """
+    try:
+        with Image.open(BytesIO(prefix)) as image:
+            return image.size
+    except (PIL.UnidentifiedImageError, OSError, SyntaxError, ValueError):
+        return None
+
+
+class ThumbnailDownloadGuard:
+    def __init__(self, max_bytes: int, max_svg_bytes: int, max_pixels: int, stats=None):
+        """ `stats` is a Scrapy-like stats collector. """
+        self.max_bytes = max_bytes
+        self.max_svg_bytes = max_svg_bytes
+        self.max_pixels = max_pixels
+        self.stats = stats
+
+    def headers_received(self, headers: Headers, body_length: int, request: Request, spider):
+        state = request.meta.get(META_KEY)
+        if state is None or b"Location" in headers:
+            # Redirects are followed, the target is checked when it arrives
+            return
+        content_type = get_content_type(headers)
+        # Unknown if the server did not send a Content-Length
+        state["expected"] = body_length if isinstance(body_length, int) and body_length >= 0 else None
+        state["received"] = 0
+        state["stopped"] = None
+        is_svg = content_type == "image/svg+xml"
+        # SVGs have no pixel size to check
+        state["header"] = None if is_svg else b""
+        state["max_bytes"] = self.max_svg_bytes if is_svg else self.max_bytes
+        if not (content_type.startswith("image/") or content_type == "application/octet-stream"):
+            self.stop(request, "content_type", f"Content-Type {content_type!r} is not an image")
+        if state["expected"] is not None and state["expected"] > state["max_bytes"]:
+            self.stop(request, "size", f"Content-Length {state['expected']} exceeds {state['max_bytes']} bytes")
+
+    def bytes_received(self, data: bytes, request: Request, spider):
+        state = request.meta.get(META_KEY)
+        if state is None or "received" not in state:
+            return
+        state["received"] += len(data)
+        if state["received"] > state["max_bytes"]:
+            self.stop(request, "size", f"More than {state['max_bytes']} bytes received")
+        if state["header"] is None:
+            # The size is already known
+            return
+        state["header"] += data
+        size = read_image_size(state["header"])
+        if size is not None:
+            state["header"] = None
+            if size[0] * size[1] > self.max_pixels:
+                self.stop(request, "dimensions", f"Image of {size[0]}x{size[1]} pixels is too large")
+        elif len(state["header"]) > MAX_HEADER_BYTES:
+            # e.g. SVG, or a format Pillow cannot parse; the byte cap still applies
+            state["header"] = None
+
+    def stop(self, request: Request, reason: str, message: str):
+        state = request.meta[META_KEY]
+        log.info("Stopped thumbnail download of %s: %s", request.url, message)
+        state["stopped"] = reason
+        if self.stats is not None:
+            self.stats.inc_value(f"thumbnail_download/stopped/{reason}")
+            if state["expected"] is not None:
+                self.stats.inc_value("thumbnail_download/bytes_avoided",
+                                     max(0, state["expected"] - state["received"]))
+        raise StopDownload(fail=False)
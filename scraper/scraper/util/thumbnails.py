@@ -0,0 +1,122 @@
+""" Thumbnail generation for the ProcessThumbnailPipeline.
+
+create_thumbnails is a pure function of the image bytes, so it can run in a
+thread or a worker process (see ThumbnailPool) instead of on the reactor
+thread. Decoding and resizing a photo takes tens of milliseconds, during
+which no other request or item would be processed.
+"""
+import asyncio
+import base64
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import NamedTuple, Optional
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+
+class ThumbnailSettings(NamedTuple):
+    # Maximum number of pixels (width * height) of the thumbnails
+    small_size: int = 250 * 250
+    small_quality: int = 40
+    large_size: int = 800 * 800
+    large_quality: int = 60
+
+    @classmethod
+    def from_settings(cls, settings) -> "ThumbnailSettings":
+        return cls(small_size=int(settings.get("THUMBNAIL_SMALL_SIZE")),
+                   small_quality=int(settings.get("THUMBNAIL_SMALL_QUALITY")),
+                   large_size=int(settings.get("THUMBNAIL_LARGE_SIZE")),
+                   large_quality=int(settings.get("THUMBNAIL_LARGE_QUALITY")))
+
+
+def target_size(width: int, height: int, max_pixels: int) -> tuple[int, int]:
+    """ Returns the largest size with the aspect ratio of width x height and
+        at most `max_pixels` pixels. Smaller images keep their size. """
+    if width * height <= max_pixels:
+        return width, height
+    scale = math.sqrt(max_pixels / (width * height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def encode(image: Image.Image, format: str, **params) -> str:
+    buffer = BytesIO()
+    image.save(buffer, format=format, **params)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def create_thumbnails(image_bytes: bytes, settings: ThumbnailSettings = ThumbnailSettings()) -> dict[str, str]:
+    """ Returns the "thumbnail" field of an item (mimetype, and the small and
+        large version as base64) for an image file. The small version is
+        scaled down from the large one. Raises PIL.UnidentifiedImageError if
+        the bytes are not a supported image. """
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == "PNG":
+        # PNG images with image.mode == "RGBA" cannot be converted cleanly to JPEG,
+        # which is why we're handling PNGs separately
+        # ToDo:
+        #  Rework settings.py thumbnail config to retrieve values as width & height instead of sum(int)
+        # The image is not used otherwise, so it can be scaled in place
+        large = image
+        large.thumbnail(size=(800, 800))
+        small = large.copy()
+        small.thumbnail(size=(250, 250))
+        return {"mimetype": "image/png",
+                "small": encode(small, "PNG"),
+                "large": encode(large, "PNG")}
+
+    large_size = target_size(image.width, image.height, settings.large_size)
+    if image.format == "JPEG":
+        # Let the decoder scale the image down by 1/2, 1/4 or 1/8 while decoding
+        # (as far as it stays larger than large_size), instead of decoding the
+        # full resolution
+        image.draft("RGB", large_size)
+    large = image.resize(large_size, Image.Resampling.LANCZOS).convert("RGB")
+    small = large.resize(target_size(large.width, large.height, settings.small_size),
+                         Image.Resampling.LANCZOS)
+    return {"mimetype": "image/jpeg",
+            "small": encode(small, "JPEG", quality=settings.small_quality),
+            "large": encode(large, "JPEG", quality=settings.large_quality)}
+
+
+class ThumbnailPool:
+    """ Runs create_thumbnails outside of the reactor thread: in a thread if
+        `workers` is 0 (Pillow releases the GIL while decoding and resizing),
+        otherwise in a pool of worker processes. """
+
+    def __init__(self, workers: int = 0):
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers > 0 and self._executor is None:
+            log.info("Starting %d thumbnail worker processes", self.workers)
+            # Forking a process with running threads (Twisted, Playwright) is not safe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def create_thumbnails(self, image_bytes: bytes,
+                                settings: ThumbnailSettings = ThumbnailSettings()) -> dict[str, str]:
+        """ See create_thumbnails. """
+        executor = self._get_executor()
+        if executor is None:
+            return await asyncio.to_thread(create_thumbnails, image_bytes, settings)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, create_thumbnails,
+                                                                    image_bytes, settings)
+        except BrokenProcessPool:
+            log.error("Thumbnail worker process died, restarting the pool")
+            self._executor = None
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,316 @@
+""" Durable work queue between the stages of a content crawl.
+
+Rendered pages are put into the "enrich" stage by the ContentSpider, the
+enrichment workers (scraper.enrichment_worker) turn them into items and put
+them into the "upload" stage, which is consumed by the UploadSpider.
+
+Tasks are delivered at least once: a consumer leases a task, and only removes
+it with `ack` after it has been processed completely. If the consumer dies,
+the lease expires and the task is handed out again. Tasks that fail
+`max_attempts` times are moved to the dead letter stage "<stage>/dead".
+
+Payloads with a "crawl_job_id" are counted per crawl job (see job_stats), so
+the ContentSpider can wait until all pages of its job went through the stages.
+
+The methods block (on sqlite locks or on the Redis connection), so call them
+via asyncio.to_thread from the reactor or event loop thread.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import logging
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, NamedTuple, Optional
+
+import redis
+from itemadapter import ItemAdapter
+
+log = logging.getLogger(__name__)
+
+STAGE_ENRICH = "enrich"
+STAGE_UPLOAD = "upload"
+STAGES = [STAGE_ENRICH, STAGE_UPLOAD]
+
+
+class Task(NamedTuple):
+    id: str
+    payload: dict
+    attempts: int
+
+
+class WorkQueue(ABC):
+    def __init__(self, lease: float = 300, max_attempts: int = 5):
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    @abstractmethod
+    def put(self, stage: str, payload: dict) -> str:
+        """ Adds a task to the stage, returns its id. """
+
+    @abstractmethod
+    def get(self, stage: str, consumer: str) -> Optional[Task]:
+        """ Leases the next task of the stage, or returns None if there is none. """
+
+    @abstractmethod
+    def ack(self, stage: str, task_id: str):
+        """ Marks the task as done, it will not be delivered again. """
+
+    @abstractmethod
+    def stage_stats(self, stage: str) -> dict[str, int]:
+        """ Returns the number of queued, in-flight and dead tasks of the stage. """
+
+    @abstractmethod
+    def job_stats(self, crawl_job_id: int) -> dict[str, int]:
+        """ Returns the number of unfinished (queued or in-flight) and dead
+            tasks of the crawl job, over all stages. """
+
+    def depth(self, stage: str) -> int:
+        """ Returns the number of unfinished (queued or in-flight) tasks. """
+        stats = self.stage_stats(stage)
+        return stats["queued"] + stats["in_flight"]
+
+    async def wait_for_capacity(self, stage: str, max_depth: int, poll: float = 1.0):
+        """ Waits until the stage has less than `max_depth` unfinished tasks.
+            Used by producers to apply backpressure. """
+        while max_depth > 0 and await asyncio.to_thread(self.depth, stage) >= max_depth:
+            await asyncio.sleep(poll)
+
+    def close(self):
+        pass
+
+
+class SqliteWorkQueue(WorkQueue):
+    """ Work queue in a local sqlite database, for single-machine setups. """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS work_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                stage TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                consumer TEXT,
+                lease_until REAL,
+                created_at REAL NOT NULL
+            )""")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS work_queue_stage ON work_queue (stage, lease_until)")
+
+    def put(self, stage: str, payload: dict) -> str:
+        with self._lock:
+            cursor = self.connection.execute(
+                "INSERT INTO work_queue (stage, payload, created_at) VALUES (?, ?, ?)",
+                (stage, json.dumps(payload), time.time()))
+            return str(cursor.lastrowid)
+
+    def get(self, stage: str, consumer: str) -> Optional[Task]:
+        with self._lock:
+            while True:
+                now = time.time()
+                # BEGIN IMMEDIATE, so two processes cannot lease the same task
+                self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    row = self.connection.execute(
+                        "SELECT id, payload, attempts FROM work_queue "
+                        "WHERE stage = ? AND (lease_until IS NULL OR lease_until < ?) "
+                        "ORDER BY id LIMIT 1", (stage, now)).fetchone()
+                    if row is None:
+                        self.connection.execute("COMMIT")
+                        return None
+                    task_id, payload, attempts = row
+                    if attempts >= self.max_attempts:
+                        log.error("Task %s in stage %s failed %d times, moving it to %s/dead",
+                                  task_id, stage, attempts, stage)
+                        self.connection.execute(
+                            "UPDATE work_queue SET stage = ?, lease_until = NULL WHERE id = ?",
+                            (f"{stage}/dead", task_id))
+                        self.connection.execute("COMMIT")
+                        continue
+                    self.connection.execute(
+                        "UPDATE work_queue SET attempts = attempts + 1, consumer = ?, lease_until = ? "
+                        "WHERE id = ?", (consumer, now + self.lease, task_id))
+                    self.connection.execute("COMMIT")
+                except BaseException:
+                    self.connection.execute("ROLLBACK")
+                    raise
+                return Task(str(task_id), json.loads(payload), attempts + 1)
+
+    def ack(self, stage: str, task_id: str):
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM work_queue WHERE id = ? AND stage = ?", (int(task_id), stage))
+
+    def stage_stats(self, stage: str) -> dict[str, int]:
+        now = time.time()
+        with self._lock:
+            queued, in_flight = self.connection.execute(
+                "SELECT COALESCE(SUM(lease_until IS NULL OR lease_until < ?), 0), "
+                "       COALESCE(SUM(lease_until >= ?), 0) "
+                "FROM work_queue WHERE stage = ?", (now, now, stage)).fetchone()
+            dead = self.connection.execute(
+                "SELECT COUNT(*) FROM work_queue WHERE stage = ?", (f"{stage}/dead",)).fetchone()[0]
+        return {"queued": queued, "in_flight": in_flight, "dead": dead}
+
+    def job_stats(self, crawl_job_id: int) -> dict[str, int]:
+        stages = ", ".join("?" * len(STAGES))
+        with self._lock:
+            unfinished, dead = self.connection.execute(
+                f"SELECT COALESCE(SUM(stage IN ({stages})), 0), COALESCE(SUM(stage NOT IN ({stages})), 0) "
+                "FROM work_queue WHERE json_extract(payload, '$.crawl_job_id') = ?",
+                (*STAGES, *STAGES, crawl_job_id)).fetchone()
+        return {"unfinished": unfinished, "dead": dead}
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class RedisWorkQueue(WorkQueue):
+    """ Work queue on Redis streams, for workers on several machines.
+
+        Each stage is a stream with one consumer group. Acknowledged tasks are
+        deleted from the stream, so its length is the number of unfinished
+        tasks. Expired leases are taken over with XAUTOCLAIM.
+
+        The crawl job of each task is kept in a hash, and the tasks of a job
+        are counted in another, since the streams cannot be queried by job. """
+
+    GROUP = "workers"
+
+    def __init__(self, url: str, prefix: str = "generic_crawler:queue", **kwargs):
+        super().__init__(**kwargs)
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._groups: set[str] = set()
+
+    def _key(self, stage: str) -> str:
+        return f"{self.prefix}:{stage}"
+
+    def _ensure_group(self, stage: str):
+        if stage in self._groups:
+            return
+        try:
+            self.redis.xgroup_create(self._key(stage), self.GROUP, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._groups.add(stage)
+
+    def _job_key(self, crawl_job_id) -> str:
+        return f"{self.prefix}:job:{crawl_job_id}"
+
+    def put(self, stage: str, payload: dict) -> str:
+        self._ensure_group(stage)
+        task_id = self.redis.xadd(self._key(stage), {"payload": json.dumps(payload)})
+        if (crawl_job_id := payload.get("crawl_job_id")) is not None:
+            pipeline = self.redis.pipeline()
+            pipeline.hset(f"{self.prefix}:task_jobs", f"{stage}:{task_id}", crawl_job_id)
+            pipeline.hincrby(self._job_key(crawl_job_id), "unfinished", 1)
+            pipeline.execute()
+        return task_id
+
+    def get(self, stage: str, consumer: str) -> Optional[Task]:
+        self._ensure_group(stage)
+        key = self._key(stage)
+        while True:
+            # First take over tasks whose lease has expired
+            _, claimed, *_ = self.redis.xautoclaim(
+                key, self.GROUP, consumer, min_idle_time=int(self.lease * 1000), start_id="0-0", count=1)
+            claimed = [(message_id, fields) for message_id, fields in claimed if fields]
+            if claimed:
+                message_id, fields = claimed[0]
+                pending = self.redis.xpending_range(key, self.GROUP, min=message_id, max=message_id, count=1)
+                attempts = pending[0]["times_delivered"] if pending else 1
+                if attempts > self.max_attempts:
+                    log.error("Task %s in stage %s failed %d times, moving it to %s/dead",
+                              message_id, stage, attempts - 1, stage)
+                    self.redis.xadd(self._key(f"{stage}/dead"), fields)
+                    crawl_job_id = self.redis.hget(f"{self.prefix}:task_jobs", f"{stage}:{message_id}")
+                    self.ack(stage, message_id)
+                    if crawl_job_id is not None:
+                        self.redis.hincrby(self._job_key(crawl_job_id), "dead", 1)
+                    continue
+                return Task(message_id, json.loads(fields["payload"]), attempts)
+
+            messages = self.redis.xreadgroup(self.GROUP, consumer, {key: ">"}, count=1)
+            if not messages:
+                return None
+            message_id, fields = messages[0][1][0]
+            return Task(message_id, json.loads(fields["payload"]), 1)
+
+    def ack(self, stage: str, task_id: str):
+        key = self._key(stage)
+        pipeline = self.redis.pipeline()
+        pipeline.xack(key, self.GROUP, task_id)
+        pipeline.xdel(key, task_id)
+        pipeline.execute()
+        task_jobs = f"{self.prefix}:task_jobs"
+        crawl_job_id = self.redis.hget(task_jobs, f"{stage}:{task_id}")
+        # Only count the first ack of a task
+        if crawl_job_id is not None and self.redis.hdel(task_jobs, f"{stage}:{task_id}"):
+            self.redis.hincrby(self._job_key(crawl_job_id), "unfinished", -1)
+
+    def stage_stats(self, stage: str) -> dict[str, int]:
+        self._ensure_group(stage)
+        length = self.redis.xlen(self._key(stage))
+        in_flight = self.redis.xpending(self._key(stage), self.GROUP)["pending"]
+        return {"queued": length - in_flight,
+                "in_flight": in_flight,
+                "dead": self.redis.xlen(self._key(f"{stage}/dead"))}
+
+    def job_stats(self, crawl_job_id: int) -> dict[str, int]:
+        counts = self.redis.hgetall(self._job_key(crawl_job_id))
+        return {"unfinished": int(counts.get("unfinished", 0)), "dead": int(counts.get("dead", 0))}
+
+    def close(self):
+        self.redis.close()
+
+
+def open_work_queue(url: str, **kwargs) -> WorkQueue:
+    """ Opens the work queue at `url`, which is either a redis:// URL or the
+        path of a sqlite database (optionally prefixed with sqlite://). """
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisWorkQueue(url, **kwargs)
+    return SqliteWorkQueue(url.removeprefix("sqlite://"), **kwargs)
+
+
+def pack_page(url: str, url_data: dict, **context) -> dict:
+    """ Converts a rendered page (see get_url_data) into a task payload. """
+    page = dict(url_data)
+    if page.get("screenshot_bytes") is not None:
+        page["screenshot_bytes"] = base64.b64encode(page["screenshot_bytes"]).decode("ascii")
+    return {"url": url, "page": page, **context}
+
+
+def unpack_page(payload: dict) -> tuple[str, dict]:
+    """ Returns the URL and the rendered page of a task payload. """
+    page = dict(payload["page"])
+    if page.get("screenshot_bytes") is not None:
+        page["screenshot_bytes"] = base64.b64decode(page["screenshot_bytes"])
+    return payload["url"], page
+
+
+def pack_item(item: Any) -> dict:
+    """ Converts an item into a JSON-serializable dict. """
+    data = ItemAdapter(item).asdict()
+    if data.get("screenshot_bytes") is not None:
+        data["screenshot_bytes"] = base64.b64encode(data["screenshot_bytes"]).decode("ascii")
+    return data
+
+
+def unpack_item(data: dict) -> dict:
+    """ Reverses pack_item. Nested items are returned as dicts. """
+    data = dict(data)
+    if data.get("screenshot_bytes") is not None:
+        data["screenshot_bytes"] = base64.b64decode(data["screenshot_bytes"])
+    return data
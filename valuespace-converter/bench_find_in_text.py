@@ -0,0 +1,96 @@
+""" Compares Valuespaces.findInText (one compiled regex per vocabulary) with
+the previous implementation (one regex per label and call).
+
+Usage: python bench_find_in_text.py [--repeat N] [vocabulary.json ...]
+If no vocabulary files (e.g. cache/valuespaces/discipline.json) are given, a
+synthetic vocabulary is used.
+"""
+import argparse
+import json
+import random
+import re
+import time
+
+from valuespace_converter.matcher import ConceptMatcher, iter_concepts
+
+# Typical values returned by the LLM, see MetadataEnricher.query_llm
+TEXTS = ["Mathematik", "Geographie", "Deutsch als Fremdsprache", "Sekundarstufe I",
+         "Lehrer/in", "Arbeitsblatt", "Physik, Chemie und Biologie",
+         "Ein Video über die Photosynthese für den Biologieunterricht der Sekundarstufe II"]
+
+
+def legacy_find_in_text(valuespace: list[dict], text: str) -> list[str]:
+    result: set[str] = set()
+    for v in valuespace:
+        labels = list(v["prefLabel"].values())
+        alt_labels = v.get("altLabel", {})
+        for tmp in alt_labels.values():
+            if isinstance(tmp, list):
+                labels.extend(tmp)
+            elif isinstance(tmp, str):
+                labels.append(tmp)
+
+        labels = list(map(lambda x: x.casefold(), labels))
+        for label in labels:
+            if re.search(r"\b" + label + r"\b", text.casefold()):
+                result.add(v["id"])
+                break
+
+        if 'narrower' in v:
+            result.update(legacy_find_in_text(v['narrower'], text))
+
+    return list(result)
+
+
+def synthetic_vocabulary(size: int = 600) -> list[dict]:
+    rng = random.Random(0)
+    syllables = ["ma", "the", "geo", "gra", "phie", "bio", "lo", "gie", "chem", "phy", "sik", "kunst",
+                 "mu", "sik", "spra", "che", "deutsch", "eng", "lisch", "ge", "schich", "te", "po", "li", "tik"]
+
+    def word():
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+
+    def concept(i):
+        return {"id": f"http://w3id.org/openeduhub/vocabs/synthetic/{i}",
+                "prefLabel": {"de": word(), "en": word()},
+                "altLabel": {"de": [f"{word()} {word()}" for _ in range(2)]}}
+
+    tree = []
+    for i in range(0, size, 10):
+        top = concept(i)
+        top["narrower"] = [concept(i + j) for j in range(1, 10)]
+        tree.append(top)
+    return tree
+
+
+def measure(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in TEXTS:
+            func(text)
+    return (time.perf_counter() - start) / (repeat * len(TEXTS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args()
+
+    vocabularies = {name: json.load(open(name, encoding="utf-8"))["hasTopConcept"] for name in args.files}
+    if not vocabularies:
+        vocabularies = {"synthetic": synthetic_vocabulary()}
+
+    for name, tree in vocabularies.items():
+        start = time.perf_counter()
+        matcher = ConceptMatcher(iter_concepts(tree))
+        build = time.perf_counter() - start
+        print(f"{name}: {len(matcher.label_ids)} labels, index built in {build * 1000:.1f} ms")
+        legacy = measure(lambda text: legacy_find_in_text(tree, text), args.repeat)
+        compiled = measure(matcher.find, args.repeat)
+        print(f"  legacy:   {legacy * 1e6:9.1f} µs per call")
+        print(f"  compiled: {compiled * 1e6:9.1f} µs per call ({legacy / compiled:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
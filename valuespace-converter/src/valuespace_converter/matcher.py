@@ -0,0 +1,136 @@
+import bisect
+import re
+from typing import Iterable, Optional
+
+_WORD = re.compile(r"\w")
+
+
+class ConceptMatcher:
+    """ Finds the concepts of a vocabulary whose labels occur in a text.
+
+        All labels are compiled into one regular expression when the matcher
+        is created, so a text is scanned once, instead of once per label.
+        Labels only match as whole words, case-insensitively. """
+
+    def __init__(self, concepts: Iterable[dict]):
+        # casefolded label -> ids of the concepts with this label
+        self.label_ids: dict[str, set[str]] = {}
+        for concept in concepts:
+            for label in concept_labels(concept):
+                label = label.casefold()
+                if label:
+                    self.label_ids.setdefault(label, set()).add(concept["id"])
+
+        # Longest labels first, so the longest label matches at each position.
+        # Shorter labels that match at the same position are found via
+        # `prefix_labels`.
+        labels = sorted(self.label_ids, key=len, reverse=True)
+        self.prefix_labels: dict[str, list[str]] = {
+            label: [label[:i] for i in range(1, len(label))
+                    if _WORD.match(label[i]) is None and label[:i] in self.label_ids]
+            for label in labels
+        }
+        self.regex: Optional[str] = None
+        if labels:
+            alternatives = "|".join(re.escape(label) for label in labels)
+            # A lookahead, so overlapping labels are found as well
+            self.regex = rf"(?<!\w)(?=({alternatives})(?!\w))"
+        self._pattern: Optional[re.Pattern] = None
+
+    def __getstate__(self):
+        # Compiled patterns are pickled as their source anyway, compile them on first use
+        return {**self.__dict__, "_pattern": None}
+
+    @property
+    def pattern(self) -> Optional[re.Pattern]:
+        if self._pattern is None and self.regex is not None:
+            self._pattern = re.compile(self.regex)
+        return self._pattern
+
+    def find(self, text: str) -> set[str]:
+        """ Returns the ids of all concepts with a label in `text`. """
+        result: set[str] = set()
+        pattern = self.pattern
+        if pattern is None:
+            return result
+        found: set[str] = set()
+        for match in pattern.finditer(text.casefold()):
+            label = match.group(1)
+            if label in found:
+                continue
+            found.add(label)
+            result.update(self.label_ids[label])
+            for prefix in self.prefix_labels[label]:
+                if prefix not in found:
+                    found.add(prefix)
+                    result.update(self.label_ids[prefix])
+        return result
+
+
+class ConceptLookup:
+    """ Maps a single value (a concept id, the end of an id, or a label) to
+        the id of the concept it refers to.
+
+        The result is the same as that of scanning the concepts in order and
+        taking the first one whose id ends with the value, or which has the
+        value as a (case-insensitive) label. Labels are looked up in a dict.
+        Id suffixes take a binary search, plus a scan over the k ids that end
+        with the value (O(log n + k)); k is 1 for a complete id or its last
+        path segment. """
+
+    def __init__(self, concepts: Iterable[dict]):
+        # casefolded label -> position of the first concept with this label
+        self.label_positions: dict[str, int] = {}
+        # reversed ids, sorted, so the ids ending with a value are a contiguous range
+        self.reversed_ids: list[tuple[str, int]] = []
+        self.concepts: list[dict] = []
+        for position, concept in enumerate(concepts):
+            self.concepts.append(concept)
+            self.reversed_ids.append((concept["id"][::-1], position))
+            for label in concept_labels(concept):
+                self.label_positions.setdefault(label.casefold(), position)
+        self.reversed_ids.sort()
+
+    def get(self, value: str) -> Optional[str]:
+        """ Returns the id of the concept `value` refers to, or None. """
+        concept = self.find(value)
+        return concept["id"] if concept is not None else None
+
+    def find(self, value: str) -> Optional[dict]:
+        """ Returns the concept `value` refers to, or None. """
+        positions = [self._suffix_position(value), self.label_positions.get(value.casefold())]
+        positions = [position for position in positions if position is not None]
+        if not positions:
+            return None
+        return self.concepts[min(positions)]
+
+    def _suffix_position(self, value: str) -> Optional[int]:
+        """ Returns the position of the first concept whose id ends with
+            `value`. Short values (e.g. "1") can match many ids, which are
+            all scanned. """
+        reversed_value = value[::-1]
+        start = bisect.bisect_left(self.reversed_ids, (reversed_value,))
+        # All reversed ids in [start, end) start with reversed_value
+        end = bisect.bisect_left(self.reversed_ids, (reversed_value + "\U0010ffff",), lo=start)
+        return min((position for _, position in self.reversed_ids[start:end]), default=None)
+
+
+def iter_concepts(tree: list[dict]) -> Iterable[dict]:
+    """ Yields all concepts of a vocabulary tree, including the narrower ones. """
+    for concept in tree:
+        yield concept
+        if "narrower" in concept:
+            yield from iter_concepts(concept["narrower"])
+
+
+def concept_labels(concept: dict) -> list[str]:
+    """ Returns the preferred and alternative labels of a concept, in all languages. """
+    labels = list(concept.get("prefLabel", {}).values())
+    # Since the Skohub update on 2024-04-19, altLabels are a list[str] per language
+    # (see https://github.com/openeduhub/oeh-metadata-vocabs/pull/65)
+    for alt_labels in concept.get("altLabel", {}).values():
+        if isinstance(alt_labels, list):
+            labels.extend(alt_labels)
+        elif isinstance(alt_labels, str):
+            labels.append(alt_labels)
+    return labels
@@ -0,0 +1,135 @@
+""" Precompiled snapshot of all vocabularies and their indexes.
+
+The snapshot is built once (e.g. during the Docker build, with
+`python -m valuespace_converter.valuespaces`) and stored in one file, so
+creating a Valuespaces object does not need to fetch or parse the
+vocabularies. Within a process, the snapshot is loaded only once and shared
+by all Valuespaces objects. If it is older than MAX_AGE, it is still used,
+and refreshed in the background.
+"""
+import logging
+import mmap
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+from .matcher import ConceptLookup, ConceptMatcher
+
+log = logging.getLogger(__name__)
+
+# Increase when the content of the snapshot changes, older snapshots are rebuilt
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_PATH = os.environ.get("VALUESPACES_SNAPSHOT", "cache/valuespaces.snapshot")
+MAX_AGE = 60 * 60 * 24
+# Wait this long before trying again after a failed refresh
+RETRY_INTERVAL = 60 * 10
+
+
+class Snapshot(NamedTuple):
+    format: int
+    created_at: float
+    # vocabulary key -> flattened list of concepts
+    data: dict[str, list[dict]]
+    matchers: dict[str, ConceptMatcher]
+    lookups: dict[str, ConceptLookup]
+
+
+def build_snapshot(urls: dict[str, str], fetch: Callable[[str], dict],
+                   flatten: Callable[[list[dict]], list[dict]]) -> Snapshot:
+    """ Fetches all vocabularies in parallel and builds their indexes. """
+    with ThreadPoolExecutor(max_workers=len(urls) or 1) as executor:
+        vocabularies = dict(zip(urls, executor.map(fetch, urls.values())))
+    data = {key: flatten(vocabulary["hasTopConcept"]) for key, vocabulary in vocabularies.items()}
+    return Snapshot(
+        format=SNAPSHOT_FORMAT,
+        created_at=time.time(),
+        data=data,
+        matchers={key: ConceptMatcher(concepts) for key, concepts in data.items()},
+        lookups={key: ConceptLookup(concepts) for key, concepts in data.items()},
+    )
+
+
+def write_snapshot(snapshot: Snapshot, path: str = SNAPSHOT_PATH):
+    """ Writes the snapshot atomically, so readers never see a partial file. """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path: str = SNAPSHOT_PATH) -> Optional[Snapshot]:
+    """ Returns the snapshot at `path`, or None if there is no usable one. """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            snapshot = pickle.loads(data)
+    except (OSError, ValueError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        log.info("No usable valuespace snapshot at %s: %s", path, e)
+        return None
+    if not isinstance(snapshot, Snapshot) or snapshot.format != SNAPSHOT_FORMAT:
+        log.info("Valuespace snapshot at %s has an old format, ignoring it", path)
+        return None
+    return snapshot
+
+
+def is_stale(snapshot: Snapshot, urls: dict[str, str]) -> bool:
+    return time.time() > snapshot.created_at + MAX_AGE or set(snapshot.data) != set(urls)
+
+
+class SnapshotLoader:
+    """ Holds the snapshot of a process, and refreshes it in the background. """
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self.snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+        self._refresh: Optional[threading.Thread] = None
+        self._last_refresh = 0.0
+
+    def get(self, urls: dict[str, str], fetch: Callable[[str], dict],
+            flatten: Callable[[list[dict]], list[dict]],
+            on_refresh: Callable[[Snapshot], None]) -> Snapshot:
+        """ Returns the snapshot, loading or (if there is none) building it
+            first. `on_refresh` is called with the new snapshot after a
+            background refresh. """
+        with self._lock:
+            if self.snapshot is None:
+                self.snapshot = read_snapshot(self.path)
+            if self.snapshot is None or set(self.snapshot.data) != set(urls):
+                log.info("Building the valuespace snapshot")
+                self.snapshot = build_snapshot(urls, fetch, flatten)
+                self._write(self.snapshot)
+            elif (is_stale(self.snapshot, urls) and self._refresh is None
+                  and time.time() > self._last_refresh + RETRY_INTERVAL):
+                self._last_refresh = time.time()
+                self._refresh = threading.Thread(
+                    target=self._refresh_snapshot, args=(urls, fetch, flatten, on_refresh),
+                    name="valuespace-refresh", daemon=True)
+                self._refresh.start()
+            return self.snapshot
+
+    def _refresh_snapshot(self, urls, fetch, flatten, on_refresh):
+        try:
+            # Another process might have refreshed it already
+            snapshot = read_snapshot(self.path)
+            if snapshot is None or is_stale(snapshot, urls):
+                log.info("Refreshing the valuespace snapshot")
+                snapshot = build_snapshot(urls, fetch, flatten)
+                self._write(snapshot)
+            with self._lock:
+                self.snapshot = snapshot
+            on_refresh(snapshot)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Failed to refresh the valuespace snapshot, using the old one")
+        finally:
+            with self._lock:
+                self._refresh = None
+
+    def _write(self, snapshot: Snapshot):
+        try:
+            write_snapshot(snapshot, self.path)
+        except OSError as e:
+            log.warning("Failed to write the valuespace snapshot to %s: %s", self.path, e)
@@ -0,0 +1,126 @@
+import glob
+import json
+import os
+
+import pytest
+
+from .matcher import ConceptLookup, ConceptMatcher, concept_labels, iter_concepts
+
+VOCABULARY = [
+    {"id": "geography",
+     "prefLabel": {"de": "Geografie", "en": "Geography"},
+     "altLabel": {"de": ["Erdkunde", "Geographie"]}},
+    {"id": "german", "prefLabel": {"de": "Deutsch", "en": "German"},
+     "narrower": [
+         {"id": "german-as-foreign-language", "prefLabel": {"de": "Deutsch als Fremdsprache"},
+          "altLabel": {"de": "DaF"}},
+     ]},
+    {"id": "cpp", "prefLabel": {"de": "C++"}},
+    {"id": "empty", "prefLabel": {"de": ""}},
+    {"id": "geography-2", "prefLabel": {"de": "Erdkunde"}},
+]
+
+
+def find(text: str) -> set[str]:
+    return ConceptMatcher(iter_concepts(VOCABULARY)).find(text)
+
+
+def test_find():
+    assert find("Erdkunde") == {"geography", "geography-2"}
+    assert find("GEOGRAPHY and mathematics") == {"geography"}
+    assert find("Mathematik") == set()
+
+
+def test_whole_words_only():
+    assert find("Geografieunterricht") == set()
+    assert find("Unterricht: Geografie.") == {"geography"}
+
+
+def test_overlapping_labels():
+    assert find("Deutsch als Fremdsprache") == {"german", "german-as-foreign-language"}
+    assert find("Deutsch, Erdkunde und DaF") == {"german", "geography", "geography-2",
+                                                 "german-as-foreign-language"}
+
+
+def test_special_characters():
+    assert find("Programmieren in C++") == {"cpp"}
+    assert find("Programmieren in C") == set()
+
+
+def test_empty():
+    assert ConceptMatcher([]).find("Erdkunde") == set()
+    assert find("") == set()
+
+
+def legacy_lookup(valuespace: list[dict], entry: str):
+    """ The linear scan that ProcessValuespacePipeline used before ConceptLookup. """
+    for v in valuespace:
+        labels = list(v["prefLabel"].values())
+        if "altLabel" in v:
+            for alt_label in v["altLabel"].values():
+                if alt_label and isinstance(alt_label, list):
+                    labels.extend(alt_label)
+                if alt_label and isinstance(alt_label, str):
+                    labels.append(alt_label)
+        labels = list(map(lambda x: x.casefold(), labels))
+        if v["id"].endswith(entry) or entry.casefold() in labels:
+            return v["id"]
+    return None
+
+
+def lookup_values(concepts: list[dict]) -> set[str]:
+    values = {"", "0", "unknown", "Mathe", "http://w3id.org/openeduhub/vocabs/"}
+    for concept in concepts:
+        values.update(concept["id"][-i:] for i in range(1, len(concept["id"]) + 1))
+        for label in concept_labels(concept):
+            values.update([label, label.upper(), label[:-1]])
+    return values
+
+
+VOCABULARY_IDS = [
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/220",
+     "prefLabel": {"de": "Geografie", "en": "Geography"},
+     "altLabel": {"de": ["Erdkunde", "Geographie"]}},
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/380", "prefLabel": {"de": "Mathematik"},
+     "narrower": [{"id": "http://w3id.org/openeduhub/vocabs/discipline/1380", "prefLabel": {"de": "Geometrie"}}]},
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/1380", "prefLabel": {"de": "Geometrie"}},
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/999", "prefLabel": {"de": "380"},
+     "altLabel": {"de": "Sonstiges"}},
+]
+
+
+def test_lookup():
+    lookup = ConceptLookup(VOCABULARY_IDS)
+    assert lookup.get("http://w3id.org/openeduhub/vocabs/discipline/220") == VOCABULARY_IDS[0]["id"]
+    assert lookup.get("220") == VOCABULARY_IDS[0]["id"]
+    assert lookup.get("erdkunde") == VOCABULARY_IDS[0]["id"]
+    # the first concept in order wins
+    assert lookup.get("380") == VOCABULARY_IDS[1]["id"]
+    assert lookup.get("1380") == VOCABULARY_IDS[2]["id"]
+    assert lookup.get("Physik") is None
+
+
+def test_lookup_matches_linear_scan():
+    lookup = ConceptLookup(VOCABULARY_IDS)
+    for value in lookup_values(VOCABULARY_IDS):
+        assert lookup.get(value) == legacy_lookup(VOCABULARY_IDS, value), value
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+# Trimmed copies of real vocabularies (taken from the OEH metadata set in
+# ui/data/mds_oeh.json), and the vocabularies cached by
+# `python -m valuespace_converter.valuespaces`, if any
+@pytest.mark.parametrize("path", [
+    os.path.join(FIXTURES, "discipline.json"),
+    os.path.join(FIXTURES, "educationalContext.json"),
+    os.path.join(FIXTURES, "hochschulfaechersystematik.json"),
+    *sorted(glob.glob("cache/valuespaces/*.json")),
+], ids=os.path.basename)
+def test_lookup_matches_linear_scan_on_vocabularies(path):
+    with open(path, encoding="utf-8") as f:
+        concepts = list(iter_concepts(json.load(f)["hasTopConcept"]))
+    lookup = ConceptLookup(concepts)
+    for value in lookup_values(concepts):
+        assert lookup.get(value) == legacy_lookup(concepts, value), value
@@ -0,0 +1,105 @@
+import pickle
+import time
+
+from . import snapshot as snapshot_module
+from .snapshot import SnapshotLoader, build_snapshot, read_snapshot, write_snapshot
+from .valuespaces import Valuespaces
+
+URLS = {"discipline": "https://example.com/discipline/index.json",
+        "educationalContext": "https://example.com/educationalContext/index.json"}
+VOCABULARIES = {
+    URLS["discipline"]: {"hasTopConcept": [
+        {"id": "http://w3id.org/openeduhub/vocabs/discipline/380", "prefLabel": {"de": "Mathematik"},
+         "narrower": [{"id": "http://w3id.org/openeduhub/vocabs/discipline/1380",
+                       "prefLabel": {"de": "Geometrie"}}]},
+    ]},
+    URLS["educationalContext"]: {"hasTopConcept": [
+        {"id": "http://w3id.org/openeduhub/vocabs/educationalContext/grundschule",
+         "prefLabel": {"de": "Primarstufe"}},
+    ]},
+}
+
+
+def fetch(url: str) -> dict:
+    return VOCABULARIES[url]
+
+
+def fail(url: str) -> dict:
+    raise AssertionError(f"unexpected fetch of {url}")
+
+
+def test_build_snapshot():
+    snapshot = build_snapshot(URLS, fetch, Valuespaces.flatten)
+    assert [c["id"] for c in snapshot.data["discipline"]] == [
+        "http://w3id.org/openeduhub/vocabs/discipline/380", "http://w3id.org/openeduhub/vocabs/discipline/1380"]
+    assert snapshot.matchers["discipline"].find("Geometrie") == {"http://w3id.org/openeduhub/vocabs/discipline/1380"}
+    assert snapshot.lookups["educationalContext"].get("grundschule") == \
+        "http://w3id.org/openeduhub/vocabs/educationalContext/grundschule"
+
+
+def test_write_and_read(tmp_path):
+    path = str(tmp_path / "valuespaces.snapshot")
+    assert read_snapshot(path) is None
+    write_snapshot(build_snapshot(URLS, fetch, Valuespaces.flatten), path)
+    snapshot = read_snapshot(path)
+    assert snapshot.matchers["discipline"].find("Mathematik") == {"http://w3id.org/openeduhub/vocabs/discipline/380"}
+
+
+def test_read_invalid(tmp_path, monkeypatch):
+    path = tmp_path / "valuespaces.snapshot"
+    path.write_bytes(b"not a pickle")
+    assert read_snapshot(str(path)) is None
+    write_snapshot(build_snapshot(URLS, fetch, Valuespaces.flatten), str(path))
+    monkeypatch.setattr(snapshot_module, "SNAPSHOT_FORMAT", snapshot_module.SNAPSHOT_FORMAT + 1)
+    assert read_snapshot(str(path)) is None
+
+
+def test_loader_builds_missing_snapshot(tmp_path):
+    path = str(tmp_path / "valuespaces.snapshot")
+    snapshot = SnapshotLoader(path).get(URLS, fetch, Valuespaces.flatten, on_refresh=print)
+    assert set(snapshot.data) == set(URLS)
+    # Other processes read the snapshot without fetching anything
+    assert SnapshotLoader(path).get(URLS, fail, Valuespaces.flatten, on_refresh=print).data == snapshot.data
+
+
+def test_loader_refreshes_stale_snapshot(tmp_path):
+    path = str(tmp_path / "valuespaces.snapshot")
+    stale = build_snapshot(URLS, fetch, Valuespaces.flatten)._replace(created_at=time.time() - 2 * snapshot_module.MAX_AGE)
+    write_snapshot(stale, path)
+    refreshed = []
+    loader = SnapshotLoader(path)
+    # The stale snapshot is returned right away
+    assert loader.get(URLS, fetch, Valuespaces.flatten, refreshed.append).created_at == stale.created_at
+    loader._refresh.join(timeout=5)
+    assert len(refreshed) == 1
+    assert refreshed[0].created_at > stale.created_at
+    assert read_snapshot(path).created_at == refreshed[0].created_at
+
+
+def test_matcher_pickles_without_compiled_pattern():
+    matcher = build_snapshot(URLS, fetch, Valuespaces.flatten).matchers["discipline"]
+    assert matcher.find("Mathematik")
+    copy = pickle.loads(pickle.dumps(matcher))
+    assert copy._pattern is None
+    assert copy.find("Mathematik") == matcher.find("Mathematik")
+
+
+def legacy_flatten(tree):
+    result = tree
+    for leaf in tree:
+        if "narrower" in leaf:
+            result.extend(legacy_flatten(leaf["narrower"]))
+    return result
+
+
+def test_flatten():
+    tree = [
+        {"id": "a", "narrower": [{"id": "a1", "narrower": [{"id": "a11"}]}, {"id": "a2"}]},
+        {"id": "b", "narrower": [{"id": "b1"}]},
+    ]
+    flat = Valuespaces.flatten(tree)
+    assert [c["id"] for c in flat] == ["a", "b", "a1", "a2", "a11", "b1"]
+    # same order as the previous, in-place implementation, but without modifying the tree
+    assert len(tree) == 2 and len(tree[0]["narrower"]) == 2
+    legacy_ids = [c["id"] for c in legacy_flatten(pickle.loads(pickle.dumps(tree)))]
+    assert [c["id"] for c in flat] == list(dict.fromkeys(legacy_ids))
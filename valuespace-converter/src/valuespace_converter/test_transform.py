@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+flask = pytest.importorskip("flask")
+flask_restful = pytest.importorskip("flask_restful")
+
+from . import transform  # noqa: E402  pylint: disable=wrong-import-position
+from .test_valuespaces import valuespaces  # noqa: F401  pylint: disable=unused-import
+
+
+@pytest.fixture
+def client(valuespaces, monkeypatch):  # pylint: disable=redefined-outer-name
+    monkeypatch.setattr(transform, "get_valuespaces", lambda: valuespaces)
+    app = flask.Flask(__name__)
+    api = flask_restful.Api(app)
+    api.add_resource(transform.Transform, "/transform")
+    api.add_resource(transform.TransformBatch, "/transform/batch")
+    return app.test_client()
+
+
+def test_transform(client):  # pylint: disable=redefined-outer-name
+    response = client.post("/transform", json={"discipline": ["Erdkunde"]})
+    assert response.get_json() == {"discipline": [
+        {"key": "http://w3id.org/openeduhub/vocabs/discipline/220", "de": "Geografie", "en": "Geography"}]}
+
+
+def test_transform_batch(client):  # pylint: disable=redefined-outer-name
+    documents = [{"discipline": ["Erdkunde"]}, {"unknown": ["x"]}, {"discipline": ["380"]}]
+    # Each streamed response is consumed before the next request, so that
+    # the request contexts are popped in order
+    for kwargs in [
+        {"json": documents},
+        {"data": "\n".join(json.dumps(d) for d in documents), "content_type": "application/x-ndjson"},
+    ]:
+        response = client.post("/transform/batch", **kwargs)
+        assert response.mimetype == "application/x-ndjson"
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(lines) == 3
+        assert lines[0]["discipline"][0]["de"] == "Geografie"
+        assert "error" in lines[1]
+        assert lines[2]["discipline"][0]["de"] == "Mathematik"
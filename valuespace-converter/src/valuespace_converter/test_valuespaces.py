@@ -0,0 +1,43 @@
+import pytest
+
+from .snapshot import build_snapshot
+from .valuespaces import Valuespaces
+
+URL = "https://example.com/discipline/index.json"
+DISCIPLINE = {"hasTopConcept": [
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/220",
+     "prefLabel": {"de": "Geografie", "en": "Geography"},
+     "altLabel": {"de": ["Erdkunde", "Geographie"]}},
+    {"id": "http://w3id.org/openeduhub/vocabs/discipline/380", "prefLabel": {"de": "Mathematik"}},
+]}
+
+
+@pytest.fixture
+def valuespaces(monkeypatch):
+    snapshot = build_snapshot({"discipline": URL}, lambda url: DISCIPLINE, Valuespaces.flatten)
+    monkeypatch.setattr(Valuespaces, "data", snapshot.data)
+    monkeypatch.setattr(Valuespaces, "matchers", snapshot.matchers)
+    monkeypatch.setattr(Valuespaces, "lookups", snapshot.lookups)
+    return object.__new__(Valuespaces)
+
+
+def test_transform_document(valuespaces):
+    document = {"discipline": ["erdkunde", "220", "380", "Physik"]}
+    assert valuespaces.transformDocument(document) == {"discipline": [
+        {"key": "http://w3id.org/openeduhub/vocabs/discipline/220", "de": "Geografie", "en": "Geography"},
+        {"key": "http://w3id.org/openeduhub/vocabs/discipline/380", "de": "Mathematik"},
+    ]}
+    # the document itself is not modified
+    assert document == {"discipline": ["erdkunde", "220", "380", "Physik"]}
+
+
+def test_transform_document_without_matches(valuespaces):
+    assert valuespaces.transformDocument({"discipline": ["Physik"]}) == {}
+    with pytest.raises(KeyError):
+        valuespaces.transformDocument({"unknown": ["Physik"]})
+
+
+def test_lookup_and_find_in_text(valuespaces):
+    assert valuespaces.lookup("discipline", "Geographie") == "http://w3id.org/openeduhub/vocabs/discipline/220"
+    assert set(valuespaces.findInText("discipline", "Mathematik und Erdkunde")) == {
+        "http://w3id.org/openeduhub/vocabs/discipline/220", "http://w3id.org/openeduhub/vocabs/discipline/380"}
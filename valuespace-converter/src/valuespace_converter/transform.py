@@ -1,46 +1,63 @@
+""" REST resources of the valuespace converter.
+
+    api.add_resource(Transform, "/transform")
+    api.add_resource(TransformBatch, "/transform/batch")
+"""
+import functools
+import json
 import logging
 
-from flask import request
+from flask import Response, request, stream_with_context
 from flask_restful import Resource
-from valuespaces import Valuespaces
+
+from .valuespaces import Valuespaces
+
+log = logging.getLogger(__name__)
+
+
+@functools.cache
+def get_valuespaces() -> Valuespaces:
+    """ The vocabularies are loaded once per worker process, not per request. """
+    return Valuespaces()
 
 
 class Transform(Resource):
-    def __init__(self):
-        self.valuespaces = Valuespaces()
+    """ Maps one valuespace document, e.g. {"discipline": ["Mathematik"]},
+        to the i18n layout. """
 
     def post(self):
-        json = request.get_json(force=True)
-        delete = []
-        for key in json:
-            # remap to new i18n layout
-            mapped = []
-            for entry in json[key]:
-                i18n = {}
-                valuespace = self.valuespaces.data[key]
-                found = False
-                for v in valuespace:
-                    labels = list(v["prefLabel"].values())
-                    if "altLabel" in v:
-                        labels += list(v["altLabel"].values())
-                    labels = list(map(lambda x: x.casefold(), labels))
-                    if v["id"].endswith(entry) or entry.casefold() in labels:
-                        i18n["key"] = v["id"]
-                        i18n["de"] = v["prefLabel"]["de"]
-                        try:
-                            i18n["en"] = v["prefLabel"]["en"]
-                        except KeyError:
-                            logging.debug(f"Valuespace transformer: No English 'prefLabel' for {i18n['de']} available.")
-                            pass
-                        found = True
-                        break
-                if found and len(list(filter(lambda x: x["key"] == i18n["key"], mapped))) == 0:
-                    mapped.append(i18n)
-            if len(mapped):
-                json[key] = mapped
-            else:
-                delete.append(key)
-        for key in delete:
-            del json[key]
-
-        return json
+        return get_valuespaces().transformDocument(request.get_json(force=True))
+
+
+class TransformBatch(Resource):
+    """ Maps several valuespace documents, sent either as a JSON list or as
+        newline-delimited JSON (application/x-ndjson). The results are
+        streamed back as newline-delimited JSON, one line per document, in
+        the same order. Documents that cannot be mapped result in an
+        {"error": ...} line. """
+
+    def post(self):
+        if request.mimetype == "application/x-ndjson":
+            documents = (json.loads(line) for line in request.stream if line.strip())
+        else:
+            documents = iter(request.get_json(force=True))
+        valuespaces = get_valuespaces()
+
+        def generate():
+            while True:
+                try:
+                    document = next(documents)
+                except StopIteration:
+                    return
+                except json.JSONDecodeError as e:
+                    # The rest of the body cannot be parsed reliably
+                    yield json.dumps({"error": f"Invalid JSON: {e}"}) + "\n"
+                    return
+                try:
+                    result = valuespaces.transformDocument(document)
+                except (KeyError, TypeError, AttributeError) as e:
+                    log.warning("Failed to transform %r: %r", document, e)
+                    result = {"error": f"Cannot transform document: {e!r}"}
+                yield json.dumps(result) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
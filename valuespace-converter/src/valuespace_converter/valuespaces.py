@@ -1,13 +1,20 @@
 import json
 import logging
 import os
-import re
 import time
+from typing import Optional
 
 import requests
 
+from .matcher import ConceptLookup, ConceptMatcher, iter_concepts
+from .snapshot import Snapshot, SnapshotLoader, build_snapshot, write_snapshot
+
 log = logging.getLogger(__name__)
 
+# Shared by all Valuespaces objects of the process
+_snapshot_loader = SnapshotLoader()
+
+
 class Valuespaces:
     idsVocabs = [
         "conditionsOfAccess",
@@ -24,29 +31,41 @@ class Valuespaces:
     ]
     idsW3ID = ["containsAdvertisement", "price", "accessibilitySummary", "dataProtectionConformity", "fskRating"]
     data = {}
+    # Compiled label index of each vocabulary, see findInText
+    matchers: dict[str, ConceptMatcher] = {}
+    # Label and id index of each vocabulary, see lookup
+    lookups: dict[str, ConceptLookup] = {}
 
     def __init__(self):
-        vocab_list: list[dict] = []
-        # one singular dictionary in the vocab list will typically look like this:
-        # {'key': 'discipline', 'url': 'https://vocabs.openeduhub.de/w3id.org/openeduhub/vocabs/discipline/index.json'}
-        for v in self.idsVocabs:
-            vocab_list.append(
-                {"key": v, "url": "https://vocabs.openeduhub.de/w3id.org/openeduhub/vocabs/" + v + "/index.json"}
-            )
-        for v in self.idsW3ID:
-            vocab_list.append({"key": v, "url": "http://w3id.org/openeduhub/vocabs/" + v + "/index.json"})
-        for vocab_name in vocab_list:
-            # try:
-            voc = getVocabulary(vocab_name["url"])
-            self.data[vocab_name["key"]] = self.flatten(voc["hasTopConcept"])
-            # except:
-            #    self.valuespaces[v] = {}
-
-    def flatten(self, tree: []):
-        result = tree
+        snapshot = _snapshot_loader.get(self.vocabularyUrls(), getVocabulary, self.flatten, self.useSnapshot)
+        self.useSnapshot(snapshot)
+
+    @classmethod
+    def vocabularyUrls(cls) -> dict[str, str]:
+        # one entry will typically look like this:
+        # 'discipline': 'https://vocabs.openeduhub.de/w3id.org/openeduhub/vocabs/discipline/index.json'
+        urls = {}
+        for v in cls.idsVocabs:
+            urls[v] = "https://vocabs.openeduhub.de/w3id.org/openeduhub/vocabs/" + v + "/index.json"
+        for v in cls.idsW3ID:
+            urls[v] = "http://w3id.org/openeduhub/vocabs/" + v + "/index.json"
+        return urls
+
+    @classmethod
+    def useSnapshot(cls, snapshot: Snapshot):
+        # The dicts are shared by all instances, so they see refreshed data as well
+        cls.data.update(snapshot.data)
+        cls.matchers.update(snapshot.matchers)
+        cls.lookups.update(snapshot.lookups)
+
+    @staticmethod
+    def flatten(tree: list[dict]) -> list[dict]:
+        """ Returns all concepts of the tree: the concepts of each level,
+            followed by the (flattened) narrower concepts of each concept. """
+        result = list(tree)
         for leaf in tree:
             if "narrower" in leaf:
-                result.extend(self.flatten(leaf["narrower"]))
+                result.extend(Valuespaces.flatten(leaf["narrower"]))
         return result
 
     @staticmethod
@@ -62,34 +81,40 @@ class Valuespaces:
                     return found
         return None
 
+    def lookup(self, valuespaceId: str, value: str) -> Optional[str]:
+        """ Returns the id of the concept that `value` refers to, either by (the
+            end of) its id or by one of its labels. """
+        return self.lookups[valuespaceId].get(value)
+
+    def transformDocument(self, document: dict[str, list[str]]) -> dict[str, list[dict]]:
+        """ Maps the values of each valuespace in `document` (see lookup) to
+            {"key": id, "de": label, "en": label} entries. Valuespaces
+            without any known value are left out. """
+        result = {}
+        for valuespaceId, values in document.items():
+            lookup = self.lookups[valuespaceId]
+            mapped = {}
+            for value in values:
+                concept = lookup.find(value)
+                if concept is None or concept["id"] in mapped:
+                    continue
+                i18n = {"key": concept["id"], "de": concept["prefLabel"]["de"]}
+                if "en" in concept["prefLabel"]:
+                    i18n["en"] = concept["prefLabel"]["en"]
+                else:
+                    log.debug("Valuespace transformer: No English 'prefLabel' for %s available.", i18n["de"])
+                mapped[concept["id"]] = i18n
+            if mapped:
+                result[valuespaceId] = list(mapped.values())
+        return result
+
     def findInText(self, valuespaceId: str, text: str, valuespace = None) -> list[str]:
+        """ Returns the ids of all concepts whose labels occur in `text` as whole words. """
         if valuespace is None:
-            valuespace: list[dict] = self.data[valuespaceId]
-
-        result: set[str] = set()
-        for v in valuespace:
-            # Example:
-            # {'id': 'http://w3id.org/openeduhub/vocabs/discipline/220',
-            #  'prefLabel': {'de': 'Geografie', 'en': 'Geography'},
-            #  'altLabel': {'de': ['Erdkunde', 'Geographie']}}
-            labels = list(v["prefLabel"].values())
-            alt_labels = v.get("altLabel", {})
-            for tmp in alt_labels.values():
-                if isinstance(tmp, list):
-                    labels.extend(tmp)
-                elif isinstance(tmp, str):
-                    labels.append(tmp)
-
-            labels = list(map(lambda x: x.casefold(), labels))
-            for label in labels:
-                if re.search(r"\b" + label + r"\b", text.casefold()):
-                    result.add(v["id"])
-                    break
-
-            if 'narrower' in v:
-                result.update(self.findInText(valuespaceId, text, v['narrower']))
-
-        return list(result)
+            matcher = self.matchers[valuespaceId]
+        else:
+            matcher = ConceptMatcher(iter_concepts(valuespace))
+        return list(matcher.find(text))
 
     def initTree(self, tree):
         for t in tree:
@@ -142,6 +167,6 @@ def getVocabulary(url: str):
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
-    log.info("Populating valuespace cache")
-    valuespaces = Valuespaces()
+    log.info("Building the valuespace snapshot")
+    write_snapshot(build_snapshot(Valuespaces.vocabularyUrls(), getVocabulary, Valuespaces.flatten))
     log.info("Done")